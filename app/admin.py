@@ -1,5 +1,5 @@
 from django.contrib import admin
-from app.models import Course, Part, User, Rating, Review, Comment, Lecture, Video, Tags
+from app.models import Course, Part, User, Rating, Review, Comment, Lecture, Video, Tag, CourseTag, MediaJob, RequestStats
 # Register your models here.
 admin.site.register(Part)
 admin.site.register(Course)
@@ -9,4 +9,7 @@ admin.site.register(Rating)
 admin.site.register(Review)
 admin.site.register(Lecture)
 admin.site.register(Video)
-admin.site.register(Tags)
\ No newline at end of file
+admin.site.register(Tag)
+admin.site.register(CourseTag)
+admin.site.register(MediaJob)
+admin.site.register(RequestStats)
\ No newline at end of file
@@ -0,0 +1,49 @@
+"""Cached category navigation.
+
+The category list with course counts is rendered on almost every page, so
+it is cached per language under a version number. Saving or deleting a
+Course or Part bumps the version (see app.signals), which retires every
+cached copy at once instead of deleting keys language by language. The
+version and the lists live in the SHARED_CACHE_ALIAS cache, so a bump in
+one process reaches every other.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count
+from django.utils.translation import get_language
+
+from app.models import Part
+
+VERSION_KEY = 'categories:version'
+
+
+def shared_cache():
+    return caches[settings.SHARED_CACHE_ALIAS]
+
+
+def get_version():
+    cache = shared_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = 1
+        cache.add(VERSION_KEY, version, timeout=None)
+    return version
+
+
+def bump_version():
+    cache = shared_cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, timeout=None)
+
+
+def get_categories():
+    """Return every Part annotated with ``course_count``, from cache when possible."""
+    cache = shared_cache()
+    key = f'categories:{get_version()}:{get_language()}'
+    parts = cache.get(key)
+    if parts is None:
+        parts = list(Part.objects.annotate(course_count=Count('parts')).order_by('id'))
+        cache.set(key, parts, settings.CATEGORY_CACHE_TIMEOUT)
+    return parts
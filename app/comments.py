@@ -0,0 +1,75 @@
+"""Course discussions: threaded comments and reviews.
+
+Both are shown a page at a time. detail renders the first page, and the
+rest is fetched from the course_comments/course_reviews fragment views as
+the list scrolls into view. A page of comments costs two queries whatever
+the thread sizes: the top-level comments, then every reply under them
+through ``Comment.root``, hung under their parents in Python. A page of
+reviews also costs two: the reviews with their authors, then their
+ratings. Render a comment with the ``comment_thread`` tag from
+comment_tags.
+"""
+from django.db.models import Prefetch
+from django.urls import reverse
+from django.utils.http import urlencode
+
+from app.models import Comment, Rating, Review
+from app.pagination import CursorPaginator
+
+COMMENTS_PER_PAGE = 10
+REVIEWS_PER_PAGE = 10
+
+
+def attach_replies(comments):
+    """Load the replies of the top-level ``comments`` in one query and nest them.
+
+    Each comment gets ``thread_replies``, its replies oldest first with
+    their own ``thread_replies``, ``depth``, 0 for top-level comments, and
+    ``reply_count``, the number of replies below it at any depth.
+    """
+    comments = list(comments)
+    by_id = {comment.id: comment for comment in comments}
+    replies = list(Comment.objects.filter(root__in=comments).select_related('user').order_by('created_at', 'id'))
+    by_id.update((reply.id, reply) for reply in replies)
+    for comment in by_id.values():
+        comment.thread_replies = []
+    for reply in replies:
+        by_id[reply.parent_id].thread_replies.append(reply)
+
+    def walk(comment, depth):
+        comment.depth = depth
+        comment.reply_count = sum(walk(reply, depth + 1) + 1 for reply in comment.thread_replies)
+        return comment.reply_count
+
+    for comment in comments:
+        walk(comment, 0)
+    return comments
+
+
+def fragment_url(name, course_id, page):
+    """URL of the fragment view holding the page after ``page``, or None on the last page."""
+    if not page.next_cursor:
+        return None
+    return f"{reverse(name, args=[course_id])}?{urlencode({'cursor': page.next_cursor})}"
+
+
+def comment_page(course_id, cursor=None):
+    top_level = Comment.objects.filter(course_id=course_id, parent=None).select_related('user')
+    page = CursorPaginator(top_level, COMMENTS_PER_PAGE).page(cursor)
+    page.object_list = attach_replies(page.object_list)
+    page.next_url = fragment_url('course_comments', course_id, page)
+    return page
+
+
+def review_page(course_id, cursor=None):
+    """A page of reviews with their authors and ratings, in two queries.
+
+    Each review gets ``stars``, the star strings of its ratings.
+    """
+    ratings = Prefetch('rating_set', queryset=Rating.objects.only('id', 'review_id', 'rating').order_by('id'))
+    reviews = Review.objects.filter(course_id=course_id).select_related('user').prefetch_related(ratings)
+    page = CursorPaginator(reviews, REVIEWS_PER_PAGE).page(cursor)
+    for review in page.object_list:
+        review.stars = review.get_all_users_ratings_as_stars()
+    page.next_url = fragment_url('course_reviews', course_id, page)
+    return page
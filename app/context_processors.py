@@ -0,0 +1,5 @@
+from app.categories import get_categories
+
+
+def categories(request):
+    return {'parts': get_categories()}
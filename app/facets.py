@@ -0,0 +1,130 @@
+"""Facet counts for course search.
+
+One grouped query counts the matching courses per combination of part,
+free/paid, level and rating bucket. Every facet's counts are then summed
+from those rows in Python, applying the other facets' selected filters
+but not its own. That way a facet shows what each of its options would
+give, whatever else is selected. The rows depend only on the search
+query, so they are cached per normalized query and language. The filters
+are applied after the cache.
+
+The rows live in the SHARED_CACHE_ALIAS cache under the category version
+and a facet version that rating and tag changes bump (see app.signals),
+so every process sees a change at once.
+"""
+import hashlib
+
+from django.conf import settings
+from django.db.models import Case, Count, F, IntegerField, Value, When
+from django.utils.translation import get_language
+
+from app.categories import get_categories, get_version, shared_cache
+from app.search import TOKEN_RE
+
+# Rating filter options: average of at least this many stars.
+RATING_THRESHOLDS = (4, 3, 2, 1)
+VERSION_KEY = 'facets:version'
+
+
+def get_facets_version():
+    cache = shared_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = 1
+        cache.add(VERSION_KEY, version, timeout=None)
+    return version
+
+
+def bump_facets_version():
+    cache = shared_cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, timeout=None)
+
+
+def normalize_query(query):
+    """Lowercased unique words in sorted order: every word must match, so order is irrelevant."""
+    return ' '.join(sorted(set(TOKEN_RE.findall(query.lower()))))
+
+
+def facet_rows(queryset):
+    """Count ``queryset`` per (part_id, is_free, level, rating bucket) in one query."""
+    rows = (
+        queryset.order_by()
+        .annotate(
+            is_free=Case(When(price=0, then=Value(1)), default=Value(0), output_field=IntegerField()),
+            # Whole stars of the average rating, 0 when unrated.
+            rating_bucket=Case(
+                When(rating_count=0, then=Value(0)),
+                default=F('rating_sum') / F('rating_count'),
+                output_field=IntegerField(),
+            ),
+        )
+        .values('part_id', 'is_free', 'level', 'rating_bucket')
+        .annotate(n=Count('id'))
+    )
+    return [(r['part_id'], bool(r['is_free']), r['level'], r['rating_bucket'], r['n']) for r in rows]
+
+
+def cached_facet_rows(queryset, query):
+    cache = shared_cache()
+    digest = hashlib.md5(normalize_query(query).encode()).hexdigest()
+    key = f'facets:{get_version()}:{get_facets_version()}:{get_language()}:{digest}'
+    rows = cache.get(key)
+    if rows is None:
+        rows = facet_rows(queryset)
+        cache.set(key, rows, settings.SEARCH_FACETS_CACHE_TIMEOUT)
+    return rows
+
+
+def filter_courses(queryset, category=None, price_level=None, skill_level=None, rating=None):
+    if category:
+        queryset = queryset.filter(part__slug=category)
+    if price_level == 'Free':
+        queryset = queryset.filter(price=0)
+    elif price_level == 'Paid':
+        queryset = queryset.exclude(price=0)
+    if skill_level:
+        queryset = queryset.filter(level=skill_level)
+    if rating:
+        queryset = queryset.filter(rating_count__gt=0, rating_sum__gte=F('rating_count') * int(rating))
+    return queryset
+
+
+def facet_counts(queryset, query, selected):
+    """Return {facet: {option: count}} for the courses of ``queryset`` matching ``query``.
+
+    ``selected`` holds the chosen filters (CourseSearchForm.cleaned_data).
+    """
+    slugs = {part.id: part.slug for part in get_categories()}
+    category = selected.get('category') or None
+    price_level = selected.get('price_level') or None
+    skill_level = selected.get('skill_level') or None
+    rating = int(selected.get('rating') or 0)
+
+    counts = {'category': {}, 'price_level': {'Free': 0, 'Paid': 0}, 'skill_level': {}, 'rating': {}}
+    for part_id, is_free, level, bucket, n in cached_facet_rows(queryset, query):
+        slug = slugs.get(part_id)
+        price = 'Free' if is_free else 'Paid'
+        matches = {
+            'category': category is None or slug == category,
+            'price_level': price_level is None or price == price_level,
+            'skill_level': skill_level is None or level == skill_level,
+            'rating': bucket >= rating,
+        }
+
+        def others_match(facet):
+            return all(ok for name, ok in matches.items() if name != facet)
+
+        if others_match('category'):
+            counts['category'][slug] = counts['category'].get(slug, 0) + n
+        if others_match('price_level'):
+            counts['price_level'][price] += n
+        if others_match('skill_level'):
+            counts['skill_level'][level] = counts['skill_level'].get(level, 0) + n
+        if others_match('rating'):
+            for threshold in RATING_THRESHOLDS:
+                if bucket >= threshold:
+                    counts['rating'][threshold] = counts['rating'].get(threshold, 0) + n
+    return counts
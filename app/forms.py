@@ -1,5 +1,7 @@
 from django import forms
+from django.urls import reverse_lazy
 from app.models import *
+from app.categories import get_categories
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 
 class RatingReviewForm(forms.ModelForm):
@@ -134,17 +136,37 @@ class CourseSearchForm(forms.Form):
         ('Advanced', 'Advanced'),
     ]
 
+    RATING_CHOICES = [
+        ('', 'Any rating'),
+        ('4', '4 & up'),
+        ('3', '3 & up'),
+        ('2', '2 & up'),
+        ('1', '1 & up'),
+    ]
+
     price_level = forms.ChoiceField(choices=PRICE_LEVEL_CHOICES, required=False)
     skill_level = forms.ChoiceField(choices=SKILL_LEVEL_CHOICES, required=False)
+    rating = forms.ChoiceField(choices=RATING_CHOICES, required=False)
 
     def __init__(self, *args, **kwargs):
         super(CourseSearchForm, self).__init__(*args, **kwargs)
 
-        parts = Part.objects.all()
+        parts = get_categories()
         part_choices = [('', 'All')]
         part_choices.extend([(part.slug, part.name) for part in parts])
         attrs = {'class': 'form-select form-select-sm js-choice', 'aria-label': '.form-select-sm example'}
         self.fields['category'] = forms.ChoiceField(choices=part_choices, required=False, widget=forms.Select(attrs=attrs))
+        for name in ('price_level', 'skill_level', 'rating'):
+            self.fields[name].widget.attrs.update(attrs)
+
+    def set_facet_counts(self, counts):
+        """Append the number of matching courses to every option label."""
+        for name, field_counts in counts.items():
+            field = self.fields[name]
+            field.choices = [
+                (value, label if value == '' else f"{label} ({field_counts.get(int(value) if name == 'rating' else value, 0)})")
+                for value, label in field.choices
+            ]
         
 class CourseForm(forms.ModelForm):
     name = forms.CharField(
@@ -205,7 +227,15 @@ class VideoForm(forms.ModelForm):
         model = Video
         fields = ['file']
         widgets = {
-            'file': forms.FileInput(attrs={'accept': 'video/mp4,video/webm,video/ogg', 'class' : 'form-control'}),
+            'file': forms.FileInput(attrs={
+                'accept': 'video/mp4,video/webm,video/ogg',
+                'class' : 'form-control',
+                'data-chunked-upload': '',
+                'data-init-url': reverse_lazy('upload_init'),
+                'data-chunk-url': reverse_lazy('upload_chunk', args=[0]),
+                'data-complete-url': reverse_lazy('upload_complete', args=[0]),
+                'data-course-input': 'upload_course',
+            }),
         }
 
 class LectureForm(forms.ModelForm):
@@ -0,0 +1,121 @@
+"""Cached fragments of the course detail page.
+
+The parts of detail.html that look the same to every visitor (title and
+stats, teacher card, rating summary, tags) are cached as rendered HTML,
+and the syllabus as data, keyed on the course id, its ``upload_at``, the
+language and a per-course content version. Saving the course moves
+``upload_at``; changes to what hangs off it (lectures, videos, tags,
+ratings, students, the teacher) bump the version, see app.signals.
+Per-visitor parts such as watch progress and the follow button are
+rendered on every request.
+
+A version bump in one process, the media worker included, has to reach
+every other, so fragments live in the FRAGMENT_CACHE_ALIAS cache, which
+must be shared. With a per-process backend such as LocMemCache, fragment
+caching is turned off rather than serving pages that never refresh.
+
+Hits and misses are counted per fragment in this process, see
+``fragment_stats``.
+"""
+import logging
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import get_language
+
+logger = logging.getLogger(__name__)
+
+HIT = 'hit'
+MISS = 'miss'
+
+# Backends whose entries only this process sees.
+PER_PROCESS_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+metrics = Counter()
+metrics_lock = threading.Lock()
+warned = False
+
+
+def fragment_cache():
+    """Return the fragment cache, or None when it is not shared between processes."""
+    global warned
+    alias = settings.FRAGMENT_CACHE_ALIAS
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if backend is None or backend in PER_PROCESS_BACKENDS:
+        if not warned:
+            warned = True
+            logger.warning("Fragment caching is off: the %r cache is not shared between processes.", alias)
+        return None
+    return caches[alias]
+
+
+def version_key(course_id):
+    return f'course:{course_id}:version'
+
+
+def get_content_version(course_id):
+    cache = caches[settings.FRAGMENT_CACHE_ALIAS]
+    version = cache.get(version_key(course_id))
+    if version is None:
+        version = 1
+        cache.add(version_key(course_id), version, timeout=None)
+    return version
+
+
+def bump_content_version(course_ids):
+    cache = fragment_cache()
+    if cache is None:
+        return
+    for course_id in set(course_ids):
+        try:
+            cache.incr(version_key(course_id))
+        except ValueError:
+            cache.add(version_key(course_id), 1, timeout=None)
+
+
+def fragment_key(name, course):
+    # One version lookup per course object, however many fragments it has.
+    if not hasattr(course, 'content_version'):
+        course.content_version = get_content_version(course.id)
+    return (
+        f'fragment:{name}:{course.id}:{course.upload_at.timestamp()}:'
+        f'{get_language()}:{course.content_version}'
+    )
+
+
+def record(name, outcome):
+    with metrics_lock:
+        metrics[name, outcome] += 1
+
+
+def cached_fragment(name, course, render):
+    """Return the cached value of fragment ``name`` of ``course``, calling ``render()`` on a miss."""
+    cache = fragment_cache()
+    if cache is None:
+        return render()
+    key = fragment_key(name, course)
+    value = cache.get(key)
+    if value is not None:
+        record(name, HIT)
+        return value
+    record(name, MISS)
+    logger.debug("Fragment cache miss: %s", key)
+    value = render()
+    cache.set(key, value, settings.FRAGMENT_CACHE_TIMEOUT)
+    return value
+
+
+def fragment_stats():
+    """Return {fragment: {'hits', 'misses', 'hit_rate'}} for this process."""
+    with metrics_lock:
+        counts = dict(metrics)
+    stats = {}
+    for name in sorted({name for name, _ in counts}):
+        hits, misses = counts.get((name, HIT), 0), counts.get((name, MISS), 0)
+        stats[name] = {'hits': hits, 'misses': misses, 'hit_rate': round(hits / (hits + misses), 3)}
+    return stats
@@ -0,0 +1,217 @@
+"""Typo-tolerant matching of course names across scripts.
+
+Course names are folded to one Latin skeleton (Cyrillic transliterated
+the Uzbek way, apostrophes dropped, k/q and h/x/kh merged), so "Дастурлаш",
+"dasturlash" and "dasturlah" all look alike. The skeletons go into an
+in-process trigram index. A query collects candidates that share enough
+trigrams with it and reranks them by edit distance. Like app.suggest,
+the index is built on first use, patched by signals and rebuilt in a
+background thread once it is FUZZY_INDEX_MAX_AGE seconds old.
+"""
+import heapq
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+CYRILLIC_TO_LATIN = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo', 'ж': 'j', 'з': 'z',
+    'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r',
+    'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'x', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sh',
+    'ъ': '', 'ы': 'i', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya', 'ў': 'o', 'қ': 'q', 'ғ': 'g',
+    'ҳ': 'h',
+}
+# Spellings that differ between Uzbek Latin, Russian and English transliterations.
+LATIN_FOLDS = [('kh', 'h'), ('x', 'h'), ('q', 'k'), ('w', 'v')]
+APOSTROPHES_RE = re.compile(r"['`ʻʼ‘’]")
+NON_WORD_RE = re.compile(r'[^a-z0-9]+')
+
+# A candidate must share this share of the query's trigrams.
+MIN_OVERLAP = 0.3
+CANDIDATES = 100
+MIN_SIMILARITY = 0.5
+
+
+def fold(text):
+    """Map ``text`` in either script to its lowercase Latin skeleton."""
+    text = ''.join(CYRILLIC_TO_LATIN.get(c, c) for c in text.casefold())
+    text = unicodedata.normalize('NFKD', APOSTROPHES_RE.sub('', text))
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    for source, target in LATIN_FOLDS:
+        text = text.replace(source, target)
+    return NON_WORD_RE.sub(' ', text).strip()
+
+
+def trigrams(skeleton):
+    grams = set()
+    for word in skeleton.split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def edit_distance(a, b):
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def similarity(query, skeleton):
+    """1.0 for an exact match, falling with the edit distance.
+
+    A query shorter than the name is compared with the run of name words of
+    the same length that fits it best, so "python" matches "python django".
+    """
+    words = skeleton.split()
+    width = len(query.split())
+    windows = {' '.join(words[i:i + width]) for i in range(max(1, len(words) - width + 1))}
+    windows.add(skeleton)
+    best = 0.0
+    for window in windows:
+        distance = edit_distance(query, window)
+        best = max(best, 1 - distance / max(len(query), len(window)))
+    return best
+
+
+class FuzzyIndex:
+    def __init__(self):
+        self.postings = defaultdict(list)
+        self.docs = {}
+
+    def add(self, pk, names):
+        skeletons = {fold(name) for name in names if name}
+        skeletons.discard('')
+        grams = set().union(*(trigrams(s) for s in skeletons)) if skeletons else set()
+        self.docs[pk] = (skeletons, grams)
+        for gram in grams:
+            self.postings[gram].append(pk)
+
+    def remove(self, pk):
+        doc = self.docs.pop(pk, None)
+        if doc is None:
+            return
+        for gram in doc[1]:
+            posting = self.postings[gram]
+            posting.remove(pk)
+            if not posting:
+                del self.postings[gram]
+
+    def search(self, query, limit):
+        """Return up to ``limit`` (pk, similarity) pairs, best first."""
+        skeleton = fold(query)
+        grams = trigrams(skeleton)
+        if not grams:
+            return []
+        overlap = Counter()
+        for gram in grams:
+            overlap.update(self.postings.get(gram, ()))
+        needed = max(1, int(len(grams) * MIN_OVERLAP))
+        candidates = heapq.nlargest(
+            CANDIDATES, (item for item in overlap.items() if item[1] >= needed), key=lambda item: item[1]
+        )
+        scored = []
+        for pk, _ in candidates:
+            score = max(similarity(skeleton, s) for s in self.docs[pk][0])
+            if score >= MIN_SIMILARITY:
+                scored.append((score, pk))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [(pk, score) for score, pk in scored[:limit]]
+
+
+def course_names(course):
+    return [course.name] + [getattr(course, f'name_{code}') for code, _ in settings.LANGUAGES]
+
+
+class CourseNames:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()
+        self.index = None
+        self.built_at = 0
+        self.rebuilding = False
+        # Updates made while a rebuild runs, replayed onto the new index before it is swapped in.
+        self.missed = []
+
+    def build(self):
+        from app.models import Course
+
+        index = FuzzyIndex()
+        fields = ['name'] + [f'name_{code}' for code, _ in settings.LANGUAGES]
+        for row in Course.objects.values_list('id', *fields).iterator():
+            index.add(row[0], row[1:])
+        return index
+
+    def get_index(self):
+        if self.index is None:
+            # Nothing to serve yet, so the first build is waited for, once.
+            with self.build_lock:
+                if self.index is None:
+                    index = self.build()
+                    with self.lock:
+                        self.index, self.built_at = index, time.monotonic()
+        elif time.monotonic() - self.built_at > settings.FUZZY_INDEX_MAX_AGE:
+            self.start_rebuild()
+        return self.index
+
+    def start_rebuild(self):
+        with self.lock:
+            if self.rebuilding:
+                return
+            self.rebuilding = True
+        thread = threading.Thread(target=self.rebuild, daemon=True)
+        thread.start()
+
+    def rebuild(self):
+        """Build a fresh index and swap it in, from the rebuild thread."""
+        try:
+            index = self.build()
+            with self.lock:
+                for pk, names in self.missed:
+                    self.apply(index, pk, names)
+                self.index = index
+        except Exception:
+            logger.exception("Could not rebuild the course name index")
+        finally:
+            with self.lock:
+                # A failed rebuild is retried once the index is FUZZY_INDEX_MAX_AGE old again.
+                self.built_at = time.monotonic()
+                self.rebuilding = False
+                self.missed = []
+            # The rebuild thread's connection is not closed by the request cycle.
+            connection.close()
+
+    def search(self, query, limit):
+        index = self.get_index()
+        with self.lock:
+            return [pk for pk, _ in index.search(query, limit)]
+
+    def update(self, pk, names):
+        """Replace one course's names; None removes it."""
+        if self.index is None:
+            return
+        with self.lock:
+            self.apply(self.index, pk, names)
+            if self.rebuilding:
+                self.missed.append((pk, names))
+
+    @staticmethod
+    def apply(index, pk, names):
+        index.remove(pk)
+        if names is not None:
+            index.add(pk, names)
+
+
+course_names_index = CourseNames()
@@ -0,0 +1,203 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from app.fragments import bump_content_version
+from app.media import (
+    HLS_MASTER_PLAYLIST, IMAGE_FORMATS, IMAGE_WIDTHS, evict_derivatives, extract_poster, make_derivative, package_hls,
+    transcode_for_web,
+)
+from app.models import MediaJob, Video
+
+logger = logging.getLogger(__name__)
+
+RETRY_DELAY = timedelta(seconds=30)
+# A running job touches its row this often, so only jobs whose worker died look stale.
+HEARTBEAT_INTERVAL = 60
+STALE_AFTER = timedelta(minutes=10)
+# The derivative cache is trimmed at most this often per worker, in seconds.
+EVICTION_INTERVAL = 60
+last_eviction = 0.0
+
+
+def probe(video):
+    video.update_metadata()
+
+
+def poster(video):
+    if video.poster:
+        return
+    at = min(1.0, (video.duration or 0) / 2)
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, f'{video.pk}.jpg')
+        extract_poster(video.file.path, output, at=at)
+        with open(output, 'rb') as f:
+            video.poster.save(os.path.basename(output), File(f), save=False)
+    Video.objects.filter(pk=video.pk).update(poster=video.poster.name)
+    images(video.poster.name)
+
+
+def transcode(video):
+    name = os.path.splitext(os.path.basename(video.file.name))[0] + '.mp4'
+    previous = video.web_file.name
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, name)
+        # One encoder thread per job, so the number of workers is the number of busy cores.
+        transcode_for_web(video.file.path, output, threads=1)
+        with open(output, 'rb') as f:
+            video.web_file.save(name, File(f), save=False)
+    Video.objects.filter(pk=video.pk).update(web_file=video.web_file.name)
+    if previous and previous != video.web_file.name:
+        video.web_file.storage.delete(previous)
+
+
+def hls(video):
+    storage = Video.file.field.storage
+    output_dir = storage.path(video.hls_dir)
+    # Package next to the final directory and swap it in, so players never see a half-written ladder.
+    building_dir = output_dir + '.tmp'
+    shutil.rmtree(building_dir, ignore_errors=True)
+    package_hls(video.file.path, building_dir)
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.rename(building_dir, output_dir)
+    video.hls_playlist = f'{video.hls_dir}/{HLS_MASTER_PLAYLIST}'
+    Video.objects.filter(pk=video.pk).update(hls_playlist=video.hls_playlist)
+
+
+def images(name):
+    """Encode every derivative of a stored image, then trim the derivative cache if it is due."""
+    global last_eviction
+    for width in IMAGE_WIDTHS:
+        for fmt in IMAGE_FORMATS:
+            make_derivative(default_storage, name, width, fmt)
+    if time.monotonic() - last_eviction > EVICTION_INTERVAL:
+        last_eviction = time.monotonic()
+        evict_derivatives(default_storage, settings.IMAGE_DERIVATIVES_MAX_BYTES)
+
+
+HANDLERS = {
+    MediaJob.PROBE: probe,
+    MediaJob.POSTER: poster,
+    MediaJob.TRANSCODE: transcode,
+    MediaJob.HLS: hls,
+    MediaJob.IMAGES: images,
+}
+
+
+def claim_next_job():
+    """Atomically move the oldest runnable job to RUNNING and return it.
+
+    Jobs other than PROBE wait until their video's PROBE job is done, since
+    the poster and the ladder need the duration and dimensions it stores.
+    """
+    now = timezone.now()
+    unprobed = MediaJob.objects.filter(video_id=OuterRef('video_id'), kind=MediaJob.PROBE).exclude(status=MediaJob.DONE)
+    candidates = (
+        MediaJob.objects.filter(status=MediaJob.PENDING, run_after__lte=now)
+        .filter(Q(kind=MediaJob.PROBE) | ~Exists(unprobed))
+        .values_list('id', flat=True)[:10]
+    )
+    for job_id in candidates:
+        claimed = MediaJob.objects.filter(id=job_id, status=MediaJob.PENDING).update(
+            status=MediaJob.RUNNING,
+            attempts=F('attempts') + 1,
+            updated_at=now,
+        )
+        if claimed:
+            return MediaJob.objects.select_related('video').get(id=job_id)
+    return None
+
+
+def heartbeat(job_id, stop):
+    """Touch a running job every HEARTBEAT_INTERVAL seconds until ``stop`` is set."""
+    try:
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            MediaJob.objects.filter(id=job_id, status=MediaJob.RUNNING).update(updated_at=timezone.now())
+    finally:
+        # The heartbeat thread's connection is not closed by anything else.
+        connection.close()
+
+
+def run_job(job):
+    stop = threading.Event()
+    beat = threading.Thread(target=heartbeat, args=(job.id, stop), daemon=True)
+    beat.start()
+    try:
+        # Image jobs work on a stored image name, every other kind on its video.
+        HANDLERS[job.kind](job.image if job.kind == MediaJob.IMAGES else job.video)
+    except Exception as e:
+        logger.error(f"Media job {job} failed: {str(e)}")
+        job.error = str(e)
+        if job.attempts < job.max_attempts:
+            job.status = MediaJob.PENDING
+            job.run_after = timezone.now() + RETRY_DELAY * 2 ** (job.attempts - 1)
+        else:
+            job.status = MediaJob.FAILED
+    else:
+        job.status = MediaJob.DONE
+        job.error = ''
+    finally:
+        stop.set()
+        beat.join()
+    saved = MediaJob.objects.filter(pk=job.pk).update(
+        status=job.status, error=job.error, run_after=job.run_after, updated_at=timezone.now(),
+    )
+    if not saved:
+        # The video, and its jobs with it, was deleted while the job ran.
+        return
+    if job.kind == MediaJob.PROBE and job.status == MediaJob.FAILED:
+        # The jobs waiting for the probe would never run.
+        MediaJob.objects.filter(video_id=job.video_id, status=MediaJob.PENDING).exclude(kind=MediaJob.PROBE).update(
+            status=MediaJob.FAILED, error='The video could not be probed.',
+        )
+    update_video_status(job.video_id)
+
+
+def update_video_status(video_id):
+    if video_id is None:
+        return
+    statuses = set(MediaJob.objects.filter(video_id=video_id).values_list('status', flat=True))
+    if statuses & {MediaJob.PENDING, MediaJob.RUNNING}:
+        return
+    status = Video.FAILED if MediaJob.FAILED in statuses else Video.READY
+    Video.objects.filter(pk=video_id).update(processing_status=status)
+    bump_content_version(Video.objects.filter(pk=video_id).values_list('course_id', flat=True))
+
+
+def requeue_stale_jobs():
+    """Give jobs left RUNNING by a worker that died another chance.
+
+    Running jobs are touched every HEARTBEAT_INTERVAL seconds, so a job is
+    only stale once nothing has touched it for STALE_AFTER.
+    """
+    return MediaJob.objects.filter(
+        status=MediaJob.RUNNING,
+        updated_at__lt=timezone.now() - STALE_AFTER,
+    ).update(status=MediaJob.PENDING)
+
+
+def work(poll_interval=2.0, once=False):
+    """Process jobs until the queue is empty (``once``) or forever."""
+    while True:
+        job = claim_next_job()
+        if job is None:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+        try:
+            run_job(job)
+        except Exception:
+            # Left RUNNING, the job is requeued once it is stale; the worker goes on with the next one.
+            logger.exception("Media job %s could not be finished", job)
@@ -0,0 +1,51 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
+
+from django.core.management.base import BaseCommand
+
+from app.fragments import bump_content_version
+from app.media import probe_video
+from app.models import Video
+
+
+class Command(BaseCommand):
+    help = "Probe stored video files and save their duration, resolution, codec, bitrate and size."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--all', action='store_true', help="Re-probe videos that already have metadata.")
+
+    def handle(self, *args, **options):
+        videos = Video.objects.exclude(file='')
+        if not options['all']:
+            videos = videos.filter(duration__isnull=True)
+        videos = list(videos.values_list('id', 'file'))
+
+        if not videos:
+            self.stdout.write("No videos to backfill.")
+            return
+
+        done = failed = 0
+        # Probing is ffmpeg-bound, so threads are enough to run it in parallel;
+        # rows are written one by one from this thread and only touch metadata columns.
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {
+                executor.submit(probe_video, Video.file.field.storage.path(name)): pk
+                for pk, name in videos
+            }
+            for future in as_completed(futures):
+                pk = futures[future]
+                try:
+                    metadata = future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"Video {pk}: {e}")
+                    continue
+                Video.objects.filter(pk=pk).update(**metadata)
+                done += 1
+
+        # Durations are shown in the cached course syllabus.
+        course_ids = Video.objects.filter(pk__in=[pk for pk, _ in videos]).values_list('course_id', flat=True)
+        bump_content_version(course_ids)
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {done} videos, {failed} failed."))
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app.models import VideoUpload
+
+
+class Command(BaseCommand):
+    help = "Delete abandoned chunked uploads and their part files."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int, default=settings.CHUNKED_UPLOAD_EXPIRE_AFTER,
+                            help="Seconds an unfinished upload may go untouched.")
+
+    def handle(self, *args, **options):
+        uploads, orphans = VideoUpload.expire(options['max_age'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Expired {uploads} uploads and removed {orphans} orphaned part files."
+        ))
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from app.media import evict_derivatives, make_derivatives
+from app.models import Course, User, Video
+
+
+class Command(BaseCommand):
+    help = "Generate responsive derivatives for existing images and trim the derivative cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--evict-only', action='store_true', help="Only trim the cache.")
+        parser.add_argument('--max-bytes', type=int, default=settings.IMAGE_DERIVATIVES_MAX_BYTES)
+
+    def handle(self, *args, **options):
+        if not options['evict_only']:
+            sources = [
+                (Course.objects.exclude(image=''), 'image'),
+                (User.objects.exclude(avatar='').exclude(avatar__isnull=True), 'avatar'),
+                (Video.objects.exclude(poster=''), 'poster'),
+            ]
+            done = failed = 0
+            for queryset, field in sources:
+                for obj in queryset.only('pk', field):
+                    try:
+                        make_derivatives(getattr(obj, field))
+                        done += 1
+                    except Exception as e:
+                        failed += 1
+                        self.stderr.write(f"{obj._meta.model_name} {obj.pk}: {e}")
+            self.stdout.write(f"Generated derivatives for {done} images, {failed} failed.")
+
+        removed = evict_derivatives(default_storage, options['max_bytes'])
+        self.stdout.write(self.style.SUCCESS(f"Evicted {removed} cached derivatives."))
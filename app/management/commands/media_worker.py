@@ -0,0 +1,47 @@
+import multiprocessing
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from app import jobs
+
+
+def run_worker(poll_interval, once):
+    # Every process opens its own database connection.
+    connections.close_all()
+    jobs.work(poll_interval=poll_interval, once=once)
+
+
+class Command(BaseCommand):
+    help = "Run worker processes that probe, extract posters and transcode uploaded videos and encode image derivatives."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                            help="Number of worker processes, one job each (default: one per CPU core).")
+        parser.add_argument('--poll-interval', type=float, default=2.0)
+        parser.add_argument('--once', action='store_true', help="Exit when the queue is empty.")
+
+    def handle(self, *args, **options):
+        requeued = jobs.requeue_stale_jobs()
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale jobs.")
+
+        processes = max(1, options['processes'])
+        if processes == 1:
+            jobs.work(poll_interval=options['poll_interval'], once=options['once'])
+            return
+
+        connections.close_all()
+        workers = [
+            multiprocessing.Process(target=run_worker, args=(options['poll_interval'], options['once']))
+            for _ in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
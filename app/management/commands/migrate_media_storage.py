@@ -0,0 +1,106 @@
+import os
+import posixpath
+
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from app.media import DERIVATIVES_DIR
+from app.models import StoredFile
+from app.signals import STORED_FILE_FIELDS
+from app.storage import content_name, content_storage, hash_content, is_content_name
+
+SKIP_DIRS = {DERIVATIVES_DIR, 'videos/hls'}
+
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return hash_content(File(f))
+
+
+class Command(BaseCommand):
+    help = "Move existing uploads into content-addressed storage and drop duplicate copies."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report what would change without touching anything.")
+        parser.add_argument('--prune-duplicates', action='store_true',
+                            help="Also delete unreferenced files that duplicate stored or earlier files.")
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.renamed = {}
+        self.targets = set()
+        self.moved = self.deduplicated = self.missing = self.reclaimed = 0
+
+        for model, fields in STORED_FILE_FIELDS.items():
+            for field in fields:
+                rows = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+                for pk, name in rows.values_list('pk', field):
+                    if is_content_name(name):
+                        continue
+                    target = self.migrate_file(name)
+                    if target is None:
+                        self.stderr.write(f"{model._meta.model_name} {pk}: missing file {name}")
+                        continue
+                    if not self.dry_run:
+                        model.objects.filter(pk=pk).update(**{field: target})
+                        StoredFile.objects.filter(name=target).update(refcount=F('refcount') + 1)
+
+        if options['prune_duplicates']:
+            self.prune_duplicates()
+
+        prefix = "Would move" if self.dry_run else "Moved"
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix} {self.moved} files, removed {self.deduplicated} duplicates, "
+            f"{self.missing} missing, {self.reclaimed} bytes reclaimed."
+        ))
+
+    def migrate_file(self, name):
+        """Store one legacy file under its content name and return that name."""
+        if name in self.renamed:
+            return self.renamed[name]
+        path = content_storage.path(name)
+        if not os.path.exists(path):
+            self.missing += 1
+            return None
+
+        digest, size = file_digest(path)
+        target = content_name(name, digest)
+        if target in self.targets or content_storage.exists(target):
+            self.deduplicated += 1
+            self.reclaimed += size
+            if not self.dry_run:
+                os.remove(path)
+        else:
+            self.moved += 1
+            if not self.dry_run:
+                target_path = content_storage.path(target)
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                os.rename(path, target_path)
+        if not self.dry_run:
+            StoredFile.objects.get_or_create(name=target, defaults={'size': size})
+        self.renamed[name] = target
+        self.targets.add(target)
+        return target
+
+    def prune_duplicates(self):
+        stored = set(StoredFile.objects.values_list('name', flat=True)) | self.targets
+        digests = {os.path.splitext(os.path.basename(name))[0] for name in stored}
+        for dirpath, dirnames, filenames in os.walk(content_storage.location):
+            relative = os.path.relpath(dirpath, content_storage.location).replace(os.sep, '/')
+            # Derivatives and HLS segments are generated output, not uploads.
+            dirnames[:] = sorted(d for d in dirnames if posixpath.normpath(posixpath.join(relative, d)) not in SKIP_DIRS)
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, content_storage.location).replace(os.sep, '/')
+                if is_content_name(name) or name in self.renamed:
+                    continue
+                digest, size = file_digest(path)
+                if digest not in digests:
+                    # Keep the first unreferenced copy of any content we do not store yet.
+                    digests.add(digest)
+                    continue
+                self.deduplicated += 1
+                self.reclaimed += size
+                if not self.dry_run:
+                    os.remove(path)
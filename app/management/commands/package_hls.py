@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app import jobs
+from app.models import MediaJob, Video
+
+
+class Command(BaseCommand):
+    help = "Package videos into HLS renditions with a master playlist."
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help="Video ids (default: videos without a playlist).")
+        parser.add_argument('--all', action='store_true', help="Re-package every video.")
+        parser.add_argument('--queue', action='store_true', help="Queue jobs for media_worker instead of packaging here.")
+
+    def handle(self, *args, **options):
+        videos = Video.objects.exclude(file='')
+        if options['ids']:
+            videos = videos.filter(id__in=options['ids'])
+        elif not options['all']:
+            videos = videos.filter(hls_playlist='')
+
+        for video in videos:
+            if options['queue']:
+                MediaJob.enqueue_for(video, kinds=[MediaJob.HLS])
+                self.stdout.write(f"Queued video {video.pk}")
+                continue
+            started = time.perf_counter()
+            try:
+                jobs.hls(video)
+            except Exception as e:
+                self.stderr.write(f"Video {video.pk}: {e}")
+                continue
+            self.stdout.write(f"Packaged video {video.pk} in {time.perf_counter() - started:.1f}s")
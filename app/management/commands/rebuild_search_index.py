@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app.search import get_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuild the course search index from the database."
+
+    def handle(self, *args, **options):
+        count = get_backend().rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} courses."))
@@ -0,0 +1,47 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from app.models import Course, Rating
+
+AGGREGATE_FIELDS = ['rating_count', 'rating_sum', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5']
+
+
+def count_ratings():
+    """Recompute every course's rating aggregates from the Rating table in one grouped query."""
+    totals = defaultdict(lambda: dict.fromkeys(AGGREGATE_FIELDS, 0))
+    rows = Rating.objects.values('course_id', 'rating').annotate(n=Count('id')).order_by()
+    for row in rows:
+        course = totals[row['course_id']]
+        course['rating_count'] += row['n']
+        course['rating_sum'] += row['rating'] * row['n']
+        course[f"rating_{row['rating']}"] += row['n']
+    return totals
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored rating aggregates of every course from its Rating rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report courses that drifted.")
+
+    def handle(self, *args, **options):
+        empty = dict.fromkeys(AGGREGATE_FIELDS, 0)
+        drifted = []
+        with transaction.atomic():
+            totals = count_ratings()
+            for course in Course.objects.select_for_update().only('pk', *AGGREGATE_FIELDS):
+                expected = totals.get(course.pk, empty)
+                if any(getattr(course, field) != value for field, value in expected.items()):
+                    for field, value in expected.items():
+                        setattr(course, field, value)
+                    drifted.append(course)
+            if drifted and not options['dry_run']:
+                Course.objects.bulk_update(drifted, AGGREGATE_FIELDS, batch_size=500)
+
+        for course in drifted:
+            self.stdout.write(f"Course {course.pk}: {course.rating_count} ratings, sum {course.rating_sum}")
+        verb = "would be fixed" if options['dry_run'] else "fixed"
+        self.stdout.write(self.style.SUCCESS(f"{len(drifted)} courses {verb}."))
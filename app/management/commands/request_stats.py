@@ -0,0 +1,44 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from app.models import RequestStats
+
+COLUMNS = ('requests', 'queries', 'db_ms', 'template_ms', 'view_ms', 'over_budget')
+
+
+def averages(stats):
+    """Per-request averages of one RequestStats row, times in milliseconds."""
+    requests = stats.requests or 1
+    return {
+        'requests': stats.requests,
+        'queries': round(stats.queries / requests, 1),
+        'db_ms': round(stats.db_time * 1000 / requests, 1),
+        'template_ms': round(stats.template_time * 1000 / requests, 1),
+        'view_ms': round(stats.view_time * 1000 / requests, 1),
+        'over_budget': stats.over_budget,
+    }
+
+
+class Command(BaseCommand):
+    help = "Show per-view averages of the requests recorded by app.querybudget, slowest first."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help="Print the rows as JSON.")
+        parser.add_argument('--reset', action='store_true', help="Delete the recorded totals afterwards.")
+
+    def handle(self, *args, **options):
+        rows = {stats.view_name: averages(stats) for stats in RequestStats.objects.all()}
+        rows = dict(sorted(rows.items(), key=lambda row: -row[1]['view_ms']))
+
+        if options['json']:
+            self.stdout.write(json.dumps(rows, indent=2))
+        else:
+            width = max((len(name) for name in rows), default=4)
+            self.stdout.write(f"{'view':<{width}}" + ''.join(f'{column:>13}' for column in COLUMNS))
+            for name, row in rows.items():
+                self.stdout.write(f'{name:<{width}}' + ''.join(f'{row[column]:>13}' for column in COLUMNS))
+
+        if options['reset']:
+            RequestStats.objects.all().delete()
+            self.stdout.write(self.style.SUCCESS(f"Reset {len(rows)} views."))
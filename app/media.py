@@ -0,0 +1,226 @@
+import os
+import re
+import subprocess
+
+from moviepy.config import get_setting
+from PIL import Image, ImageOps
+
+DURATION_RE = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+BITRATE_RE = re.compile(r"bitrate: (\d+) kb/s")
+VIDEO_STREAM_RE = re.compile(r"Stream #\S+.*?: Video: (\w+).*?, (\d{2,5})x(\d{2,5})")
+AUDIO_STREAM_RE = re.compile(r"Stream #\S+.*?: Audio: ")
+
+# (name, height, video kb/s, audio kb/s) of the HLS ladder, lowest first.
+HLS_RENDITIONS = [
+    ('360p', 360, 800, 96),
+    ('480p', 480, 1400, 128),
+    ('720p', 720, 2800, 128),
+    ('1080p', 1080, 5000, 192),
+]
+HLS_SEGMENT_SECONDS = 6
+HLS_MASTER_PLAYLIST = 'master.m3u8'
+
+# Widths and encodings of the responsive image derivatives, kept under DERIVATIVES_DIR.
+IMAGE_WIDTHS = (320, 640, 960)
+IMAGE_FORMATS = {
+    'webp': ('WEBP', 'image/webp', 80),
+    'jpg': ('JPEG', 'image/jpeg', 82),
+}
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif')
+DERIVATIVES_DIR = 'derivatives'
+
+
+def ffmpeg_infos(path):
+    """Return the stream banner ``ffmpeg -i`` prints for a file."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No such file: {path}")
+
+    proc = subprocess.run(
+        [get_setting("FFMPEG_BINARY"), "-hide_banner", "-i", path],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        errors="replace",
+    )
+    return proc.stderr
+
+
+def probe_video(path):
+    """Read duration, resolution, codec, bitrate and size of a video file.
+
+    Runs a single ``ffmpeg -i`` and parses its banner, so it costs one
+    subprocess per file instead of opening a full VideoFileClip.
+    """
+    infos = ffmpeg_infos(path)
+
+    duration = DURATION_RE.search(infos)
+    if duration is None:
+        raise ValueError(f"Could not read duration of {path}")
+    hours, minutes, seconds = duration.groups()
+
+    metadata = {
+        'duration': int(hours) * 3600 + int(minutes) * 60 + float(seconds),
+        'width': None,
+        'height': None,
+        'codec': '',
+        'bitrate': None,
+        'file_size': os.path.getsize(path),
+    }
+
+    bitrate = BITRATE_RE.search(infos)
+    if bitrate:
+        metadata['bitrate'] = int(bitrate.group(1))
+
+    stream = VIDEO_STREAM_RE.search(infos)
+    if stream:
+        metadata['codec'] = stream.group(1)
+        metadata['width'] = int(stream.group(2))
+        metadata['height'] = int(stream.group(3))
+
+    return metadata
+
+
+def run_ffmpeg(*args):
+    """Run ffmpeg with the given arguments and raise if it fails."""
+    proc = subprocess.run(
+        [get_setting("FFMPEG_BINARY"), "-hide_banner", "-loglevel", "error", "-y", *args],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        errors="replace",
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {proc.stderr.strip()[-500:]}")
+
+
+def extract_poster(path, output, at=1.0):
+    """Save one frame of the video at ``at`` seconds as a JPEG."""
+    run_ffmpeg("-ss", str(at), "-i", path, "-frames:v", "1", "-q:v", "3", output)
+
+
+def transcode_for_web(path, output, threads=1):
+    """Re-encode a video to H.264/AAC MP4 with the index at the front for progressive playback."""
+    run_ffmpeg(
+        "-i", path,
+        "-threads", str(threads),
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "23", "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-b:a", "128k",
+        "-movflags", "+faststart",
+        output,
+    )
+
+
+def package_hls(path, output_dir, renditions=HLS_RENDITIONS, segment_seconds=HLS_SEGMENT_SECONDS, threads=1):
+    """Encode a video into an HLS bitrate ladder with a master playlist.
+
+    Renditions taller than the source are skipped. Every file is written
+    flat into ``output_dir``: ``master.m3u8``, one ``<name>.m3u8`` per
+    rendition and its ``<name>_NNN.ts`` segments. Returns the names of the
+    renditions that were produced.
+    """
+    infos = ffmpeg_infos(path)
+    stream = VIDEO_STREAM_RE.search(infos)
+    if stream is None:
+        raise ValueError(f"No video stream in {path}")
+    source_height = int(stream.group(3))
+    has_audio = AUDIO_STREAM_RE.search(infos) is not None
+
+    ladder = [r for r in renditions if r[1] <= source_height] or renditions[:1]
+    os.makedirs(output_dir, exist_ok=True)
+
+    splits = ''.join(f'[v{i}]' for i in range(len(ladder)))
+    filters = [f'[0:v]split={len(ladder)}{splits}']
+    filters += [f'[v{i}]scale=-2:{height}[v{i}out]' for i, (_, height, _, _) in enumerate(ladder)]
+
+    args = ["-i", path, "-threads", str(threads), "-filter_complex", ';'.join(filters)]
+    stream_map = []
+    for i, (name, height, video_bitrate, audio_bitrate) in enumerate(ladder):
+        args += [
+            "-map", f"[v{i}out]",
+            f"-c:v:{i}", "libx264",
+            f"-b:v:{i}", f"{video_bitrate}k",
+            f"-maxrate:v:{i}", f"{int(video_bitrate * 1.07)}k",
+            f"-bufsize:v:{i}", f"{int(video_bitrate * 1.5)}k",
+        ]
+        entry = f"v:{i}"
+        if has_audio:
+            args += ["-map", "a:0", f"-c:a:{i}", "aac", f"-b:a:{i}", f"{audio_bitrate}k"]
+            entry += f",a:{i}"
+        stream_map.append(f"{entry},name:{name}")
+
+    args += [
+        "-preset", "veryfast",
+        "-pix_fmt", "yuv420p",
+        # Keyframes on segment boundaries so every rendition switches at the same points.
+        "-force_key_frames", f"expr:gte(t,n_forced*{segment_seconds})",
+        "-sc_threshold", "0",
+        "-f", "hls",
+        "-hls_time", str(segment_seconds),
+        "-hls_playlist_type", "vod",
+        "-hls_segment_filename", os.path.join(output_dir, "%v_%03d.ts"),
+        "-master_pl_name", HLS_MASTER_PLAYLIST,
+        "-var_stream_map", ' '.join(stream_map),
+        os.path.join(output_dir, "%v.m3u8"),
+    ]
+    run_ffmpeg(*args)
+    return [name for name, _, _, _ in ladder]
+
+
+def derivative_name(name, width, fmt):
+    return f'{DERIVATIVES_DIR}/{os.path.splitext(name)[0]}/{width}.{fmt}'
+
+
+def make_derivative(storage, name, width, fmt):
+    """Create the ``width``/``fmt`` derivative of a stored image unless it is cached."""
+    target = derivative_name(name, width, fmt)
+    path = storage.path(target)
+    if os.path.exists(path):
+        return target
+
+    pil_format, _, quality = IMAGE_FORMATS[fmt]
+    with Image.open(storage.path(name)) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.width > width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write under a private name first so concurrent requests never serve a partial file.
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        image.save(tmp_path, pil_format, quality=quality, optimize=True)
+        os.replace(tmp_path, path)
+    return target
+
+
+def make_derivatives(field_file):
+    """Create every derivative of an image field's file."""
+    for width in IMAGE_WIDTHS:
+        for fmt in IMAGE_FORMATS:
+            make_derivative(field_file.storage, field_file.name, width, fmt)
+
+
+def evict_derivatives(storage, max_bytes):
+    """Delete the least recently used derivatives until the cache fits in ``max_bytes``."""
+    root = storage.path(DERIVATIVES_DIR)
+    entries = []
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((max(stat.st_atime, stat.st_mtime), stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    return removed
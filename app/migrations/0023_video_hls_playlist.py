@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0022_media_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='hls_playlist',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='mediajob',
+            name='kind',
+            field=models.CharField(choices=[('probe', 'Probe'), ('poster', 'Poster'), ('transcode', 'Transcode'), ('hls', 'HLS packaging')], max_length=10),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:17
+
+import app.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0023_video_hls_playlist'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveBigIntegerField()),
+                ('refcount', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='course',
+            name='image',
+            field=models.ImageField(storage=app.storage.ContentAddressedStorage(), upload_to='media/'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='avatar',
+            field=models.ImageField(blank=True, null=True, storage=app.storage.ContentAddressedStorage(), upload_to='avatar/'),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='file',
+            field=models.FileField(storage=app.storage.ContentAddressedStorage(), upload_to='videos/'),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='poster',
+            field=models.ImageField(storage=app.storage.ContentAddressedStorage(), upload_to='posters/'),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='web_file',
+            field=models.FileField(blank=True, storage=app.storage.ContentAddressedStorage(), upload_to='videos/web/'),
+        ),
+    ]
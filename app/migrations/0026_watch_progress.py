@@ -0,0 +1,61 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:20
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def copy_watched(apps, schema_editor):
+    """Carry the old per-video flags over as progress of the video's own user, the only user they name."""
+    Video = apps.get_model('app', 'Video')
+    WatchProgress = apps.get_model('app', 'WatchProgress')
+    videos = Video.objects.filter(models.Q(watched=True) | models.Q(last_watched__isnull=False))
+    WatchProgress.objects.bulk_create([
+        WatchProgress(
+            user_id=video.user_id,
+            video_id=video.id,
+            course_id=video.course_id,
+            completed=video.watched,
+            updated_at=video.last_watched or video.uploaded_at,
+        )
+        for video in videos.only('id', 'user_id', 'course_id', 'watched', 'last_watched', 'uploaded_at')
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0025_video_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WatchProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.FloatField(default=0)),
+                ('completed', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='progress', to='app.course')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='progress', to=settings.AUTH_USER_MODEL)),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='progress', to='app.video')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'course', '-updated_at'], name='app_watchpr_user_id_31af78_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='watchprogress',
+            constraint=models.UniqueConstraint(fields=('user', 'video'), name='unique_user_video_progress'),
+        ),
+        migrations.RunPython(copy_watched, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='video',
+            name='last_watched',
+        ),
+        migrations.RemoveField(
+            model_name='video',
+            name='watched',
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:23
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    Course = apps.get_model('app', 'Course')
+    Rating = apps.get_model('app', 'Rating')
+    totals = {}
+    for row in Rating.objects.values('course_id', 'rating').annotate(n=Count('id')).order_by():
+        course = totals.setdefault(row['course_id'], {'rating_count': 0, 'rating_sum': 0})
+        course['rating_count'] += row['n']
+        course['rating_sum'] += row['rating'] * row['n']
+        course[f"rating_{row['rating']}"] = row['n']
+    for course_id, fields in totals.items():
+        Course.objects.filter(pk=course_id).update(**fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0026_watch_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
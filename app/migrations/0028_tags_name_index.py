@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0027_course_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tags',
+            name='name',
+            field=models.CharField(db_index=True, max_length=25),
+        ),
+    ]
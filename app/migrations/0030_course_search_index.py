@@ -0,0 +1,38 @@
+from django.db import migrations
+
+COLUMNS = "name, level, body_uz, body_en, body_ru, tags, teacher"
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS app_course_fts USING fts5("
+        f"{COLUMNS}, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    schema_editor.execute(
+        f"INSERT INTO app_course_fts (rowid, {COLUMNS}) "
+        "SELECT c.id, "
+        "c.name || ' ' || coalesce(c.name_uz, '') || ' ' || coalesce(c.name_en, '') || ' ' || coalesce(c.name_ru, ''), "
+        "c.level || ' ' || coalesce(c.level_uz, '') || ' ' || coalesce(c.level_en, '') || ' ' || coalesce(c.level_ru, ''), "
+        "coalesce(c.body_uz, ''), coalesce(c.body_en, ''), coalesce(c.body_ru, ''), "
+        "coalesce((SELECT group_concat(t.name, ' ') FROM app_tags t WHERE t.course_id = c.id), ''), "
+        "u.username || ' ' || u.first_name || ' ' || u.last_name "
+        "FROM app_course c JOIN app_user u ON u.id = c.teacher_id"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS app_course_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0029_course_keyset_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
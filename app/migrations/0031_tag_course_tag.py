@@ -0,0 +1,75 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils.text import slugify
+
+
+def copy_tags(apps, schema_editor):
+    """Turn the per-course Tags rows into one Tag per slug plus links."""
+    Tags = apps.get_model('app', 'Tags')
+    Tag = apps.get_model('app', 'Tag')
+    CourseTag = apps.get_model('app', 'CourseTag')
+    tags = {}
+    links = set()
+    for name, course_id in Tags.objects.order_by('id').values_list('name', 'course_id').iterator():
+        slug = slugify(name, allow_unicode=True)
+        if not slug:
+            continue
+        tags.setdefault(slug, Tag(name=name, slug=slug))
+        links.add((slug, course_id))
+    Tag.objects.bulk_create(tags.values(), batch_size=500)
+    ids = dict(Tag.objects.values_list('slug', 'id'))
+    CourseTag.objects.bulk_create(
+        [CourseTag(tag_id=ids[slug], course_id=course_id) for slug, course_id in sorted(links)], batch_size=500
+    )
+    counts = {}
+    for slug, _ in links:
+        counts[slug] = counts.get(slug, 0) + 1
+    for slug, count in counts.items():
+        Tag.objects.filter(pk=ids[slug]).update(course_count=count)
+
+
+def copy_tags_back(apps, schema_editor):
+    Tags = apps.get_model('app', 'Tags')
+    CourseTag = apps.get_model('app', 'CourseTag')
+    Tags.objects.bulk_create(
+        [Tags(name=name, course_id=course_id)
+         for name, course_id in CourseTag.objects.values_list('tag__name', 'course_id').iterator()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0030_course_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=25)),
+                ('slug', models.SlugField(allow_unicode=True, blank=True, max_length=40, unique=True)),
+                ('course_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CourseTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='course_tags', to='app.course')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='course_tags', to='app.tag')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='coursetag',
+            constraint=models.UniqueConstraint(fields=('tag', 'course'), name='course_tag_unique'),
+        ),
+        migrations.RunPython(copy_tags, copy_tags_back),
+        migrations.DeleteModel(
+            name='Tags',
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_comment_roots(apps, schema_editor):
+    Comment = apps.get_model('app', 'Comment')
+    parents = dict(Comment.objects.values_list('id', 'parent_id'))
+    replies = []
+    for pk, parent_id in parents.items():
+        if parent_id is None:
+            continue
+        root_id = parent_id
+        while parents.get(root_id) is not None:
+            root_id = parents[root_id]
+        replies.append(Comment(pk=pk, root_id=root_id))
+    Comment.objects.bulk_update(replies, ['root'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0031_tag_course_tag'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='root',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='thread', to='app.comment'),
+        ),
+        migrations.RunPython(backfill_comment_roots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0032_comment_root'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('view_name', models.CharField(max_length=200, unique=True)),
+                ('requests', models.PositiveBigIntegerField(default=0)),
+                ('queries', models.PositiveBigIntegerField(default=0)),
+                ('db_time', models.FloatField(default=0)),
+                ('template_time', models.FloatField(default=0)),
+                ('view_time', models.FloatField(default=0)),
+                ('over_budget', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
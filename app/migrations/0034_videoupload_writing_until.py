@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0033_request_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videoupload',
+            name='writing_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
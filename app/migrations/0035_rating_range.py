@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:23
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0034_videoupload_writing_until'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='rating',
+            name='rating',
+            field=models.IntegerField(choices=[(1, '1'), (2, '2'), (3, '3'), (4, '4'), (5, '5')], default='1', validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(5)]),
+        ),
+        migrations.AddConstraint(
+            model_name='rating',
+            constraint=models.CheckConstraint(check=models.Q(('rating__gte', 1), ('rating__lte', 5)), name='rating_between_1_and_5'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0035_rating_range'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediajob',
+            name='image',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='mediajob',
+            name='kind',
+            field=models.CharField(choices=[('probe', 'Probe'), ('poster', 'Poster'), ('transcode', 'Transcode'), ('hls', 'HLS packaging'), ('images', 'Image derivatives')], max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='mediajob',
+            name='video',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='app.video'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:11
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def drop_duplicate_image_jobs(apps, schema_editor):
+    MediaJob = apps.get_model('app', 'MediaJob')
+    queued = MediaJob.objects.filter(kind='images', status__in=['pending', 'running'])
+    keep = queued.values('image').annotate(first=Min('id')).order_by().values_list('first', flat=True)
+    queued.exclude(id__in=list(keep)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0036_mediajob_images'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_image_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='mediajob',
+            constraint=models.UniqueConstraint(condition=models.Q(('kind', 'images'), ('status__in', ['pending', 'running'])), fields=('image',), name='unique_queued_image_job'),
+        ),
+    ]
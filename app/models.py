@@ -1,7 +1,25 @@
-from django.db import models
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db import models, transaction
+from django.db.models import Case, Count, Exists, F, FloatField, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
+from django.utils.text import slugify
+from app.fragments import bump_content_version, cached_fragment
+from app.media import probe_video
+from app.storage import content_storage
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+def generate_derivatives(field_file):
+    """Queue the responsive derivatives of a newly saved image for the media worker."""
+    MediaJob.enqueue_image(field_file.name)
 
 # Create your models here
 
@@ -18,12 +36,18 @@ class User(AbstractUser):
     email = models.EmailField(max_length=255, blank=True)
     phone = models.CharField(max_length=10)
     address = models.CharField(max_length=50)
-    avatar = models.ImageField(null=True, blank=True, upload_to="avatar/")
+    avatar = models.ImageField(null=True, blank=True, upload_to="avatar/", storage=content_storage)
     follower = models.ManyToManyField('User', related_name='follow', blank=True)
 
     USERNAME_FIELD = 'username'
     REQUIRED_FIELDS = []
 
+    def save(self, *args, **kwargs):
+        new_avatar = bool(self.avatar) and not self.avatar._committed
+        super(User, self).save(*args, **kwargs)
+        if new_avatar:
+            generate_derivatives(self.avatar)
+
     def delete_self(self):
         self.delete()
 
@@ -47,6 +71,38 @@ class Part(models.Model):
     def get_absolute_url(self):
         return reverse('product_list_by_category', args=[self.slug])
 
+def count_subquery(queryset, field):
+    """Count the rows of ``queryset`` per ``field``, matched against the outer row's pk."""
+    counts = queryset.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(n=Count('*')).values('n')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+class CourseQuerySet(models.QuerySet):
+    def with_card_data(self, user=None):
+        """Everything a course card shows, in the same query as the courses.
+
+        Counts are correlated subqueries rather than joins, so the three
+        relations cannot multiply each other's rows.
+        """
+        queryset = self.select_related('teacher', 'part').annotate(
+            student_count=count_subquery(Course.students.through.objects, 'course_id'),
+            like_count=count_subquery(Course.like.through.objects, 'course_id'),
+            lecture_count=count_subquery(Lecture.objects, 'course_id'),
+            average_rating=Case(
+                When(rating_count=0, then=Value(0.0)),
+                default=F('rating_sum') * 1.0 / F('rating_count'),
+                output_field=FloatField(),
+            ),
+        )
+        if user is not None and user.is_authenticated:
+            queryset = queryset.annotate(liked=Exists(
+                Course.like.through.objects.filter(course_id=OuterRef('pk'), user_id=user.pk)
+            ))
+        else:
+            queryset = queryset.annotate(liked=Value(False))
+        return queryset
+
+
 class Course(models.Model):
     reatings = (
         (1, '1'),
@@ -59,27 +115,94 @@ class Course(models.Model):
     students = models.ManyToManyField(User, related_name="student", blank=True)
     teacher = models.ForeignKey(User, on_delete=models.CASCADE, related_name="teacher")
     like = models.ManyToManyField(User, related_name = 'like', blank=True)
-    image = models.ImageField(upload_to="media/")
+    image = models.ImageField(upload_to="media/", storage=content_storage)
     body = models.TextField()
     level = models.CharField(max_length=15)
     price = models.IntegerField()
     part = models.ForeignKey(Part, related_name='parts', on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     upload_at = models.DateTimeField(auto_now=True)
+    # Rating aggregates, kept in step with Rating rows by Rating.save and the post_delete signal.
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+
+    objects = CourseQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        new_image = bool(self.image) and not self.image._committed
+        super(Course, self).save(*args, **kwargs)
+        if new_image:
+            generate_derivatives(self.image)
     
     def get_ratings(self):
         return Rating.objects.filter(course=self)
 
+    def get_syllabus(self, user):
+        """Return the course lectures with their videos and the user's progress.
+
+        The lectures and videos come from the fragment cache when possible,
+        so usually only the progress is queried.
+        """
+        from app.progress import completed_video_ids
+
+        lectures = cached_fragment('syllabus', self, lambda: list(self.lectures.prefetch_related('videos')))
+        video_ids = {video.id for lecture in lectures for video in lecture.videos.all()}
+        watched = completed_video_ids(user, video_ids)
+
+        for lecture in lectures:
+            videos = lecture.videos.all()
+            total_videos = len(videos)
+            watched_videos = sum(1 for video in videos if video.id in watched)
+            lecture.video_count = total_videos
+            lecture.duration = sum(video.duration or 0 for video in videos)
+            if total_videos > 0:
+                lecture.watched_fraction = round(watched_videos / total_videos, 2)
+                lecture.watched_percentage = round(watched_videos / total_videos * 100, 2)
+            else:
+                lecture.watched_fraction = 0
+                lecture.watched_percentage = 0
+        return lectures
+
     def get_number_of_students(self):
         student_count = self.students.count()
         total_students = student_count 
 
         return total_students
+
+    def can_watch(self, user):
+        """Whether ``user`` may stream this course's videos: its students, its teacher and staff."""
+        if not user.is_authenticated:
+            return False
+        return user.is_staff or user.id == self.teacher_id or self.students.filter(pk=user.pk).exists()
     
+    @classmethod
+    def apply_rating(cls, course_id, rating, delta):
+        """Add (``delta=1``) or remove (``delta=-1``) one rating from the stored aggregates."""
+        rating = int(rating)
+        cls.objects.filter(pk=course_id).update(**{
+            'rating_count': F('rating_count') + delta,
+            'rating_sum': F('rating_sum') + rating * delta,
+            f'rating_{rating}': F(f'rating_{rating}') + delta,
+        })
+
+    @property
+    def rating_histogram(self):
+        """Return (stars, count, percentage) for 5 down to 1 stars."""
+        histogram = []
+        for stars in range(5, 0, -1):
+            count = getattr(self, f'rating_{stars}')
+            percentage = round(count / self.rating_count * 100) if self.rating_count else 0
+            histogram.append((stars, count, percentage))
+        return histogram
+
     def calculate_average_rating(self):
-        user_ratings = [int(rating.rating) for rating in self.get_ratings()]
-        if user_ratings:
-            return sum(user_ratings) / len(user_ratings)
+        if self.rating_count:
+            return self.rating_sum / self.rating_count
         else:
             return 0    
         
@@ -91,6 +214,12 @@ class Course(models.Model):
 
         stars_html = '⭐' * full_stars + '½' * half_stars + '☆' * empty_stars
         return stars_html
+
+    class Meta:
+        indexes = [
+            # Keyset pagination order, see app.pagination.
+            models.Index(fields=['created_at', 'id'], name='course_created_id_idx'),
+        ]
     
     def __str__(self) -> str:
         return self.name
@@ -107,24 +236,10 @@ class Review(models.Model):
         return Rating.objects.filter(course=self.course)
 
     def calculate_all_users_average_rating(self):
-        all_user_ratings = [int(rating.rating) for rating in self.get_all_user_ratings()]
-        if all_user_ratings:
-            return sum(all_user_ratings) / len(all_user_ratings)
-        else:
-            return 0
+        return self.course.calculate_average_rating()
     def get_all_users_ratings_as_stars(self):
-        user_ratings = self.rating_set.all()  
-
-        stars_list = []
-        for rating in user_ratings:
-            full_stars = int(rating.rating)
-            half_stars = 1 if rating.rating - full_stars >= 0.5 else 0
-            empty_stars = 5 - full_stars - half_stars
-
-            stars_html = '⭐' * full_stars + '½' * half_stars + '☆' * empty_stars
-            stars_list.append(stars_html)
-
-        return stars_list
+        # Served from the prefetch when loaded by app.comments.review_page.
+        return [rating.get_rating_as_stars() for rating in self.rating_set.all()]
 
         
     class Meta:
@@ -137,7 +252,32 @@ class Rating(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
     review = models.ForeignKey(Review, on_delete=models.CASCADE, null=True, blank=True)
-    rating = models.IntegerField(choices=Course.reatings, default='1')
+    rating = models.IntegerField(
+        choices=Course.reatings, default='1', validators=[MinValueValidator(1), MaxValueValidator(5)]
+    )
+
+    class Meta:
+        constraints = [
+            # Course keeps a rating_<n> counter per star, so no other value can be counted.
+            models.CheckConstraint(check=models.Q(rating__gte=1, rating__lte=5), name='rating_between_1_and_5')
+        ]
+
+    def save(self, *args, **kwargs):
+        if int(self.rating) not in range(1, 6):
+            raise ValueError(f"A rating is 1 to 5 stars, not {self.rating}.")
+        with transaction.atomic():
+            previous = None
+            if self.pk is not None:
+                # Locked, so a concurrent save of this rating waits and then sees our value as its previous one.
+                previous = (
+                    Rating.objects.select_for_update().filter(pk=self.pk).values_list('course_id', 'rating').first()
+                )
+            super(Rating, self).save(*args, **kwargs)
+            current = (self.course_id, int(self.rating))
+            if previous != current:
+                if previous is not None:
+                    Course.apply_rating(*previous, delta=-1)
+                Course.apply_rating(*current, delta=1)
     
     def get_rating_as_stars(self):
         full_stars = int(self.rating)
@@ -155,13 +295,25 @@ class Comment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     upload_at = models.DateTimeField(auto_now=True)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
+    # Top-level comment of the thread, so a thread's replies load in one query. Null on top-level comments.
+    root = models.ForeignKey(
+        'self', on_delete=models.CASCADE, null=True, blank=True, editable=False, related_name='thread'
+    )
 
     class Meta:
         ordering = ['-upload_at', '-created_at']
 
+    def save(self, *args, **kwargs):
+        if self.parent_id is not None and self.root_id is None:
+            self.root_id = self.parent.root_id or self.parent_id
+        super(Comment, self).save(*args, **kwargs)
+
 
     @property
     def getReplies(self):
+        # Comments from app.comments.comment_page and attach_replies already carry their replies.
+        if hasattr(self, 'thread_replies'):
+            return self.thread_replies
         return Comment.objects.filter(parent=self).reverse()
 
     @property
@@ -181,49 +333,271 @@ class Lecture(models.Model):
     def __str__(self):
         return self.name
 
-    def videos_watched_percentage(self):
-        total_videos = self.videos.count()  # Use self.videos instead of self.video_set
-        watched_videos = self.videos.filter(watched=True).count()
-
-        if total_videos > 0:
-            percentage = (watched_videos / total_videos) * 100
-            return round(percentage, 2)
-        else:
-            return 0
-    
-    def video_fraction(self):
-        total_videos = self.videos.count()
-        watched_videos = self.videos.filter(watched=True).count()
-
-        if total_videos > 0:
-            percentage = watched_videos / total_videos
-            return round(percentage, 2)
-        else:
-            return 0
-    
 class Video(models.Model):
-    file = models.FileField(upload_to="videos/")
+    PROCESSING = 'processing'
+    READY = 'ready'
+    FAILED = 'failed'
+    PROCESSING_STATUSES = [
+        (PROCESSING, 'Processing'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed'),
+    ]
+
+    file = models.FileField(upload_to="videos/", storage=content_storage)
+    web_file = models.FileField(upload_to="videos/web/", blank=True, storage=content_storage)
+    hls_playlist = models.CharField(max_length=255, blank=True)
     name = models.CharField(max_length=44)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    poster = models.ImageField(upload_to="posters/")
+    poster = models.ImageField(upload_to="posters/", storage=content_storage)
     created_at = models.DateTimeField(auto_now_add=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     course = models.ForeignKey(Course, related_name='courses', on_delete=models.CASCADE)
-    last_watched = models.DateTimeField(null=True, blank=True)
-    watched = models.BooleanField(default=False)
+    duration = models.FloatField(null=True, blank=True)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    codec = models.CharField(max_length=32, blank=True)
+    bitrate = models.PositiveIntegerField(null=True, blank=True)
+    file_size = models.PositiveBigIntegerField(null=True, blank=True)
+    processing_status = models.CharField(max_length=10, choices=PROCESSING_STATUSES, default=READY)
 
     def __str__(self):
         return self.name
 
+    @property
+    def duration_minutes(self):
+        if self.duration is None:
+            return None
+        return round(self.duration / 60)
+
+    @property
+    def is_processing(self):
+        return self.processing_status == self.PROCESSING
+
+    @property
+    def playback_file(self):
+        return self.web_file or self.file
+
+    @property
+    def hls_dir(self):
+        return f'videos/hls/{self.pk}'
+
     def save(self, *args, **kwargs):
-        if self.last_watched:
-            self.watched = True
-            self.last_watched = timezone.now()
+        new_file = bool(self.file) and not self.file._committed
+        new_poster = bool(self.poster) and not self.poster._committed
+        if new_file:
+            self.processing_status = self.PROCESSING
         super(Video, self).save(*args, **kwargs)
+        if new_file:
+            MediaJob.enqueue_for(self)
+        if new_poster:
+            generate_derivatives(self.poster)
+
+    def update_metadata(self):
+        metadata = probe_video(self.file.path)
+        for field, value in metadata.items():
+            setattr(self, field, value)
+        Video.objects.filter(pk=self.pk).update(**metadata)
+        bump_content_version([self.course_id])
+
+class WatchProgress(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='progress')
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='progress')
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='progress')
+    position = models.FloatField(default=0)
+    completed = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(default=timezone.now)
 
-class Tags(models.Model):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'video'], name='unique_user_video_progress')
+        ]
+        indexes = [
+            models.Index(fields=['user', 'course', '-updated_at'])
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} - {self.video_id}: {self.position}s'
+
+class MediaJob(models.Model):
+    PROBE = 'probe'
+    POSTER = 'poster'
+    TRANSCODE = 'transcode'
+    HLS = 'hls'
+    IMAGES = 'images'
+    KINDS = [
+        (PROBE, 'Probe'),
+        (POSTER, 'Poster'),
+        (TRANSCODE, 'Transcode'),
+        (HLS, 'HLS packaging'),
+        (IMAGES, 'Image derivatives'),
+    ]
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    video = models.ForeignKey(Video, related_name='jobs', on_delete=models.CASCADE, null=True, blank=True)
+    # Storage name of the source image of an IMAGES job, which has no video.
+    image = models.CharField(max_length=255, blank=True)
+    kind = models.CharField(max_length=10, choices=KINDS)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    error = models.TextField(blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['run_after', 'id']
+        indexes = [
+            models.Index(fields=['status', 'run_after'])
+        ]
+        constraints = [
+            # An image is queued at most once at a time, however many saves race for it.
+            models.UniqueConstraint(
+                fields=['image'],
+                condition=models.Q(kind='images', status__in=['pending', 'running']),
+                name='unique_queued_image_job',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.video_id or self.image} ({self.status})'
+
+    @classmethod
+    def enqueue_for(cls, video, kinds=(PROBE, POSTER, TRANSCODE, HLS)):
+        """Queue ``kinds`` for ``video``; the others are only claimed once its PROBE job is done."""
+        return cls.objects.bulk_create([cls(video=video, kind=kind) for kind in kinds])
+
+    @classmethod
+    def enqueue_image(cls, name):
+        """Queue the derivatives of the stored image ``name`` unless they are queued already."""
+        return cls.objects.get_or_create(kind=cls.IMAGES, image=name, status__in=[cls.PENDING, cls.RUNNING])[0]
+
+class VideoUpload(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    course = models.ForeignKey(Course, on_delete=models.CASCADE)
+    name = models.CharField(max_length=44)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    sha256 = models.CharField(max_length=64, blank=True)
+    offset = models.PositiveBigIntegerField(default=0)
+    video = models.OneToOneField(Video, null=True, blank=True, on_delete=models.SET_NULL)
+    # Set while a request writes a chunk, so a second request for the same chunk is turned away.
+    writing_until = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.filename} ({self.offset}/{self.size})'
+
+    @property
+    def path(self):
+        return os.path.join(settings.CHUNKED_UPLOAD_DIR, f'{self.pk}.part')
+
+    @classmethod
+    def expire(cls, max_age):
+        """Delete unfinished uploads idle for ``max_age`` seconds with their part files.
+
+        Part files no upload owns, left by uploads deleted with their user or
+        course, are removed once they are as old. Returns both counts.
+        """
+        now = timezone.now()
+        cutoff = now - timedelta(seconds=max_age)
+        expired = list(cls.objects.filter(video__isnull=True, updated_at__lt=cutoff).exclude(writing_until__gt=now))
+        cls.objects.filter(pk__in=[upload.pk for upload in expired]).delete()
+        for upload in expired:
+            if os.path.exists(upload.path):
+                os.remove(upload.path)
+
+        orphans = 0
+        if os.path.isdir(settings.CHUNKED_UPLOAD_DIR):
+            owned = {f'{pk}.part' for pk in cls.objects.filter(video__isnull=True).values_list('pk', flat=True)}
+            for entry in os.scandir(settings.CHUNKED_UPLOAD_DIR):
+                if (entry.name.endswith('.part') and entry.name not in owned
+                        and entry.stat().st_mtime < cutoff.timestamp()):
+                    os.remove(entry.path)
+                    orphans += 1
+        return len(expired), orphans
+
+class StoredFile(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.name} ({self.refcount})'
+
+class RequestStats(models.Model):
+    """Request totals per URL name, added to by app.querybudget. Times are in seconds."""
+    view_name = models.CharField(max_length=200, unique=True)
+    requests = models.PositiveBigIntegerField(default=0)
+    queries = models.PositiveBigIntegerField(default=0)
+    db_time = models.FloatField(default=0)
+    template_time = models.FloatField(default=0)
+    view_time = models.FloatField(default=0)
+    over_budget = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.view_name}: {self.requests} requests'
+
+class Tag(models.Model):
     name = models.CharField(max_length=25)
-    course = models.ForeignKey(Course, related_name='courslar', on_delete=models.CASCADE)
-    
+    slug = models.SlugField(max_length=40, unique=True, allow_unicode=True, blank=True)
+    # Kept up to date by CourseTag.save and the post_delete signal, so listings need no COUNT.
+    course_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self) -> str:
+        return self.name
+
+    def save(self, *args, **kwargs):
+        if not self.slug:
+            self.slug = slugify(self.name, allow_unicode=True)
+        super(Tag, self).save(*args, **kwargs)
+
+    def get_absolute_url(self):
+        return reverse('courses_tag', args=[self.slug])
+
+    @classmethod
+    def apply_course(cls, tag_id, delta):
+        """Add (``delta=1``) or remove (``delta=-1``) one course from the stored count."""
+        cls.objects.filter(pk=tag_id).update(course_count=F('course_count') + delta)
+
+    @classmethod
+    def recount(cls, tag_ids=None):
+        """Recompute stored counts from the links, e.g. after bulk_create."""
+        tags = cls.objects.all() if tag_ids is None else cls.objects.filter(pk__in=tag_ids)
+        tags.update(course_count=count_subquery(CourseTag.objects.all(), 'tag'))
+
+class CourseTag(models.Model):
+    course = models.ForeignKey(Course, related_name='course_tags', on_delete=models.CASCADE)
+    tag = models.ForeignKey(Tag, related_name='course_tags', on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tag', 'course'], name='course_tag_unique'),
+        ]
+
     def __str__(self) -> str:
-        return self.name
\ No newline at end of file
+        return f'{self.course_id}: {self.tag_id}'
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = None
+            if self.pk is not None:
+                previous = CourseTag.objects.filter(pk=self.pk).values_list('tag_id', flat=True).first()
+            super(CourseTag, self).save(*args, **kwargs)
+            if previous != self.tag_id:
+                if previous is not None:
+                    Tag.apply_course(previous, delta=-1)
+                Tag.apply_course(self.tag_id, delta=1)
\ No newline at end of file
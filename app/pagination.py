@@ -0,0 +1,125 @@
+"""Keyset (cursor) pagination.
+
+Pages are fetched with ``WHERE (created_at, id) < (last row) ... LIMIT n``
+instead of OFFSET, so a deep page costs the same as the first one, and no
+COUNT(*) is needed to know whether there is a next page. Cursors are
+signed, so clients can't forge or edit them. A bad cursor just gives the
+first page.
+"""
+from django.core import signing
+from django.db.models import Q
+
+CURSOR_SALT = 'app.pagination'
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+class CursorPage:
+    def __init__(self, object_list, has_next, has_previous, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.next_url = self.previous_url = None
+        self.total = None
+        self.total_is_approximate = False
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+class CursorPaginator:
+    """Paginate ``queryset`` on ``ordering``, whose fields must be non-null and end with a unique one."""
+
+    def __init__(self, queryset, per_page, ordering=('-created_at', '-id')):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+
+    def cursor(self, obj, direction=NEXT):
+        values = [getattr(obj, field.lstrip('-')) for field in self.ordering]
+        # isoformat() keeps microseconds, which the keyset comparison needs to be exact.
+        values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+        return signing.dumps([direction, values], salt=CURSOR_SALT)
+
+    def decode(self, cursor):
+        try:
+            direction, values = signing.loads(cursor, salt=CURSOR_SALT)
+        except (signing.BadSignature, TypeError, ValueError):
+            return NEXT, None
+        if direction not in (NEXT, PREVIOUS) or len(values) != len(self.ordering):
+            return NEXT, None
+        return direction, values
+
+    def after(self, values, backwards=False):
+        """Rows strictly past ``values`` in the (possibly reversed) ordering."""
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != backwards
+            step = Q(**{f"{name}__{'lt' if descending else 'gt'}": values[i]})
+            for previous, value in zip(self.ordering[:i], values):
+                step &= Q(**{previous.lstrip('-'): value})
+            condition |= step
+        return condition
+
+    def page(self, cursor=None):
+        direction, values = self.decode(cursor) if cursor else (NEXT, None)
+        backwards = direction == PREVIOUS
+        ordering = self.ordering
+        if backwards:
+            ordering = [field[1:] if field.startswith('-') else '-' + field for field in ordering]
+        queryset = self.queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self.after(values, backwards))
+
+        rows = list(queryset[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+            has_next, has_previous = True, more
+        else:
+            has_next, has_previous = more, values is not None
+
+        return CursorPage(
+            rows,
+            has_next=has_next and bool(rows),
+            has_previous=has_previous and bool(rows),
+            next_cursor=self.cursor(rows[-1], NEXT) if has_next and rows else None,
+            previous_cursor=self.cursor(rows[0], PREVIOUS) if has_previous and rows else None,
+        )
+
+
+def approximate_count(queryset, cap=1000):
+    """Count up to ``cap`` rows. Returns (count, is_approximate)."""
+    count = queryset.order_by().values('pk')[:cap + 1].count()
+    return min(count, cap), count > cap
+
+
+def paginate(request, queryset, per_page, ordering=('-created_at', '-id'), with_total=False, total=None):
+    """Return the page of ``queryset`` named by the ``cursor`` query parameter.
+
+    ``next_url``/``previous_url`` keep the request's other parameters, so
+    search filters survive paging. Pass ``total`` when the count is already
+    known, e.g. stored, to skip counting.
+    """
+    page = CursorPaginator(queryset, per_page, ordering).page(request.GET.get('cursor'))
+    for attr, cursor in (('next_url', page.next_cursor), ('previous_url', page.previous_cursor)):
+        if cursor:
+            params = request.GET.copy()
+            params.pop('page', None)
+            params['cursor'] = cursor
+            setattr(page, attr, '?' + params.urlencode())
+    if total is not None:
+        page.total, page.total_is_approximate = total, False
+    elif with_total:
+        page.total, page.total_is_approximate = approximate_count(queryset)
+    return page
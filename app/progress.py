@@ -0,0 +1,246 @@
+"""Per-user watch progress with buffered writes.
+
+Player heartbeats land in an in-process buffer keyed by (user, video) and
+are written with bulk upserts once the buffer is large enough or old
+enough, so a heartbeat costs no database write of its own. A timer flushes
+the buffer when no more heartbeats come, so a crash loses at most
+PROGRESS_FLUSH_INTERVAL seconds of positions. Finishing a video is written
+at once, so every process sees it. Reads merge the buffer with the table,
+so a user always sees their latest position.
+"""
+import atexit
+import logging
+import operator
+import threading
+import time
+from functools import reduce
+
+from django.conf import settings
+from django.db import DataError, IntegrityError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from app.models import Video, WatchProgress
+
+logger = logging.getLogger(__name__)
+
+# A video counts as watched once this share of it has been played.
+COMPLETION_RATIO = 0.9
+COMPLETION_BATCH_SIZE = 200
+
+lock = threading.Lock()
+buffer = {}
+last_flush = time.monotonic()
+timer = None
+video_meta = {}
+
+
+def get_video_meta(video_id):
+    """Return (course_id, duration) of a video, cached for the life of the process.
+
+    A video whose duration is not probed yet is looked up again on the next
+    heartbeat, so completion starts counting once the probe job has run.
+    """
+    meta = video_meta.get(video_id)
+    if meta is None:
+        meta = Video.objects.filter(id=video_id).values_list('course_id', 'duration').first()
+        if meta is None:
+            return None
+        if meta[1] is not None:
+            video_meta[video_id] = meta
+    return meta
+
+
+def record(user_id, video_id, position=None, completed=False):
+    """Buffer a heartbeat. ``position=None`` only marks the video as last opened."""
+    meta = get_video_meta(video_id)
+    if meta is None:
+        return False
+    course_id, duration = meta
+    if position is not None and duration:
+        completed = completed or position >= duration * COMPLETION_RATIO
+
+    global timer
+    with lock:
+        previous = buffer.get((user_id, video_id))
+        finished = completed and not (previous and previous['completed'])
+        if previous is not None:
+            if position is None:
+                position = previous['position']
+            completed = completed or previous['completed']
+        entry = buffer[(user_id, video_id)] = {
+            'course_id': course_id,
+            'position': position,
+            'completed': completed,
+            'updated_at': timezone.now(),
+        }
+        due = (
+            len(buffer) >= settings.PROGRESS_FLUSH_SIZE
+            or time.monotonic() - last_flush >= settings.PROGRESS_FLUSH_INTERVAL
+        )
+        if not due and timer is None:
+            timer = threading.Timer(settings.PROGRESS_FLUSH_INTERVAL, flush_on_timer)
+            timer.daemon = True
+            timer.start()
+    if finished:
+        # Write completion through, so the other processes see it without waiting for this buffer.
+        WatchProgress.objects.bulk_create(
+            [WatchProgress(
+                user_id=user_id,
+                video_id=video_id,
+                course_id=course_id,
+                position=entry['position'] or 0,
+                completed=True,
+                updated_at=entry['updated_at'],
+            )],
+            update_conflicts=True,
+            unique_fields=['user', 'video'],
+            update_fields=['completed', 'updated_at'],
+        )
+    if due:
+        try:
+            flush()
+        except Exception:
+            # flush() put the heartbeats back; the next one tries again.
+            logger.exception("Could not flush watch progress")
+    return True
+
+
+def flush_on_timer():
+    """Flush what is left once heartbeats stop, from the timer's own thread."""
+    global timer
+    with lock:
+        timer = None
+    try:
+        flush()
+    except Exception:
+        logger.exception("Could not flush watch progress")
+    finally:
+        # The timer thread's connection is not closed by the request cycle.
+        connection.close()
+
+
+def flush():
+    """Write every buffered heartbeat with a few bulk queries.
+
+    If the database cannot be written, the heartbeats go back into the buffer
+    for the next flush instead of being lost.
+    """
+    global buffer, last_flush
+    with lock:
+        pending, buffer = buffer, {}
+        last_flush = time.monotonic()
+    if not pending:
+        return 0
+    try:
+        write(pending)
+    except Exception:
+        restore(pending)
+        raise
+    return len(pending)
+
+
+def restore(pending):
+    """Put unwritten heartbeats back, keeping anything newer recorded meanwhile."""
+    with lock:
+        for key, entry in pending.items():
+            newer = buffer.get(key)
+            if newer is None:
+                buffer[key] = entry
+                continue
+            if newer['position'] is None:
+                newer['position'] = entry['position']
+            newer['completed'] = newer['completed'] or entry['completed']
+
+
+def upsert(rows, update_fields):
+    """Bulk upsert ``rows``, falling back to one row at a time if the batch is refused.
+
+    A row the database rejects is logged and dropped, so it cannot hold back
+    the heartbeats of every other user.
+    """
+    try:
+        with transaction.atomic():
+            WatchProgress.objects.bulk_create(
+                rows, update_conflicts=True, unique_fields=['user', 'video'], update_fields=update_fields
+            )
+        return
+    except (IntegrityError, DataError):
+        if len(rows) == 1:
+            logger.exception("Dropped invalid watch progress for user %s, video %s", rows[0].user_id, rows[0].video_id)
+            return
+    for row in rows:
+        upsert([row], update_fields)
+
+
+def write(pending):
+    """Upsert ``pending`` heartbeats; rows of deleted videos are skipped."""
+    existing = set(Video.objects.filter(id__in={v for _, v in pending}).values_list('id', flat=True))
+    rows = {'position': [], 'touch': []}
+    finished = []
+    for (user_id, video_id), entry in pending.items():
+        if video_id not in existing:
+            video_meta.pop(video_id, None)
+            continue
+        row = WatchProgress(
+            user_id=user_id,
+            video_id=video_id,
+            course_id=entry['course_id'],
+            position=entry['position'] or 0,
+            completed=entry['completed'],
+            updated_at=entry['updated_at'],
+        )
+        rows['touch' if entry['position'] is None else 'position'].append(row)
+        if entry['completed']:
+            finished.append(row)
+
+    # Completion is only ever set, never cleared, so rewinding a watched video keeps it watched.
+    for kind, update_fields in (('position', ['position', 'updated_at']), ('touch', ['updated_at'])):
+        if rows[kind]:
+            upsert(rows[kind], update_fields)
+    for start in range(0, len(finished), COMPLETION_BATCH_SIZE):
+        batch = finished[start:start + COMPLETION_BATCH_SIZE]
+        pairs = reduce(operator.or_, (Q(user_id=row.user_id, video_id=row.video_id) for row in batch))
+        WatchProgress.objects.filter(pairs, completed=False).update(completed=True)
+
+
+def completed_video_ids(user, video_ids):
+    """Return the ids among ``video_ids`` the user has finished, buffered heartbeats included."""
+    if not user.is_authenticated or not video_ids:
+        return set()
+    completed = set(
+        WatchProgress.objects.filter(user=user, video_id__in=video_ids, completed=True)
+        .values_list('video_id', flat=True)
+    )
+    with lock:
+        completed.update(
+            video_id for (user_id, video_id), entry in buffer.items()
+            if user_id == user.id and entry['completed'] and video_id in video_ids
+        )
+    return completed
+
+
+def last_watched_video(user, course):
+    """Return the video of ``course`` the user opened most recently, or None."""
+    if not user.is_authenticated:
+        return None
+    with lock:
+        buffered = [
+            (entry['updated_at'], video_id)
+            for (user_id, video_id), entry in buffer.items()
+            if user_id == user.id and entry['course_id'] == course.id
+        ]
+    latest = (
+        WatchProgress.objects.filter(user=user, course=course)
+        .order_by('-updated_at')
+        .select_related('video')
+        .first()
+    )
+    if buffered:
+        updated_at, video_id = max(buffered)
+        if latest is None or updated_at > latest.updated_at:
+            return Video.objects.filter(id=video_id).first()
+    return latest.video if latest else None
+
+
+atexit.register(flush)
@@ -0,0 +1,179 @@
+"""Per-request query budgets and per-view timing.
+
+QueryBudgetMiddleware counts the SQL queries of every request and times
+the database, template rendering and the view, per resolved URL name. A
+request over any budget in settings.REQUEST_BUDGETS is logged as a
+warning along with its repeated SQL, which is usually a query run per
+row. The totals per view are kept in process and added to RequestStats
+every REQUEST_STATS_FLUSH_INTERVAL seconds; ``manage.py request_stats``
+reports them.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+from django.template.backends.django import Template
+
+logger = logging.getLogger(__name__)
+
+METRICS = ('requests', 'queries', 'db_time', 'template_time', 'view_time', 'over_budget')
+# How many repeated statements an over-budget warning lists.
+DUPLICATES_SHOWN = 5
+
+lock = threading.Lock()
+totals = {}
+last_flush = time.monotonic()
+local = threading.local()
+
+
+class RequestTimer:
+    """Queries and template time of the request running in this thread."""
+
+    def __init__(self):
+        self.queries = []
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.db_time += elapsed
+            self.queries.append(sql)
+
+
+def timed_render(render):
+    def wrapper(self, *args, **kwargs):
+        timer = getattr(local, 'timer', None)
+        if timer is None:
+            return render(self, *args, **kwargs)
+        # Only the outermost render counts, templates rendered inside it are part of its time.
+        timer.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            timer.template_depth -= 1
+            if not timer.template_depth:
+                timer.template_time += time.perf_counter() - started
+
+    wrapper.timed = True
+    return wrapper
+
+
+if not getattr(Template.render, 'timed', False):
+    Template.render = timed_render(Template.render)
+
+
+def duplicate_queries(queries, limit=DUPLICATES_SHOWN):
+    """Return (count, sql) for the statements run more than once, most repeated first."""
+    return [(count, sql) for sql, count in Counter(queries).most_common(limit) if count > 1]
+
+
+def get_budget(view_name):
+    budgets = settings.REQUEST_BUDGETS
+    return {**budgets['default'], **budgets.get(view_name, {})}
+
+
+def over_budget(view_name, measured):
+    """Return the names of the budgets ``measured`` exceeds."""
+    return [name for name, limit in get_budget(view_name).items() if measured[name] > limit]
+
+
+class QueryBudgetMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = local.timer = RequestTimer()
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(timer):
+                response = self.get_response(request)
+        finally:
+            local.timer = None
+        view_time = time.perf_counter() - started
+
+        match = request.resolver_match
+        if match is not None:
+            self.report(request, match.view_name, timer, view_time)
+        return response
+
+    def report(self, request, view_name, timer, view_time):
+        measured = {
+            'queries': len(timer.queries),
+            'db_ms': timer.db_time * 1000,
+            'template_ms': timer.template_time * 1000,
+            'view_ms': view_time * 1000,
+        }
+        exceeded = over_budget(view_name, measured)
+        if exceeded:
+            duplicates = ''.join(f'\n  {count}x {sql}' for count, sql in duplicate_queries(timer.queries))
+            logger.warning(
+                "%s %s over budget (%s): %d queries, %.1f ms db, %.1f ms templates, %.1f ms total.%s",
+                request.method, request.path, ', '.join(exceeded), measured['queries'], measured['db_ms'],
+                measured['template_ms'], measured['view_ms'], duplicates,
+            )
+        record(view_name, {
+            'requests': 1,
+            'queries': measured['queries'],
+            'db_time': timer.db_time,
+            'template_time': timer.template_time,
+            'view_time': view_time,
+            'over_budget': int(bool(exceeded)),
+        })
+
+
+def record(view_name, values):
+    with lock:
+        view_totals = totals.setdefault(view_name, Counter())
+        view_totals.update(values)
+        due = time.monotonic() - last_flush >= settings.REQUEST_STATS_FLUSH_INTERVAL
+    if due:
+        try:
+            flush()
+        except Exception:
+            # The totals stay buffered for the next flush; the request itself went fine.
+            logger.exception("Could not flush request stats")
+
+
+def flush():
+    """Add the totals gathered since the last flush to RequestStats.
+
+    If the database cannot be written, the totals not yet added go back into
+    the buffer for the next flush instead of being lost.
+    """
+    from app.models import RequestStats
+
+    global totals, last_flush
+    with lock:
+        pending, totals = totals, {}
+        last_flush = time.monotonic()
+    count = len(pending)
+    try:
+        for view_name in list(pending):
+            values = pending[view_name]
+            RequestStats.objects.get_or_create(view_name=view_name)
+            RequestStats.objects.filter(view_name=view_name).update(
+                **{metric: F(metric) + values[metric] for metric in METRICS}, updated_at=timezone.now()
+            )
+            del pending[view_name]
+    except Exception:
+        restore(pending)
+        raise
+    return count
+
+
+def restore(pending):
+    """Put unwritten totals back, adding them to anything recorded meanwhile."""
+    with lock:
+        for view_name, values in pending.items():
+            totals.setdefault(view_name, Counter()).update(values)
@@ -0,0 +1,198 @@
+"""Course search.
+
+Search goes through a backend chosen by settings.SEARCH_BACKEND. The
+default keeps an SQLite FTS5 table with one row per course (rowid =
+course id) over the course name, level and bodies in every language, its
+tags and its teacher, and ranks matches with BM25. IcontainsBackend is
+the portable fallback for other databases. Signals in app.signals keep
+the index in sync with writes, and ``manage.py rebuild_search_index``
+rebuilds it from scratch.
+"""
+import json
+import re
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from app.fuzzy import course_names_index
+from app.models import Course
+
+TOKEN_RE = re.compile(r'\w+')
+# Pagination order of search results, see search_courses().
+SEARCH_ORDERING = ('search_rank', 'id')
+
+
+def course_document(course):
+    """Return the indexed text of a course, with teacher and tags prefetched."""
+    def distinct(*values):
+        return ' '.join(dict.fromkeys(v for v in values if v))
+
+    teacher = course.teacher
+    return {
+        'name': distinct(course.name, course.name_uz, course.name_en, course.name_ru),
+        'level': distinct(course.level, course.level_uz, course.level_en, course.level_ru),
+        'body_uz': course.body_uz or '',
+        'body_en': course.body_en or '',
+        'body_ru': course.body_ru or '',
+        'tags': ' '.join(link.tag.name for link in course.course_tags.all()),
+        'teacher': distinct(teacher.username, teacher.first_name, teacher.last_name),
+    }
+
+
+def indexable_courses():
+    return Course.objects.select_related('teacher').prefetch_related('course_tags__tag')
+
+
+class SearchBackend:
+    def search(self, query, limit):
+        """Return up to ``limit`` matching course ids, best match first."""
+        raise NotImplementedError
+
+    def narrow(self, queryset, ids):
+        """Filter ``queryset`` to ``ids`` and annotate each row's position in it as ``search_rank``."""
+        rank = Case(*[When(pk=pk, then=Value(i)) for i, pk in enumerate(ids)], output_field=IntegerField())
+        return queryset.filter(pk__in=ids).annotate(search_rank=rank)
+
+    def update(self, course_ids):
+        pass
+
+    def remove(self, course_ids):
+        pass
+
+    def rebuild(self):
+        return 0
+
+
+class IcontainsBackend(SearchBackend):
+    def search(self, query, limit):
+        words = TOKEN_RE.findall(query)
+        if not words:
+            return []
+        condition = Q()
+        for word in words:
+            condition &= (
+                Q(name__icontains=word) | Q(body__icontains=word) | Q(level__icontains=word)
+                | Q(course_tags__tag__name__icontains=word) | Q(teacher__username__icontains=word)
+            )
+        return list(Course.objects.filter(condition).values_list('id', flat=True).distinct()[:limit])
+
+
+class SQLiteFTSBackend(SearchBackend):
+    table = 'app_course_fts'
+    columns = ('name', 'level', 'body_uz', 'body_en', 'body_ru', 'tags', 'teacher')
+    # BM25 weight of each column, in the order above: a hit in the name counts most.
+    weights = (10.0, 2.0, 1.0, 1.0, 1.0, 5.0, 3.0)
+    batch_size = 2000
+
+    @classmethod
+    def create_table(cls, cursor):
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {cls.table} USING fts5("
+            f"{', '.join(cls.columns)}, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+
+    @staticmethod
+    def match_expression(query):
+        # Every word must match, as a prefix, so "pyth dj" finds "Python Django".
+        # Quoting each word keeps FTS5 syntax characters in user input inert.
+        return ' '.join(f'"{word}"*' for word in TOKEN_RE.findall(query))
+
+    def search(self, query, limit):
+        expression = self.match_expression(query)
+        if not expression:
+            return []
+        weights = ', '.join(str(w) for w in self.weights)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s "
+                f"ORDER BY bm25({self.table}, {weights}) LIMIT %s",
+                [expression, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def narrow(self, queryset, ids):
+        # The ids go in as one string parameter instead of a CASE branch per id, which is slow
+        # to compile. A row's rank is where its id sits in that string, which keeps the order.
+        joined = ',' + ','.join(str(pk) for pk in ids) + ','
+        column = f'"{Course._meta.db_table}"."id"'
+        return queryset.filter(pk__in=RawSQL("SELECT value FROM json_each(%s)", [json.dumps(ids)])).annotate(
+            search_rank=RawSQL(f"instr(%s, ',' || {column} || ',')", [joined], IntegerField())
+        )
+
+    def write(self, cursor, courses):
+        rows = []
+        for course in courses:
+            document = course_document(course)
+            rows.append([course.id] + [document[column] for column in self.columns])
+        if rows:
+            placeholders = ', '.join(['%s'] * (len(self.columns) + 1))
+            cursor.executemany(
+                f"INSERT INTO {self.table} (rowid, {', '.join(self.columns)}) VALUES ({placeholders})", rows
+            )
+
+    def update(self, course_ids):
+        course_ids = list(course_ids)
+        if not course_ids:
+            return
+        with connection.cursor() as cursor:
+            self.delete_rows(cursor, course_ids)
+            self.write(cursor, indexable_courses().filter(id__in=course_ids))
+
+    def remove(self, course_ids):
+        with connection.cursor() as cursor:
+            self.delete_rows(cursor, list(course_ids))
+
+    def delete_rows(self, cursor, course_ids):
+        cursor.executemany(f"DELETE FROM {self.table} WHERE rowid = %s", [[pk] for pk in course_ids])
+
+    def rebuild(self):
+        count = 0
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {self.table}")
+            self.create_table(cursor)
+            batch = []
+            for course in indexable_courses().order_by('id').iterator(chunk_size=self.batch_size):
+                batch.append(course)
+                if len(batch) == self.batch_size:
+                    self.write(cursor, batch)
+                    count += len(batch)
+                    batch = []
+            self.write(cursor, batch)
+            count += len(batch)
+            cursor.execute(f"INSERT INTO {self.table}({self.table}) VALUES ('optimize')")
+        return count
+
+
+backend = None
+
+
+def get_backend():
+    global backend
+    if backend is None:
+        backend = import_string(settings.SEARCH_BACKEND)()
+    return backend
+
+
+def search_courses(queryset, query, fuzzy=False):
+    """Narrow ``queryset`` to courses matching ``query``, best first.
+
+    Matches are annotated with ``search_rank``, lower is better. With
+    ``fuzzy``, courses whose names only resemble the query (typos, the
+    other script) follow the exact matches.
+
+    A blank query returns ``queryset`` unchanged.
+    """
+    if not query.strip():
+        return queryset
+    backend = get_backend()
+    ids = backend.search(query, settings.SEARCH_MAX_RESULTS)
+    if fuzzy and len(ids) < settings.SEARCH_MAX_RESULTS:
+        found = set(ids)
+        similar = course_names_index.search(query, settings.SEARCH_MAX_RESULTS - len(ids))
+        ids += [pk for pk in similar if pk not in found]
+    if not ids:
+        return queryset.filter(pk__in=[]).annotate(search_rank=Value(0))
+    return backend.narrow(queryset, ids).order_by(*SEARCH_ORDERING)
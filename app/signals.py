@@ -0,0 +1,205 @@
+import shutil
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from app.categories import bump_version
+from app.facets import bump_facets_version
+from app.fragments import bump_content_version
+from app.fuzzy import course_names, course_names_index
+from app.models import Course, CourseTag, Lecture, Part, Rating, Tag, User, Video
+from app.search import get_backend
+from app.suggest import COURSE, PART, TEACHER, suggestions, teacher_labels, translated_labels
+from app.storage import content_storage
+
+# File fields kept in content-addressed storage, per model.
+STORED_FILE_FIELDS = {
+    Course: ['image'],
+    User: ['avatar'],
+    Video: ['file', 'web_file', 'poster'],
+}
+
+
+def release_files(names):
+    for name in names:
+        if name:
+            content_storage.delete(name)
+
+
+@receiver(pre_save)
+def remember_replaced_files(sender, instance, **kwargs):
+    fields = STORED_FILE_FIELDS.get(sender)
+    if not fields or instance.pk is None:
+        return
+    # Only look up the old names when a new file is about to be stored.
+    new_fields = [f for f in fields if getattr(instance, f) and not getattr(instance, f)._committed]
+    if not new_fields:
+        return
+    old = sender.objects.filter(pk=instance.pk).values(*new_fields).first()
+    if old:
+        instance._replaced_files = [old[f] for f in new_fields]
+
+
+@receiver(post_save)
+def release_replaced_files(sender, instance, **kwargs):
+    replaced = getattr(instance, '_replaced_files', None)
+    if replaced:
+        del instance._replaced_files
+        release_files(replaced)
+
+
+@receiver(post_delete)
+def release_deleted_files(sender, instance, **kwargs):
+    fields = STORED_FILE_FIELDS.get(sender)
+    if not fields:
+        return
+    release_files([getattr(instance, field).name for field in fields])
+
+
+@receiver(post_delete, sender=Video)
+def remove_hls_ladder(sender, instance, **kwargs):
+    # The ladder is not a file field, so nothing else removes it; nothing is removed if the delete rolls back.
+    path = Video.file.field.storage.path(instance.hls_dir)
+    transaction.on_commit(lambda: shutil.rmtree(path, ignore_errors=True))
+
+
+@receiver(post_delete, sender=Rating)
+def remove_deleted_rating(sender, instance, **kwargs):
+    # Runs inside the delete's transaction, cascades from User or Review included.
+    Course.apply_rating(instance.course_id, instance.rating, delta=-1)
+
+
+@receiver(post_delete, sender=CourseTag)
+def remove_deleted_course_tag(sender, instance, **kwargs):
+    Tag.apply_course(instance.tag_id, delta=-1)
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+@receiver(post_save, sender=Part)
+@receiver(post_delete, sender=Part)
+def invalidate_categories(sender, **kwargs):
+    bump_version()
+
+
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+@receiver(post_save, sender=CourseTag)
+@receiver(post_delete, sender=CourseTag)
+@receiver(post_save, sender=Tag)
+def invalidate_facets(sender, **kwargs):
+    # Ratings move courses between rating buckets; tags change which courses a query matches.
+    bump_facets_version()
+
+
+# Fields of User that appear in the search index.
+TEACHER_SEARCH_FIELDS = {'username', 'first_name', 'last_name'}
+
+
+@receiver(post_save, sender=Course)
+def index_course(sender, instance, **kwargs):
+    get_backend().update([instance.pk])
+
+
+@receiver(post_delete, sender=Course)
+def unindex_course(sender, instance, **kwargs):
+    get_backend().remove([instance.pk])
+
+
+@receiver(post_save, sender=CourseTag)
+@receiver(post_delete, sender=CourseTag)
+def reindex_tagged_course(sender, instance, **kwargs):
+    get_backend().update([instance.course_id])
+
+
+@receiver(post_save, sender=Tag)
+def reindex_renamed_tag(sender, instance, created, **kwargs):
+    if not created:
+        get_backend().update(instance.course_tags.values_list('course_id', flat=True))
+
+
+@receiver(post_save, sender=User)
+def reindex_teacher_courses(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not TEACHER_SEARCH_FIELDS & set(update_fields):
+        return
+    get_backend().update(Course.objects.filter(teacher=instance).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Course)
+def suggest_course(sender, instance, **kwargs):
+    course_names_index.update(instance.pk, course_names(instance))
+    suggestions.update(COURSE, instance.pk, translated_labels(instance))
+    if not suggestions.contains(TEACHER, instance.teacher_id):
+        suggestions.update(TEACHER, instance.teacher_id, teacher_labels(instance.teacher), weight=1)
+
+
+@receiver(post_delete, sender=Course)
+def unsuggest_course(sender, instance, **kwargs):
+    course_names_index.update(instance.pk, None)
+    suggestions.update(COURSE, instance.pk, None)
+
+
+@receiver(post_save, sender=Part)
+def suggest_part(sender, instance, **kwargs):
+    suggestions.update(PART, instance.pk, translated_labels(instance))
+
+
+@receiver(post_delete, sender=Part)
+def unsuggest_part(sender, instance, **kwargs):
+    suggestions.update(PART, instance.pk, None)
+
+
+@receiver(post_save, sender=User)
+def suggest_teacher(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not TEACHER_SEARCH_FIELDS & set(update_fields):
+        return
+    if suggestions.contains(TEACHER, instance.pk):
+        suggestions.update(TEACHER, instance.pk, teacher_labels(instance))
+
+
+# Fields of User that appear in the cached teacher card.
+TEACHER_CARD_FIELDS = {'username', 'avatar'}
+
+
+@receiver(post_save, sender=Lecture)
+@receiver(post_delete, sender=Lecture)
+@receiver(post_save, sender=Video)
+@receiver(post_delete, sender=Video)
+@receiver(post_save, sender=CourseTag)
+@receiver(post_delete, sender=CourseTag)
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def invalidate_course_fragments(sender, instance, **kwargs):
+    bump_content_version([instance.course_id])
+
+
+@receiver(m2m_changed, sender=Lecture.videos.through)
+def invalidate_syllabus(sender, instance, action, **kwargs):
+    # Lectures and videos both carry course_id, whichever side changed.
+    if action.startswith('post_'):
+        bump_content_version([instance.course_id])
+
+
+@receiver(m2m_changed, sender=Course.students.through)
+def invalidate_enrolled_courses(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            bump_content_version([instance.pk])
+    elif action == 'pre_clear':
+        bump_content_version(instance.student.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        bump_content_version(pk_set)
+
+
+@receiver(post_save, sender=Tag)
+def invalidate_renamed_tag(sender, instance, created, **kwargs):
+    if not created:
+        bump_content_version(instance.course_tags.values_list('course_id', flat=True))
+
+
+@receiver(post_save, sender=User)
+def invalidate_teacher_courses(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not TEACHER_CARD_FIELDS & set(update_fields):
+        return
+    bump_content_version(Course.objects.filter(teacher=instance).values_list('id', flat=True))
@@ -0,0 +1,119 @@
+import hashlib
+import os
+import posixpath
+
+from django.apps import apps
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+
+DIGEST_LENGTH = 64
+
+
+def hash_content(content):
+    """Return the sha256 hex digest and size of a File, leaving it rewound."""
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in content.chunks():
+        digest.update(chunk)
+        size += len(chunk)
+    content.seek(0)
+    return digest.hexdigest(), size
+
+
+def content_name(name, digest):
+    """Map an upload name like ``videos/intro.mp4`` to ``videos/ab/cd/abcd....mp4``."""
+    directory = posixpath.dirname(name)
+    extension = os.path.splitext(name)[1].lower()
+    return posixpath.join(directory, digest[:2], digest[2:4], digest + extension)
+
+
+def is_content_name(name):
+    parts = name.split('/')
+    if len(parts) < 3:
+        return False
+    digest = os.path.splitext(parts[-1])[0]
+    return (
+        len(digest) == DIGEST_LENGTH
+        and parts[-3] == digest[:2]
+        and parts[-2] == digest[2:4]
+    )
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage that names files after the sha256 of their content.
+
+    Uploading bytes that are already stored reuses the existing file, and
+    every stored name carries a reference count in StoredFile. delete()
+    drops one reference. When the last one goes, the file is removed once
+    the transaction commits, unless a save of the same bytes counted a new
+    reference in the meantime.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        digest, size = hash_content(content)
+        name = content_name(name, digest)
+        self.write_missing(name, content)
+        self.add_reference(name, size)
+        # A delete() of the last earlier reference may have removed the file before ours was counted.
+        self.write_missing(name, content)
+        return name
+
+    def write_missing(self, name, content):
+        if self.exists(name):
+            return
+        content.seek(0)
+        try:
+            self._save(name, content)
+        except FileExistsError:
+            # Someone else stored the same bytes first.
+            pass
+
+    def get_available_name(self, name, max_length=None):
+        # Content names never need a suffix: an existing file already holds these bytes.
+        if self.exists(name):
+            raise FileExistsError(name)
+        return name
+
+    def add_reference(self, name, size):
+        StoredFile = apps.get_model('app', 'StoredFile')
+        while True:
+            with transaction.atomic():
+                stored, _ = StoredFile.objects.get_or_create(name=name, defaults={'size': size})
+                # No row updated means remove_unreferenced deleted it meanwhile, so create it again.
+                if StoredFile.objects.filter(pk=stored.pk).update(refcount=F('refcount') + 1):
+                    return
+
+    def delete(self, name):
+        StoredFile = apps.get_model('app', 'StoredFile')
+        with transaction.atomic():
+            stored = StoredFile.objects.select_for_update().filter(name=name).first()
+            if stored is not None:
+                if stored.refcount > 1:
+                    StoredFile.objects.filter(pk=stored.pk).update(refcount=F('refcount') - 1)
+                    return
+                StoredFile.objects.filter(pk=stored.pk).update(refcount=0)
+            # Nothing is removed if the caller's transaction rolls back.
+            transaction.on_commit(lambda: self.remove_unreferenced(name))
+
+    def remove_unreferenced(self, name):
+        """Delete a file whose last reference is gone, unless a save counted a new one since."""
+        StoredFile = apps.get_model('app', 'StoredFile')
+        with transaction.atomic():
+            stored = StoredFile.objects.select_for_update().filter(name=name).first()
+            if stored is not None:
+                if stored.refcount:
+                    return
+                stored.delete()
+            super().delete(name)
+
+
+content_storage = ContentAddressedStorage()
@@ -0,0 +1,221 @@
+"""Search-as-you-type suggestions from an in-process prefix index.
+
+Each language has a sorted array of (key, kind, id) entries, with one key
+for every word of a course, part or teacher name, so "dja" finds "Python
+Django". A lookup bisects to the first key with the prefix and reads
+forward. The index is built on first use in each process. Signals in
+app.signals patch it when a Course, Part or teacher changes. Writes made
+by other processes are picked up by a full rebuild once the index is
+SUGGEST_INDEX_MAX_AGE seconds old. The rebuild runs once, in a background
+thread, while requests keep reading the old index until the new one is
+swapped in.
+"""
+import heapq
+import logging
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count
+from django.urls import reverse
+
+from app.categories import get_categories
+from app.models import Course, Part, User
+
+logger = logging.getLogger(__name__)
+
+COURSE = 'course'
+PART = 'part'
+TEACHER = 'teacher'
+# How many entries sharing a prefix are considered when ranking, so one-letter prefixes stay cheap.
+SCAN_LIMIT = 2000
+
+
+def fold(text):
+    """Lowercase ``text`` and strip accents, so "Öz" and "oz" share keys."""
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def name_keys(name):
+    words = fold(name).split()
+    return sorted({' '.join(words[i:]) for i in range(len(words))})
+
+
+class PrefixIndex:
+    def __init__(self):
+        self.entries = []
+        self.items = {}
+
+    def add(self, kind, pk, label, weight, keep_sorted=True):
+        keys = name_keys(label)
+        self.items[kind, pk] = (label, weight, keys)
+        for key in keys:
+            if keep_sorted:
+                insort(self.entries, (key, kind, pk))
+            else:
+                self.entries.append((key, kind, pk))
+
+    def remove(self, kind, pk):
+        item = self.items.pop((kind, pk), None)
+        if item is None:
+            return
+        for key in item[2]:
+            i = bisect_left(self.entries, (key, kind, pk))
+            if i < len(self.entries) and self.entries[i] == (key, kind, pk):
+                del self.entries[i]
+
+    def lookup(self, prefix, limit):
+        prefix = fold(prefix).strip()
+        if not prefix:
+            return []
+        start = bisect_left(self.entries, (prefix,))
+        found = {}
+        for key, kind, pk in self.entries[start:start + SCAN_LIMIT]:
+            if not key.startswith(prefix):
+                break
+            found[kind, pk] = self.items[kind, pk]
+        best = heapq.nlargest(limit, found.items(), key=lambda item: (item[1][1], -len(item[1][0])))
+        return [(kind, pk, label) for (kind, pk), (label, weight, keys) in best]
+
+
+def language_field(name, language):
+    return f'{name}_{language}'
+
+
+class Suggestions:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()
+        self.indexes = None
+        self.built_at = 0
+        self.rebuilding = False
+        # Updates made while a rebuild runs, replayed onto the new index before it is swapped in.
+        self.missed = []
+
+    def languages(self):
+        return [code for code, _ in settings.LANGUAGES]
+
+    def build(self):
+        indexes = {language: PrefixIndex() for language in self.languages()}
+        names = [language_field('name', language) for language in indexes]
+        courses = Course.objects.annotate(weight=Count('students')).values('id', 'name', 'weight', *names)
+        for course in courses.iterator():
+            for language, index in indexes.items():
+                label = course[language_field('name', language)] or course['name']
+                index.add(COURSE, course['id'], label, course['weight'], keep_sorted=False)
+        for part in Part.objects.annotate(weight=Count('parts')).values('id', 'name', 'weight', *names):
+            for language, index in indexes.items():
+                label = part[language_field('name', language)] or part['name']
+                index.add(PART, part['id'], label, part['weight'], keep_sorted=False)
+        teachers = User.objects.annotate(weight=Count('teacher')).filter(weight__gt=0)
+        for teacher in teachers.only('id', 'username', 'first_name', 'last_name'):
+            for index in indexes.values():
+                index.add(TEACHER, teacher.id, teacher_label(teacher), teacher.weight, keep_sorted=False)
+        for index in indexes.values():
+            index.entries.sort()
+        return indexes
+
+    def get_indexes(self):
+        if self.indexes is None:
+            # Nothing to serve yet, so the first build is waited for, once.
+            with self.build_lock:
+                if self.indexes is None:
+                    indexes = self.build()
+                    with self.lock:
+                        self.indexes, self.built_at = indexes, time.monotonic()
+        elif time.monotonic() - self.built_at > settings.SUGGEST_INDEX_MAX_AGE:
+            self.start_rebuild()
+        return self.indexes
+
+    def start_rebuild(self):
+        with self.lock:
+            if self.rebuilding:
+                return
+            self.rebuilding = True
+        thread = threading.Thread(target=self.rebuild, daemon=True)
+        thread.start()
+
+    def rebuild(self):
+        """Build a fresh index and swap it in, from the rebuild thread."""
+        try:
+            indexes = self.build()
+            with self.lock:
+                for update in self.missed:
+                    self.apply(indexes, *update)
+                self.indexes = indexes
+        except Exception:
+            logger.exception("Could not rebuild the suggestion index")
+        finally:
+            with self.lock:
+                # A failed rebuild is retried once the index is SUGGEST_INDEX_MAX_AGE old again.
+                self.built_at = time.monotonic()
+                self.rebuilding = False
+                self.missed = []
+            # The rebuild thread's connection is not closed by the request cycle.
+            connection.close()
+
+    def suggest(self, prefix, language, limit):
+        index = self.get_indexes().get(language)
+        if index is None:
+            return []
+        with self.lock:
+            found = index.lookup(prefix, limit)
+        return [{'type': kind, 'id': pk, 'label': label, 'url': suggestion_url(kind, pk)} for kind, pk, label in found]
+
+    def update(self, kind, pk, labels, weight=None):
+        """Replace one item, keeping its weight unless given.
+
+        ``labels`` maps each language to the item's name in it; None removes the item.
+        """
+        if self.indexes is None:
+            return
+        with self.lock:
+            self.apply(self.indexes, kind, pk, labels, weight)
+            if self.rebuilding:
+                self.missed.append((kind, pk, labels, weight))
+
+    @staticmethod
+    def apply(indexes, kind, pk, labels, weight):
+        for language, index in indexes.items():
+            if weight is None:
+                weight = index.items.get((kind, pk), (None, 0))[1]
+            index.remove(kind, pk)
+            if labels is not None:
+                index.add(kind, pk, labels[language], weight)
+
+    def contains(self, kind, pk):
+        if self.indexes is None:
+            return False
+        return any((kind, pk) in index.items for index in self.indexes.values())
+
+
+def teacher_label(user):
+    full_name = f'{user.first_name} {user.last_name}'.strip()
+    return f'{full_name} ({user.username})' if full_name else user.username
+
+
+def suggestion_url(kind, pk):
+    if kind == COURSE:
+        return reverse('detail', args=[pk])
+    if kind == PART:
+        slugs = {part.id: part.slug for part in get_categories()}
+        return reverse('product_list_by_category', args=[slugs[pk]]) if pk in slugs else None
+    return reverse('account', args=[pk])
+
+
+def translated_labels(instance):
+    return {
+        language: getattr(instance, language_field('name', language)) or instance.name
+        for language in suggestions.languages()
+    }
+
+
+def teacher_labels(user):
+    return dict.fromkeys(suggestions.languages(), teacher_label(user))
+
+
+suggestions = Suggestions()
@@ -0,0 +1,9 @@
+from django import template
+
+register = template.Library()
+
+
+@register.inclusion_tag('front/comment_thread.html')
+def comment_thread(comment):
+    """Render a comment from app.comments.comment_page or attach_replies with its replies nested below it."""
+    return {'comment': comment}
@@ -0,0 +1,31 @@
+from django import template
+
+from app import fragments
+
+register = template.Library()
+
+
+class CachedFragmentNode(template.Node):
+    def __init__(self, nodelist, name, course):
+        self.nodelist = nodelist
+        self.name = name
+        self.course = course
+
+    def render(self, context):
+        return fragments.cached_fragment(
+            self.name.resolve(context), self.course.resolve(context), lambda: self.nodelist.render(context)
+        )
+
+
+@register.tag
+def cached_fragment(parser, token):
+    """Cache the enclosed template per course, see app.fragments.
+
+    Usage: {% cached_fragment "name" course %} ... {% endcached_fragment %}
+    """
+    bits = token.split_contents()
+    if len(bits) != 3:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' takes a fragment name and a course.")
+    nodelist = parser.parse(('endcached_fragment',))
+    parser.delete_first_token()
+    return CachedFragmentNode(nodelist, parser.compile_filter(bits[1]), parser.compile_filter(bits[2]))
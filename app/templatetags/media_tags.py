@@ -0,0 +1,63 @@
+from functools import lru_cache
+
+from django import template
+from django.contrib.staticfiles import finders
+from django.templatetags.static import static
+from django.urls import reverse
+from django.utils.html import format_html, format_html_join
+
+from app.media import IMAGE_WIDTHS
+
+register = template.Library()
+
+DEFAULT_SIZES = "(min-width: 1200px) 25vw, (min-width: 576px) 50vw, 100vw"
+# hls.js is served from our own static files like plyr, never from a third-party CDN.
+HLS_JS = 'assets/vendor/hls/hls.min.js'
+
+
+def derivative_srcset(name, fmt):
+    return ', '.join(
+        f"{reverse('image_derivative', args=[width, fmt, name])} {width}w" for width in IMAGE_WIDTHS
+    )
+
+
+@register.simple_tag
+def responsive_image(image, sizes=DEFAULT_SIZES, **attrs):
+    """Render an image field as a <picture> with WebP and JPEG srcsets.
+
+    Extra keyword arguments (``class``, ``alt``, ...) become attributes of
+    the <img>. Missing derivatives are queued by image_derivative and
+    encoded by the media worker.
+    """
+    if not image:
+        return ''
+    attrs.setdefault('alt', '')
+    attrs.setdefault('loading', 'lazy')
+    fallback = reverse('image_derivative', args=[IMAGE_WIDTHS[len(IMAGE_WIDTHS) // 2], 'jpg', image.name])
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}" />'
+        '<img src="{}" srcset="{}" sizes="{}"{} /></picture>',
+        derivative_srcset(image.name, 'webp'),
+        sizes,
+        fallback,
+        derivative_srcset(image.name, 'jpg'),
+        sizes,
+        format_html_join('', ' {}="{}"', attrs.items()),
+    )
+
+
+@lru_cache(maxsize=None)
+def is_vendored(path):
+    return finders.find(path) is not None
+
+
+@register.simple_tag
+def hls_js():
+    """Render the <script> of the vendored hls.js, or nothing when it is not installed.
+
+    Without it, Safari still plays the HLS ladder natively and other
+    browsers play the MP4 source.
+    """
+    if not is_vendored(HLS_JS):
+        return ''
+    return format_html('<script src="{}"></script>', static(HLS_JS))
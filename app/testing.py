@@ -0,0 +1,28 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from app import querybudget
+
+
+class QueryBudgetMixin:
+    """TestCase mixin for keeping views within a query budget."""
+
+    def assertViewQueryBudget(self, url, n, **kwargs):
+        """GET ``url`` with the test client and fail if it runs more than ``n`` queries.
+
+        The failure lists every query and the repeated ones. Returns the response.
+        """
+        # Keep a stats flush from landing inside the measured request.
+        querybudget.last_flush = querybudget.time.monotonic()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, **kwargs)
+        self.assertEqual(response.status_code, 200, url)
+        queries = [query['sql'] for query in context.captured_queries]
+        if len(queries) > n:
+            listing = '\n'.join(f'{i}. {sql}' for i, sql in enumerate(queries, start=1))
+            duplicates = '\n'.join(f'{count}x {sql}' for count, sql in querybudget.duplicate_queries(queries))
+            self.fail(
+                f"{url} ran {len(queries)} queries, budget is {n}.\n{listing}\n"
+                f"Repeated:\n{duplicates or 'none'}"
+            )
+        return response
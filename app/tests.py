@@ -1,3 +1,1480 @@
-from django.test import TestCase
+import hashlib
+import json
+import os
+import tempfile
+import unittest
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, OperationalError, connection, transaction
+from django.db.models import F
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from app import jobs, progress, querybudget, views
+from app.categories import VERSION_KEY, get_categories
+from app.comments import COMMENTS_PER_PAGE, REVIEWS_PER_PAGE, comment_page, review_page
+from app.facets import facet_counts
+from app.fragments import fragment_stats, metrics, version_key
+from app.fuzzy import course_names_index
+from app.media import HLS_MASTER_PLAYLIST, derivative_name, evict_derivatives, package_hls, run_ffmpeg
+from app.pagination import CursorPaginator
+from app.search import search_courses
+from app.storage import content_name, content_storage, is_content_name
+from app.suggest import suggestions
+from app.models import Comment, Course, CourseTag, Lecture, Part, Rating, Review, Tag, User, Video, MediaJob, RequestStats, StoredFile, VideoUpload, WatchProgress
+from app.templatetags.media_tags import is_vendored
+from app.testing import QueryBudgetMixin
+
+
+def png_bytes(width=8, height=8, color='teal'):
+    content = BytesIO()
+    Image.new('RGB', (width, height), color).save(content, 'PNG')
+    return content.getvalue()
+
+
+def setUpModule():
+    # The fragment and shared caches are directories shared by every process; the tests get their own.
+    tmp = tempfile.TemporaryDirectory()
+    fragments = override_settings(CACHES={
+        **settings.CACHES,
+        **{
+            alias: {**settings.CACHES[alias], 'LOCATION': os.path.join(tmp.name, alias)}
+            for alias in (settings.FRAGMENT_CACHE_ALIAS, settings.SHARED_CACHE_ALIAS)
+        },
+    })
+    fragments.enable()
+    unittest.addModuleCleanup(tmp.cleanup)
+    unittest.addModuleCleanup(fragments.disable)
+
+
+class TemporaryMediaMixin:
+    """Store uploads in a directory of the test's own, removed afterwards."""
+
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.media_root = tmp.name
+        media = override_settings(MEDIA_ROOT=tmp.name, CHUNKED_UPLOAD_DIR=os.path.join(tmp.name, 'uploads'))
+        media.enable()
+        self.addCleanup(media.disable)
+
+
+class CatalogQueryCountTests(TestCase):
+    """Catalog pages must not run a query per listed course."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = User.objects.create_user(username='teacher', password='x', user_type=User.TEACHER)
+        cls.student = User.objects.create_user(username='student', password='x')
+        cls.part = Part.objects.create(name='Programming', slug='programming')
+
+    def add_courses(self, n):
+        tag, _ = Tag.objects.get_or_create(name='python')
+        for i in range(n):
+            course = Course.objects.create(
+                name=f'Course {i}', teacher=self.teacher, body='body', level='Beginner', price=i, part=self.part
+            )
+            course.students.add(self.student)
+            course.like.add(self.student)
+            Lecture.objects.create(name='Intro', user=self.teacher, course=course)
+            Rating.objects.create(user=self.student, course=course, rating=4)
+            CourseTag.objects.create(course=course, tag=tag)
+
+    def queries_for(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_catalog_query_count_does_not_grow_with_courses(self):
+        self.client.force_login(self.student)
+        urls = [
+            reverse('home'),
+            reverse('courses'),
+            reverse('courses_tag', args=['python']),
+            reverse('search') + '?query=Course',
+            reverse('full_search') + '?quer=Course',
+            reverse('product_list_by_category', args=[self.part.slug]),
+        ]
+        self.add_courses(2)
+        # Built on first use in the process, not per request.
+        course_names_index.index = None
+        course_names_index.get_index()
+        few = {url: self.queries_for(url) for url in urls}
+        self.add_courses(20)
+        many = {url: self.queries_for(url) for url in urls}
+        self.assertEqual(few, many)
+
+    def test_card_annotations(self):
+        self.add_courses(1)
+        course = Course.objects.with_card_data(self.student).get()
+        self.assertEqual(course.student_count, 1)
+        self.assertEqual(course.like_count, 1)
+        self.assertEqual(course.lecture_count, 1)
+        self.assertEqual(course.average_rating, 4.0)
+        self.assertTrue(course.liked)
+
+    def test_cursor_pages_walk_forward_and_back(self):
+        self.add_courses(10)
+        paginator = CursorPaginator(Course.objects.all(), 4)
+        first = paginator.page()
+        second = paginator.page(first.next_cursor)
+        third = paginator.page(second.next_cursor)
+        self.assertEqual([len(first), len(second), len(third)], [4, 4, 2])
+        self.assertFalse(third.has_next)
+        back = paginator.page(second.previous_cursor)
+        self.assertEqual(list(back), list(first))
+        self.assertFalse(back.has_previous)
+        self.assertEqual(list(paginator.page('tampered')), list(first))
+
+
+class CategoryCacheTests(TestCase):
+    def setUp(self):
+        caches[settings.SHARED_CACHE_ALIAS].clear()
+        self.teacher = User.objects.create_user(username='teacher', password='x')
+        self.part = Part.objects.create(name='Design', slug='design')
+
+    def test_categories_are_cached_until_a_course_changes(self):
+        self.assertEqual([p.course_count for p in get_categories()], [0])
+        with self.assertNumQueries(0):
+            get_categories()
+        Course.objects.create(name='Logo', teacher=self.teacher, body='body', level='Beginner', price=0, part=self.part)
+        self.assertEqual([p.course_count for p in get_categories()], [1])
+
+    def test_a_bump_in_another_process_is_seen(self):
+        get_categories()
+        Course.objects.bulk_create([
+            Course(name='Logo', teacher=self.teacher, body='body', level='Beginner', price=0, part=self.part)
+        ])
+        # What another process's signal does: bump the version in the cache they share.
+        caches[settings.SHARED_CACHE_ALIAS].incr(VERSION_KEY)
+        self.assertEqual([p.course_count for p in get_categories()], [1])
+
+
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        self.teacher = User.objects.create_user(username='karimov', password='x', first_name='Aziz')
+        self.part = Part.objects.create(name='Programming', slug='programming')
+
+    def create_course(self, name, body='', **kwargs):
+        return Course.objects.create(
+            name=name, body=body, teacher=self.teacher, level='Beginner', price=0, part=self.part, **kwargs
+        )
+
+    def search(self, query):
+        return list(search_courses(Course.objects.all(), query).values_list('name', flat=True))
+
+    def test_name_matches_rank_above_body_matches(self):
+        self.create_course('Web basics', body='Python for the web')
+        self.create_course('Python', body='Learn it')
+        self.assertEqual(self.search('pyth'), ['Python', 'Web basics'])
+
+    def test_index_follows_writes(self):
+        course = self.create_course('Django')
+        CourseTag.objects.create(course=course, tag=Tag.objects.create(name='backend'))
+        self.assertEqual(self.search('backend'), ['Django'])
+        self.assertEqual(self.search('aziz'), ['Django'])
+        course.name = 'Flask'
+        course.save()
+        self.assertEqual(self.search('django'), [])
+        course.delete()
+        self.assertEqual(self.search('flask'), [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.create_course('C++ "pointers"')
+        self.assertEqual(self.search('"pointers" OR NEAR('), [])
+        self.assertEqual(self.search('pointers)'), ['C++ "pointers"'])
+
+
+
+class TagTests(TestCase):
+    def setUp(self):
+        self.teacher = User.objects.create_user(username='karimov', password='x')
+        self.part = Part.objects.create(name='Programming', slug='programming')
+        self.tag = Tag.objects.create(name='Web Dev')
+        self.courses = [
+            Course.objects.create(
+                name=f'Course {i}', teacher=self.teacher, body='', level='Beginner', price=0, part=self.part
+            )
+            for i in range(3)
+        ]
+        for course in self.courses:
+            CourseTag.objects.create(course=course, tag=self.tag)
+
+    def test_course_count_follows_links(self):
+        self.assertEqual(self.tag.slug, 'web-dev')
+        self.tag.refresh_from_db()
+        self.assertEqual(self.tag.course_count, 3)
+        CourseTag.objects.filter(course=self.courses[0]).delete()
+        self.courses[1].delete()
+        self.tag.refresh_from_db()
+        self.assertEqual(self.tag.course_count, 1)
+        Tag.objects.update(course_count=0)
+        Tag.recount()
+        self.tag.refresh_from_db()
+        self.assertEqual(self.tag.course_count, 1)
+
+    def test_tag_page_lists_cards_with_stored_total(self):
+        url = reverse('courses_tag', args=[self.tag.slug])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(len([q for q in queries if 'app_coursetag' in q['sql']]), 1)
+        page = response.context['courses']
+        self.assertEqual((page.total, page.total_is_approximate), (3, False))
+        self.assertEqual([c.name for c in page.object_list], ['Course 2', 'Course 1', 'Course 0'])
+        self.assertEqual(page.object_list[0].lecture_count, 0)
+        self.assertEqual(self.client.get(reverse('courses_tag', args=['missing'])).status_code, 404)
+
+    def test_renaming_a_tag_reindexes_its_courses(self):
+        self.tag.name = 'Backend'
+        self.tag.save()
+        found = search_courses(Course.objects.all(), 'backend').values_list('name', flat=True)
+        self.assertEqual(sorted(found), ['Course 0', 'Course 1', 'Course 2'])
+
+class FacetTests(TestCase):
+    def setUp(self):
+        caches[settings.SHARED_CACHE_ALIAS].clear()
+        teacher = User.objects.create_user(username='teacher', password='x')
+        student = User.objects.create_user(username='student', password='x')
+        design = Part.objects.create(name='Design', slug='design')
+        code = Part.objects.create(name='Code', slug='code')
+        for part, price, level, stars in [
+            (design, 0, 'Beginner', 5), (design, 10, 'Advanced', 3), (code, 0, 'Beginner', 4), (code, 20, 'Beginner', None),
+        ]:
+            course = Course.objects.create(name='Course', teacher=teacher, body='', level=level, price=price, part=part)
+            if stars:
+                Rating.objects.create(user=student, course=course, rating=stars)
+
+    def test_each_facet_ignores_its_own_filter(self):
+        get_categories()
+        with self.assertNumQueries(1):
+            counts = facet_counts(Course.objects.all(), '', {'price_level': 'Free', 'category': 'design'})
+        self.assertEqual(counts['category'], {'design': 1, 'code': 1})
+        self.assertEqual(counts['price_level'], {'Free': 1, 'Paid': 1})
+        self.assertEqual(counts['skill_level'], {'Beginner': 1})
+        self.assertEqual(counts['rating'], {4: 1, 3: 1, 2: 1, 1: 1})
+
+    def test_rows_are_cached_per_normalized_query(self):
+        facet_counts(Course.objects.all(), 'Course  web', {})
+        with self.assertNumQueries(0):
+            facet_counts(Course.objects.all(), 'web course', {'rating': '4'})
+
+    def test_rating_changes_retire_cached_rows(self):
+        self.assertEqual(facet_counts(Course.objects.all(), '', {})['rating'], {4: 2, 3: 3, 2: 3, 1: 3})
+        unrated = Course.objects.get(price=20)
+        Rating.objects.create(user=unrated.teacher, course=unrated, rating=5)
+        self.assertEqual(facet_counts(Course.objects.all(), '', {})['rating'], {4: 3, 3: 4, 2: 4, 1: 4})
+
+
+class SuggestTests(TestCase):
+    def setUp(self):
+        caches[settings.SHARED_CACHE_ALIAS].clear()
+        suggestions.indexes = None
+        self.teacher = User.objects.create_user(username='karimov', password='x', first_name='Aziz')
+        self.part = Part.objects.create(name='Dasturlash', name_en='Programming', slug='programming')
+        self.course = Course.objects.create(
+            name='Python Django', teacher=self.teacher, body='', level='Beginner', price=0, part=self.part
+        )
+
+    def labels(self, prefix):
+        response = self.client.get(reverse('suggest'), {'q': prefix})
+        return [(r['type'], r['label']) for r in response.json()['results']]
+
+    def test_prefix_of_any_word_per_language(self):
+        self.assertEqual(self.labels('dja'), [('course', 'Python Django')])
+        self.assertEqual(self.labels('dast'), [('part', 'Dasturlash')])
+        self.assertEqual(self.labels('aziz'), [('teacher', 'Aziz (karimov)')])
+        self.assertEqual(suggestions.suggest('prog', 'en', 5)[0]['label'], 'Programming')
+
+    def test_index_is_patched_on_writes(self):
+        self.labels('py')
+        self.course.name = 'Flask'
+        self.course.save()
+        with self.assertNumQueries(0):
+            self.assertEqual([r['label'] for r in suggestions.suggest('fla', 'uz', 5)], ['Flask'])
+        self.course.delete()
+        self.assertEqual(suggestions.suggest('fla', 'uz', 5), [])
+
+    def test_stale_index_is_served_while_one_rebuild_runs(self):
+        self.labels('py')
+        stale = suggestions.indexes
+        suggestions.built_at -= settings.SUGGEST_INDEX_MAX_AGE + 1
+        with mock.patch('app.suggest.threading.Thread') as Thread:
+            with self.assertNumQueries(0):
+                suggestions.suggest('py', 'uz', 5)
+                suggestions.suggest('py', 'uz', 5)
+        Thread.assert_called_once_with(target=suggestions.rebuild, daemon=True)
+        self.assertIs(suggestions.indexes, stale)
+
+        build = suggestions.build
+
+        def build_then_rename():
+            # A write landing after the rebuild read the table must survive the swap.
+            indexes = build()
+            self.course.name = 'Flask'
+            self.course.save()
+            return indexes
+
+        with mock.patch.object(suggestions, 'build', build_then_rename), mock.patch('app.suggest.connection.close'):
+            Thread.call_args.kwargs['target']()
+        self.assertIsNot(suggestions.indexes, stale)
+        self.assertFalse(suggestions.rebuilding)
+        self.assertEqual([r['label'] for r in suggestions.suggest('fla', 'uz', 5)], ['Flask'])
+
+
+class FuzzySearchTests(TestCase):
+    def setUp(self):
+        course_names_index.index = None
+        teacher = User.objects.create_user(username='karimov', password='x')
+        part = Part.objects.create(name='Fanlar', slug='fanlar')
+        for name in ('Kimyo asoslari', 'Python Django', 'Дастурлаш'):
+            Course.objects.create(name=name, teacher=teacher, body='', level='Beginner', price=0, part=part)
+
+    def search(self, query):
+        return list(search_courses(Course.objects.all(), query, fuzzy=True).values_list('name', flat=True))
+
+    def test_typos_and_other_script_match(self):
+        self.assertEqual(self.search('pyton'), ['Python Django'])
+        self.assertEqual(self.search('dasturlash'), ['Дастурлаш'])
+        self.assertEqual(self.search('кимё'), ['Kimyo asoslari'])
+        self.assertEqual(search_courses(Course.objects.all(), 'pyton').count(), 0)
+
+    def test_exact_matches_come_first(self):
+        Course.objects.filter(name='Python Django').update(body='pytoon')
+        course = Course.objects.get(name='Kimyo asoslari')
+        course.name = 'Pyton'
+        course.save()
+        self.assertEqual(self.search('pyton'), ['Pyton', 'Python Django'])
+
+    def test_full_search_lists_fuzzy_matches(self):
+        response = self.client.get(reverse('full_search'), {'quer': 'Djngo'})
+        self.assertEqual([c.name for c in response.context['courses'].object_list], ['Python Django'])
+
+    def test_stale_index_is_served_while_one_rebuild_runs(self):
+        self.assertEqual(self.search('pyton'), ['Python Django'])
+        stale = course_names_index.index
+        course_names_index.built_at -= settings.FUZZY_INDEX_MAX_AGE + 1
+        with mock.patch('app.fuzzy.threading.Thread') as Thread:
+            self.assertEqual(self.search('pyton'), ['Python Django'])
+            self.assertEqual(self.search('pyton'), ['Python Django'])
+        Thread.assert_called_once_with(target=course_names_index.rebuild, daemon=True)
+        self.assertIs(course_names_index.index, stale)
+
+        build = course_names_index.build
+
+        def build_then_rename():
+            # A write landing after the rebuild read the table must survive the swap.
+            index = build()
+            course = Course.objects.get(name='Kimyo asoslari')
+            course.name = 'Fizika'
+            course.save()
+            return index
+
+        with mock.patch.object(course_names_index, 'build', build_then_rename), mock.patch('app.fuzzy.connection.close'):
+            Thread.call_args.kwargs['target']()
+        self.assertIsNot(course_names_index.index, stale)
+        self.assertFalse(course_names_index.rebuilding)
+        self.assertEqual(self.search('fizka'), ['Fizika'])
+
+
+class CommentThreadTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='student', password='x')
+        part = Part.objects.create(name='Programming', slug='programming')
+        self.course = Course.objects.create(
+            name='Python', teacher=self.user, body='', level='Beginner', price=0, part=part
+        )
+
+    def comment(self, body, parent=None):
+        return Comment.objects.create(user=self.user, course=self.course, body=body, parent=parent)
+
+    def add_thread(self, n):
+        for i in range(n):
+            question = self.comment(f'Question {i}')
+            answer = self.comment(f'Answer {i}', parent=question)
+            self.comment(f'Thanks {i}', parent=answer)
+
+    def test_page_of_threads_is_loaded_in_two_queries(self):
+        first = self.comment('First')
+        reply = self.comment('Reply 1', parent=first)
+        self.comment('Reply 2', parent=first)
+        self.comment('Nested', parent=reply)
+        second = self.comment('Second')
+        with self.assertNumQueries(2):
+            page = comment_page(self.course.id)
+            tree = [
+                (c.body, c.reply_count, c.user.username, [(r.body, r.depth, len(r.getReplies)) for r in c.getReplies])
+                for c in page
+            ]
+        self.assertEqual(tree, [
+            ('Second', 0, 'student', []),
+            ('First', 3, 'student', [('Reply 1', 1, 1), ('Reply 2', 1, 0)]),
+        ])
+        self.assertEqual(list(second.getReplies), [])
+
+    def test_detail_query_count_does_not_grow_with_comments(self):
+        url = reverse('detail', args=[self.course.id])
+        self.add_thread(2)
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as few:
+            response = self.client.get(url)
+        self.assertContains(response, 'Thanks 1')
+        self.add_thread(20)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+        self.assertContains(response, 'Thanks 19')
+        self.assertEqual(len(few), len(many))
+
+    def test_later_pages_are_fragments(self):
+        for i in range(COMMENTS_PER_PAGE + 2):
+            self.comment(f'Question {i:02}')
+        for i in range(REVIEWS_PER_PAGE + 1):
+            Review.objects.create(user=self.user, course=self.course, body=f'Review {i:02}')
+        response = self.client.get(reverse('detail', args=[self.course.id]))
+        self.assertContains(response, 'Question 02')
+        self.assertNotContains(response, 'Question 01')
+        self.assertContains(response, 'Review 01')
+        self.assertNotContains(response, 'Review 00')
+
+        data = self.client.get(response.context['comments'].next_url).json()
+        self.assertIn('Question 01', data['html'])
+        self.assertIn('Question 00', data['html'])
+        self.assertIsNone(data['next_url'])
+        data = self.client.get(response.context['reviews'].next_url).json()
+        self.assertIn('Review 00', data['html'])
+        self.assertIsNone(data['next_url'])
+
+    def test_review_page_cost_does_not_grow_with_reviews(self):
+        for i in range(REVIEWS_PER_PAGE):
+            author = User.objects.create_user(username=f'author{i}', password='x')
+            review = Review.objects.create(user=author, course=self.course, body='Good')
+            Rating.objects.create(user=author, course=self.course, review=review, rating=i % 5 + 1)
+        with self.assertNumQueries(2):
+            page = review_page(self.course.id)
+            rendered = [(review.user.username, review.stars) for review in page]
+        self.assertEqual(rendered[0], (f'author{REVIEWS_PER_PAGE - 1}', ['⭐⭐⭐⭐⭐']))
+        self.assertEqual(rendered[-1], ('author0', ['⭐☆☆☆☆']))
+
+
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        caches[settings.SHARED_CACHE_ALIAS].clear()
+        caches[settings.FRAGMENT_CACHE_ALIAS].clear()
+        metrics.clear()
+        self.teacher = User.objects.create_user(username='karimov', password='x')
+        self.student = User.objects.create_user(username='student', password='x')
+        part = Part.objects.create(name='Programming', slug='programming')
+        self.course = Course.objects.create(
+            name='Python', teacher=self.teacher, body='', level='Beginner', price=0, part=part
+        )
+        self.lecture = Lecture.objects.create(name='Intro', user=self.teacher, course=self.course)
+        self.url = reverse('detail', args=[self.course.id])
+
+    def get(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_second_render_hits_the_cache(self):
+        _, cold = self.get()
+        response, warm = self.get()
+        self.assertLess(warm, cold)
+        self.assertContains(response, 'Intro')
+        stats = fragment_stats()
+        self.assertEqual(set(stats), {'course_title', 'course_teacher', 'course_rating_summary', 'course_tags', 'syllabus'})
+        self.assertEqual(stats['course_title'], {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_child_changes_invalidate(self):
+        self.get()
+        Lecture.objects.create(name='Closures', user=self.teacher, course=self.course)
+        CourseTag.objects.create(course=self.course, tag=Tag.objects.create(name='backend'))
+        Rating.objects.create(user=self.student, course=self.course, rating=4)
+        self.course.students.add(self.student)
+        response, _ = self.get()
+        self.assertContains(response, 'Closures')
+        self.assertContains(response, 'backend')
+        self.assertContains(response, '4,0/5.0')
+        self.assertContains(response, '1\n                  Enrolled')
+
+    def test_per_user_parts_are_not_cached(self):
+        follow = reverse('follow_user', args=[self.teacher.id])
+        self.client.force_login(self.student)
+        self.assertContains(self.get()[0], follow)
+        self.client.force_login(self.teacher)
+        self.assertNotContains(self.get()[0], follow)
+        self.assertEqual(fragment_stats()['course_teacher']['hits'], 1)
+
+    def test_bump_in_another_process_invalidates(self):
+        self.get()
+        # Like a media worker: no signal here, and a cache connection of its own.
+        Lecture.objects.filter(pk=self.lecture.pk).update(name='Generators')
+        caches.create_connection(settings.FRAGMENT_CACHE_ALIAS).incr(version_key(self.course.id))
+        self.assertContains(self.get()[0], 'Generators')
+
+    def test_per_process_cache_is_not_used(self):
+        per_process = {**settings.CACHES, settings.FRAGMENT_CACHE_ALIAS: {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }}
+        with override_settings(CACHES=per_process), mock.patch('app.fragments.warned', False), \
+                self.assertLogs('app.fragments', 'WARNING'):
+            self.get()
+            Lecture.objects.filter(pk=self.lecture.pk).update(name='Generators')
+            self.assertContains(self.get()[0], 'Generators')
+        self.assertEqual(fragment_stats(), {})
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        caches[settings.SHARED_CACHE_ALIAS].clear()
+        querybudget.totals.clear()
+        self.teacher = User.objects.create_user(username='teacher', password='x', user_type=User.TEACHER)
+        part = Part.objects.create(name='Programming', slug='programming')
+        self.course = Course.objects.create(
+            name='Python', teacher=self.teacher, body='', level='Beginner', price=0, part=part
+        )
+        Lecture.objects.create(name='Intro', user=self.teacher, course=self.course)
+
+    def test_pages_stay_within_budget(self):
+        self.client.get(reverse('home'))
+        self.assertViewQueryBudget(reverse('home'), 4)
+        self.assertViewQueryBudget(reverse('courses'), 4)
+        self.assertViewQueryBudget(reverse('detail', args=[self.course.id]), 10)
+
+    @override_settings(REQUEST_BUDGETS={'default': {'queries': 1}})
+    def test_requests_over_budget_are_logged(self):
+        with self.assertLogs('app.querybudget', 'WARNING') as logs:
+            self.client.get(reverse('detail', args=[self.course.id]))
+        self.assertIn('over budget (queries)', logs.output[0])
+        self.assertEqual(querybudget.totals['detail']['over_budget'], 1)
+
+    def test_repeated_queries_are_reported_once_each(self):
+        queries = ['SELECT 1', 'SELECT 2', 'SELECT 1', 'SELECT 3', 'SELECT 1', 'SELECT 2']
+        self.assertEqual(querybudget.duplicate_queries(queries), [(3, 'SELECT 1'), (2, 'SELECT 2')])
+
+    def test_totals_are_flushed_and_reported(self):
+        self.client.get(reverse('home'))
+        self.client.get(reverse('home'))
+        querybudget.flush()
+        self.client.get(reverse('home'))
+        querybudget.flush()
+        out = StringIO()
+        call_command('request_stats', '--json', stdout=out)
+        home = json.loads(out.getvalue())['home']
+        self.assertEqual(home['requests'], 3)
+        self.assertEqual(home['over_budget'], 0)
+        self.assertGreater(home['queries'], 0)
+
+    def test_totals_are_kept_when_they_cannot_be_written(self):
+        self.client.get(reverse('home'))
+        with override_settings(REQUEST_STATS_FLUSH_INTERVAL=0), \
+                mock.patch('app.models.RequestStats.objects.get_or_create', side_effect=DatabaseError('locked')), \
+                self.assertLogs('app.querybudget', 'ERROR'):
+            response = self.client.get(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(querybudget.totals['home']['requests'], 2)
+        querybudget.flush()
+        self.assertEqual(RequestStats.objects.get(view_name='home').requests, 2)
+
+    def test_reset_reports_on_stdout(self):
+        self.client.get(reverse('home'))
+        querybudget.flush()
+        out, err = StringIO(), StringIO()
+        call_command('request_stats', '--reset', stdout=out, stderr=err)
+        self.assertIn('Reset 1 views.', out.getvalue())
+        self.assertEqual(err.getvalue(), '')
+        self.assertFalse(RequestStats.objects.exists())
+
+
+
+class SyllabusQueryTests(QueryBudgetMixin, TestCase):
+    """The syllabus costs the same few queries however many lectures a course has."""
+
+    def setUp(self):
+        caches[settings.SHARED_CACHE_ALIAS].clear()
+        caches[settings.FRAGMENT_CACHE_ALIAS].clear()
+        timer = mock.patch('app.progress.threading.Timer')
+        timer.start()
+        self.addCleanup(timer.stop)
+        progress.buffer.clear()
+        progress.video_meta.clear()
+        self.teacher = User.objects.create_user(username='teacher', password='x', user_type=User.TEACHER)
+        self.student = User.objects.create_user(username='student', password='x')
+        part = Part.objects.create(name='Programming', slug='programming')
+        self.course = Course.objects.create(
+            name='Python', teacher=self.teacher, body='', level='Beginner', price=0, part=part
+        )
+        self.add_lectures(2)
+        # The category sidebar is cached on its own; keep its first load out of the counts.
+        get_categories()
+
+    def add_lectures(self, n):
+        for i in range(n):
+            lecture = Lecture.objects.create(name=f'Lecture {i}', user=self.teacher, course=self.course)
+            for j in range(2):
+                video = Video.objects.create(name=f'Video {i}.{j}', user=self.teacher, course=self.course, duration=60)
+                lecture.videos.add(video)
+        self.video = video
+
+    def urls(self):
+        return [
+            reverse('detail', args=[self.course.id]),
+            reverse('detail_video', args=[self.course.id, self.video.id]),
+        ]
+
+    def query_counts(self):
+        counts = []
+        for url in self.urls():
+            # Measure the syllabus queries, not a fragment cached or a heartbeat buffered by the previous request.
+            caches[settings.FRAGMENT_CACHE_ALIAS].clear()
+            progress.flush()
+            progress.video_meta.clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            counts.append(len(queries))
+        return counts
+
+    def assertCountsDoNotGrow(self):
+        few = self.query_counts()
+        self.add_lectures(48)
+        self.assertEqual(self.query_counts(), few)
+
+    def test_anonymous_query_count_does_not_grow_with_lectures(self):
+        self.assertCountsDoNotGrow()
+
+    def test_student_query_count_does_not_grow_with_lectures(self):
+        self.client.force_login(self.student)
+        progress.record(self.student.id, self.video.id, 60)
+        self.assertCountsDoNotGrow()
+
+    def test_syllabus_takes_three_queries(self):
+        self.add_lectures(48)
+        with self.assertNumQueries(3):
+            lectures = self.course.get_syllabus(self.student)
+        self.assertEqual([lecture.video_count for lecture in lectures], [2] * 50)
+        for url in self.urls():
+            caches[settings.FRAGMENT_CACHE_ALIAS].clear()
+            self.assertViewQueryBudget(url, 7)
+        # Logging in adds the session, the user, the watched videos and the last watched video or the heartbeat's video.
+        self.client.force_login(self.student)
+        for url in self.urls():
+            caches[settings.FRAGMENT_CACHE_ALIAS].clear()
+            progress.flush()
+            progress.video_meta.clear()
+            self.assertViewQueryBudget(url, 11)
+
+    def test_video_of_another_course_is_not_found(self):
+        other = Course.objects.create(
+            name='Django', teacher=self.teacher, body='', level='Beginner', price=0, part=self.course.part
+        )
+        stray = Video.objects.create(name='Stray', user=self.teacher, course=other)
+        response = self.client.get(reverse('detail_video', args=[self.course.id, stray.id]))
+        self.assertEqual(response.status_code, 404)
+
+class VideoMetadataTests(TemporaryMediaMixin, TestCase):
+    METADATA = {'duration': 754.0, 'width': 1280, 'height': 720, 'codec': 'h264', 'bitrate': 2500, 'file_size': 5}
+
+    def test_metadata_is_probed_once_and_then_read_from_the_row(self):
+        teacher = User.objects.create_user(username='teacher', password='x', user_type=User.TEACHER)
+        part = Part.objects.create(name='Programming', slug='programming')
+        course = Course.objects.create(name='Python', teacher=teacher, body='', level='Beginner', price=0, part=part)
+        lecture = Lecture.objects.create(name='Intro', user=teacher, course=course)
+        with mock.patch('app.models.probe_video', return_value=dict(self.METADATA)) as probe:
+            video = Video.objects.create(
+                name='Welcome', user=teacher, course=course, file=SimpleUploadedFile('welcome.mp4', b'video')
+            )
+            lecture.videos.add(video)
+            jobs.run_job(jobs.claim_next_job())
+            stored = Video.objects.get(pk=video.pk)
+            response = self.client.get(reverse('detail', args=[course.id]))
+        probe.assert_called_once_with(stored.file.path)
+        self.assertEqual({field: getattr(stored, field) for field in self.METADATA}, self.METADATA)
+        self.assertContains(response, '13 minutes')
+
+
+class MediaJobTests(TestCase):
+    def setUp(self):
+        teacher = User.objects.create_user(username='teacher', password='x', user_type=User.TEACHER)
+        part = Part.objects.create(name='Programming', slug='programming')
+        course = Course.objects.create(name='Python', teacher=teacher, body='', level='Beginner', price=0, part=part)
+        self.video = Video.objects.create(name='Welcome', user=teacher, course=course)
+
+    def test_each_job_is_claimed_once(self):
+        first = MediaJob.objects.create(video=self.video, kind=MediaJob.PROBE)
+        second = MediaJob.objects.create(video=self.video, kind=MediaJob.PROBE)
+        MediaJob.objects.create(
+            video=self.video, kind=MediaJob.HLS, run_after=timezone.now() + jobs.RETRY_DELAY
+        )
+        claimed = [jobs.claim_next_job(), jobs.claim_next_job(), jobs.claim_next_job()]
+        self.assertEqual([job and job.id for job in claimed], [first.id, second.id, None])
+        self.assertEqual((claimed[0].status, claimed[0].attempts), (MediaJob.RUNNING, 1))
+
+    def test_later_jobs_wait_for_the_probe(self):
+        probe, poster, hls = MediaJob.enqueue_for(self.video, kinds=[MediaJob.PROBE, MediaJob.POSTER, MediaJob.HLS])
+        self.assertEqual(jobs.claim_next_job().id, probe.id)
+        # Poster and ladder need the duration and dimensions the probe stores.
+        self.assertIsNone(jobs.claim_next_job())
+        MediaJob.objects.filter(id=probe.id).update(status=MediaJob.DONE)
+        self.assertEqual([jobs.claim_next_job().id, jobs.claim_next_job().id], [poster.id, hls.id])
+
+    def test_failed_probe_fails_the_jobs_waiting_for_it(self):
+        MediaJob.enqueue_for(self.video, kinds=[MediaJob.PROBE, MediaJob.POSTER])
+        MediaJob.objects.update(max_attempts=1)
+        failing = mock.Mock(side_effect=RuntimeError('bad file'))
+        with mock.patch.dict(jobs.HANDLERS, {MediaJob.PROBE: failing}), self.assertLogs('app.jobs', 'ERROR'):
+            jobs.run_job(jobs.claim_next_job())
+        self.assertEqual(set(MediaJob.objects.values_list('status', flat=True)), {MediaJob.FAILED})
+        self.assertEqual(Video.objects.get(pk=self.video.pk).processing_status, Video.FAILED)
+
+    def test_video_deleted_while_its_job_runs(self):
+        MediaJob.enqueue_for(self.video, kinds=[MediaJob.PROBE])
+        with mock.patch.dict(jobs.HANDLERS, {MediaJob.PROBE: lambda video: video.delete()}):
+            jobs.run_job(jobs.claim_next_job())
+        self.assertFalse(MediaJob.objects.exists())
+
+    def test_worker_goes_on_after_a_job_it_cannot_finish(self):
+        first, second = MediaJob.enqueue_for(self.video, kinds=[MediaJob.PROBE, MediaJob.PROBE])
+        run_job = mock.Mock(side_effect=[DatabaseError('locked'), None])
+        with mock.patch('app.jobs.run_job', run_job), self.assertLogs('app.jobs', 'ERROR'):
+            jobs.work(once=True)
+        self.assertEqual([call.args[0].id for call in run_job.call_args_list], [first.id, second.id])
+
+    def test_running_job_is_kept_fresh_by_its_heartbeat(self):
+        job = MediaJob.objects.create(video=self.video, kind=MediaJob.TRANSCODE)
+        old = timezone.now() - jobs.STALE_AFTER * 2
+        MediaJob.objects.filter(id=job.id).update(status=MediaJob.RUNNING, updated_at=old)
+        stop = mock.Mock()
+        stop.wait.side_effect = [False, True]
+        with mock.patch('app.jobs.connection.close') as close:
+            jobs.heartbeat(job.id, stop)
+        stop.wait.assert_called_with(jobs.HEARTBEAT_INTERVAL)
+        close.assert_called_once_with()
+        self.assertEqual(jobs.requeue_stale_jobs(), 0)
+
+        MediaJob.objects.filter(id=job.id).update(updated_at=old)
+        self.assertEqual(jobs.requeue_stale_jobs(), 1)
+
+    def test_job_claimed_elsewhere_is_skipped(self):
+        job = MediaJob.objects.create(video=self.video, kind=MediaJob.PROBE)
+
+        def taken_by_another_worker(name):
+            # Runs between the candidate query and the conditional update.
+            MediaJob.objects.filter(id=job.id).update(status=MediaJob.RUNNING)
+            return F(name)
+
+        with mock.patch('app.jobs.F', side_effect=taken_by_another_worker):
+            self.assertIsNone(jobs.claim_next_job())
+        self.assertEqual(MediaJob.objects.get(id=job.id).attempts, 0)
+
+    def test_failing_job_is_retried_with_backoff_then_failed(self):
+        job = MediaJob.objects.create(video=self.video, kind=MediaJob.PROBE, max_attempts=2)
+        failing = mock.Mock(side_effect=RuntimeError('bad file'))
+        with mock.patch.dict(jobs.HANDLERS, {MediaJob.PROBE: failing}), self.assertLogs('app.jobs', 'ERROR') as logs:
+            jobs.run_job(jobs.claim_next_job())
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts, job.error), (MediaJob.PENDING, 1, 'bad file'))
+            self.assertGreater(job.run_after, timezone.now() + jobs.RETRY_DELAY / 2)
+            self.assertIsNone(jobs.claim_next_job())
+
+            MediaJob.objects.filter(id=job.id).update(run_after=timezone.now())
+            jobs.run_job(jobs.claim_next_job())
+        self.assertEqual(len(logs.output), 2)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (MediaJob.FAILED, 2))
+        self.assertEqual(Video.objects.get(pk=self.video.pk).processing_status, Video.FAILED)
+
+
+class HLSTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        teacher = User.objects.create_user(username='teacher', password='x', user_type=User.TEACHER)
+        part = Part.objects.create(name='Programming', slug='programming')
+        course = Course.objects.create(name='Python', teacher=teacher, body='', level='Beginner', price=0, part=part)
+        self.video = Video.objects.create(
+            name='Welcome', user=teacher, course=course, file=SimpleUploadedFile('welcome.mp4', b'video')
+        )
+        self.hls_path = Video.file.field.storage.path(self.video.hls_dir)
+        student = User.objects.create_user(username='student', password='x')
+        course.students.add(student)
+        self.client.force_login(student)
+
+    def write_ladder(self, output_dir, *names):
+        os.makedirs(output_dir, exist_ok=True)
+        for name in names:
+            with open(os.path.join(output_dir, name), 'w') as f:
+                f.write(name)
+
+    def get(self, name):
+        response = self.client.get(reverse('stream_hls', args=[self.video.id, name]))
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        response.close()
+        return response, body
+
+    def test_playlists_and_segments_are_served(self):
+        self.write_ladder(self.hls_path, HLS_MASTER_PLAYLIST, '360p.m3u8', '360p_000.ts')
+        # Not packaged yet.
+        self.assertEqual(self.get(HLS_MASTER_PLAYLIST)[0].status_code, 404)
+
+        Video.objects.filter(pk=self.video.pk).update(hls_playlist=f'{self.video.hls_dir}/{HLS_MASTER_PLAYLIST}')
+        response, body = self.get(HLS_MASTER_PLAYLIST)
+        self.assertEqual((response.status_code, body), (200, b'master.m3u8'))
+        self.assertEqual(response['Content-Type'], 'application/vnd.apple.mpegurl')
+        self.assertEqual(response['Cache-Control'], 'private, max-age=60')
+        response, body = self.get('360p_000.ts')
+        self.assertEqual((response['Content-Type'], body), ('video/mp2t', b'360p_000.ts'))
+        self.assertIn('immutable', response['Cache-Control'])
+
+        for name in ('720p.m3u8', '360p_001.ts', '.m3u8', '360p.mp4', 'master.m3u8.bak', '..ts'):
+            self.assertEqual(self.get(name)[0].status_code, 404, name)
+        self.client.logout()
+        self.assertEqual(self.get(HLS_MASTER_PLAYLIST)[0].status_code, 403)
+
+    def test_hls_job_swaps_in_the_new_ladder(self):
+        self.write_ladder(self.hls_path, HLS_MASTER_PLAYLIST, '1080p.m3u8')
+
+        def package(path, output_dir):
+            self.assertTrue(os.path.exists(os.path.join(self.hls_path, '1080p.m3u8')))
+            self.write_ladder(output_dir, HLS_MASTER_PLAYLIST, '360p.m3u8')
+            return ['360p']
+
+        with mock.patch('app.jobs.package_hls', side_effect=package):
+            jobs.hls(self.video)
+        self.assertEqual(sorted(os.listdir(self.hls_path)), ['360p.m3u8', HLS_MASTER_PLAYLIST])
+        self.assertFalse(os.path.exists(self.hls_path + '.tmp'))
+        self.assertEqual(
+            Video.objects.get(pk=self.video.pk).hls_playlist, f'{self.video.hls_dir}/{HLS_MASTER_PLAYLIST}'
+        )
+
+    def test_package_hls_skips_renditions_taller_than_the_source(self):
+        source = os.path.join(self.media_root, 'source.mp4')
+        try:
+            run_ffmpeg('-f', 'lavfi', '-i', 'testsrc=duration=2:size=160x120:rate=10', source)
+        except (OSError, RuntimeError) as e:
+            self.skipTest(f'ffmpeg is not available: {e}')
+        output_dir = os.path.join(self.media_root, 'ladder')
+        renditions = [('120p', 120, 200, 32), ('240p', 240, 400, 64)]
+        self.assertEqual(package_hls(source, output_dir, renditions=renditions, segment_seconds=1), ['120p'])
+        with open(os.path.join(output_dir, HLS_MASTER_PLAYLIST)) as f:
+            self.assertIn('120p.m3u8', f.read())
+        with open(os.path.join(output_dir, '120p.m3u8')) as f:
+            self.assertIn('120p_000.ts', f.read())
+        self.assertTrue(os.path.exists(os.path.join(output_dir, '120p_000.ts')))
+
+    def test_hls_js_is_only_loaded_from_our_static_files(self):
+        template = Template('{% load media_tags %}{% hls_js %}')
+        for found, html in ((None, ''), ('/static/hls.min.js', '<script src="/static/assets/vendor/hls/hls.min.js">')):
+            is_vendored.cache_clear()
+            self.addCleanup(is_vendored.cache_clear)
+            with mock.patch('app.templatetags.media_tags.finders.find', return_value=found):
+                rendered = template.render(Context())
+            self.assertEqual(rendered[:len(html)], html)
+            self.assertEqual(bool(rendered), bool(found))
+
+    def test_deleting_a_video_removes_its_ladder(self):
+        self.write_ladder(self.hls_path, HLS_MASTER_PLAYLIST)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.video.delete()
+        self.assertFalse(os.path.exists(self.hls_path))
+
+
+class StreamVideoTests(TemporaryMediaMixin, TestCase):
+    DATA = bytes(range(256)) * 40
+
+    def setUp(self):
+        super().setUp()
+        teacher = User.objects.create_user(username='teacher', password='x', user_type=User.TEACHER)
+        part = Part.objects.create(name='Programming', slug='programming')
+        course = Course.objects.create(name='Python', teacher=teacher, body='', level='Beginner', price=0, part=part)
+        video = Video.objects.create(
+            name='Welcome', user=teacher, course=course, file=SimpleUploadedFile('welcome.mp4', self.DATA)
+        )
+        self.url = reverse('stream_video', args=[video.id])
+        self.teacher, self.course = teacher, course
+        self.student = User.objects.create_user(username='student', password='x')
+        course.students.add(self.student)
+        self.client.force_login(self.student)
+
+    def get(self, **headers):
+        response = self.client.get(self.url, headers=headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        response.close()
+        return response, body
+
+    def test_only_students_the_teacher_and_staff_can_stream(self):
+        self.client.logout()
+        self.assertEqual(self.get()[0].status_code, 403)
+        outsider = User.objects.create_user(username='outsider', password='x')
+        self.client.force_login(outsider)
+        self.assertEqual(self.get()[0].status_code, 403)
+        admin = User.objects.create_user(username='admin', password='x', is_staff=True)
+        for user in (self.student, self.teacher, admin):
+            self.client.force_login(user)
+            self.assertEqual(self.get()[0].status_code, 200)
+
+    def test_without_range_the_whole_file_is_sent(self):
+        response, body = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.DATA)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Type'], 'video/mp4')
+
+    def test_byte_ranges(self):
+        size = len(self.DATA)
+        cases = {
+            'bytes=100-199': (100, 199),
+            'bytes=10000-': (10000, size - 1),
+            'bytes=-500': (size - 500, size - 1),
+            'bytes=10000-99999': (10000, size - 1),
+            'bytes=-99999': (0, size - 1),
+        }
+        for header, (start, end) in cases.items():
+            with self.subTest(header):
+                response, body = self.get(Range=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/{size}')
+                self.assertEqual(response['Content-Length'], str(end - start + 1))
+                self.assertEqual(body, self.DATA[start:end + 1])
+
+    def test_unsatisfiable_range_is_416(self):
+        for header in ('bytes=20000-', 'bytes=200-100', 'bytes=-0'):
+            with self.subTest(header):
+                response, _ = self.get(Range=header)
+                self.assertEqual(response.status_code, 416)
+                self.assertEqual(response['Content-Range'], f'bytes */{len(self.DATA)}')
+
+    def test_unsupported_ranges_fall_back_to_the_whole_file(self):
+        for header in ('bytes=0-1,5-6', 'items=0-9', 'bytes=-'):
+            with self.subTest(header):
+                response, body = self.get(Range=header)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(body, self.DATA)
+
+    def test_if_range(self):
+        first, _ = self.get()
+        for if_range, status in ((first['ETag'], 206), (first['Last-Modified'], 206), ('"stale"', 200)):
+            with self.subTest(if_range):
+                response, body = self.get(Range='bytes=0-9', **{'If-Range': if_range})
+                self.assertEqual(response.status_code, status)
+                self.assertEqual(body, self.DATA[:10] if status == 206 else self.DATA)
+
+    def test_matching_etag_is_not_modified(self):
+        first, _ = self.get()
+        response, body = self.get(**{'If-None-Match': first['ETag']})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(body, b'')
+
+
+class ImageDerivativeTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.name = self.save_image('media/cover.png', 1200, 800)
+
+    def save_image(self, name, width, height):
+        return default_storage.save(name, ContentFile(png_bytes(width, height)))
+
+    def get(self, width, fmt, name):
+        response = self.client.get(reverse('image_derivative', args=[width, fmt, name]))
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        response.close()
+        return response, body
+
+    def encoded(self, width, fmt, name):
+        """Queue an image, let the media worker encode it and request the derivative."""
+        MediaJob.enqueue_image(name)
+        jobs.work(once=True)
+        return self.get(width, fmt, name)
+
+    def test_missing_derivative_serves_the_original_without_queueing(self):
+        with self.assertNumQueries(0):
+            response, body = self.get(640, 'webp', self.name)
+        self.assertEqual((response.status_code, response['Content-Type']), (200, 'image/png'))
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+        self.assertEqual(body, default_storage.open(self.name).read())
+        self.assertFalse(MediaJob.objects.exists())
+
+    def test_saved_images_are_queued_and_encoded(self):
+        teacher = User.objects.create_user(username='teacher', password='x', avatar=SimpleUploadedFile('me.png', png_bytes()))
+        job = MediaJob.objects.get()
+        self.assertEqual((job.kind, job.image, job.video), (MediaJob.IMAGES, teacher.avatar.name, None))
+
+        jobs.work(once=True)
+        self.assertEqual(MediaJob.objects.get().status, MediaJob.DONE)
+        for width in (320, 640, 960):
+            self.assertTrue(default_storage.exists(derivative_name(teacher.avatar.name, width, 'webp')))
+
+    def test_an_image_is_queued_once_at_a_time(self):
+        first = MediaJob.enqueue_image(self.name)
+        self.assertEqual(MediaJob.enqueue_image(self.name), first)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            MediaJob.objects.create(kind=MediaJob.IMAGES, image=self.name)
+        MediaJob.objects.filter(pk=first.pk).update(status=MediaJob.DONE)
+        self.assertNotEqual(MediaJob.enqueue_image(self.name), first)
+
+    def test_each_width_and_format_is_encoded(self):
+        for fmt, pil_format, content_type in (('webp', 'WEBP', 'image/webp'), ('jpg', 'JPEG', 'image/jpeg')):
+            with self.subTest(fmt):
+                response, body = self.encoded(640, fmt, self.name)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['Content-Type'], content_type)
+                self.assertIn('immutable', response['Cache-Control'])
+                with Image.open(BytesIO(body)) as image:
+                    self.assertEqual((image.format, image.size), (pil_format, (640, 427)))
+
+    def test_small_images_are_not_upscaled(self):
+        name = self.save_image('media/icon.png', 200, 100)
+        _, body = self.encoded(960, 'jpg', name)
+        with Image.open(BytesIO(body)) as image:
+            self.assertEqual(image.size, (200, 100))
+
+    def test_picture_offers_webp_and_jpeg_srcsets(self):
+        html = Template('{% load media_tags %}{% responsive_image image %}').render(
+            Context({'image': Course(image=self.name).image})
+        )
+        self.assertIn('<source type="image/webp" srcset="', html)
+        for width in (320, 640, 960):
+            self.assertIn(f"{reverse('image_derivative', args=[width, 'webp', self.name])} {width}w", html)
+            self.assertIn(f"{reverse('image_derivative', args=[width, 'jpg', self.name])} {width}w", html)
+
+    def test_unknown_sizes_formats_and_names_are_404(self):
+        default_storage.save('media/notes.txt', ContentFile(b'text'))
+        for width, fmt, name in (
+            (500, 'jpg', self.name),
+            (640, 'gif', self.name),
+            (640, 'jpg', 'media/missing.png'),
+            (640, 'jpg', 'media/notes.txt'),
+            (640, 'jpg', f'media/../../{self.name}'),
+            (640, 'jpg', derivative_name(self.name, 320, 'jpg')),
+        ):
+            with self.subTest(name=name, width=width, fmt=fmt):
+                self.assertEqual(self.get(width, fmt, name)[0].status_code, 404)
+
+    def test_least_recently_used_derivatives_are_evicted(self):
+        self.encoded(320, 'jpg', self.name)
+        paths = {width: default_storage.path(derivative_name(self.name, width, 'jpg')) for width in (320, 640, 960)}
+        for age, width in enumerate((640, 320, 960)):
+            os.utime(paths[width], (1000 + age, 1000 + age))
+        # Room for everything but the least recently used file; the WebP files are the newest.
+        root = default_storage.path('derivatives')
+        total = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(root) for f in files)
+        cap = total - os.path.getsize(paths[640])
+        self.assertEqual(evict_derivatives(default_storage, cap), 1)
+        self.assertEqual({width for width, path in paths.items() if os.path.exists(path)}, {320, 960})
+
+    @override_settings(IMAGE_DERIVATIVES_MAX_BYTES=0)
+    def test_worker_keeps_the_cache_under_the_cap(self):
+        jobs.last_eviction = 0.0
+        self.encoded(320, 'jpg', self.name)
+        self.assertFalse(default_storage.exists(derivative_name(self.name, 320, 'jpg')))
+        # Serving a derivative never walks the cache.
+        with mock.patch('app.jobs.evict_derivatives') as evict:
+            self.get(640, 'webp', self.name)
+        evict.assert_not_called()
+
+
+class ContentStorageTests(TemporaryMediaMixin, TestCase):
+    DATA = b'same bytes'
+
+    def save(self, name='videos/intro.mp4', data=DATA):
+        return content_storage.save(name, ContentFile(data))
+
+    def refcount(self, name):
+        return StoredFile.objects.filter(name=name).values_list('refcount', flat=True).first()
+
+    def test_identical_content_is_stored_once(self):
+        first = self.save('videos/intro.mp4')
+        second = self.save('videos/copy.MP4')
+        self.assertEqual(first, second)
+        self.assertTrue(is_content_name(first))
+        self.assertTrue(first.endswith('.mp4'))
+        self.assertEqual(self.refcount(first), 2)
+        self.assertNotEqual(self.save(data=b'other bytes'), first)
+
+    def test_file_is_removed_with_its_last_reference_on_commit(self):
+        name = self.save()
+        self.save()
+        content_storage.delete(name)
+        self.assertEqual(self.refcount(name), 1)
+        with self.captureOnCommitCallbacks() as callbacks:
+            content_storage.delete(name)
+        self.assertTrue(content_storage.exists(name))
+        callbacks[0]()
+        self.assertFalse(content_storage.exists(name))
+        self.assertIsNone(self.refcount(name))
+
+    def test_save_after_delete_keeps_the_file(self):
+        name = self.save()
+        with self.captureOnCommitCallbacks() as callbacks:
+            content_storage.delete(name)
+        self.save()
+        callbacks[0]()
+        self.assertTrue(content_storage.exists(name))
+        self.assertEqual(self.refcount(name), 1)
+
+    def test_file_removed_while_saving_is_written_again(self):
+        name = self.save()
+        with self.captureOnCommitCallbacks() as callbacks:
+            content_storage.delete(name)
+        add_reference = content_storage.add_reference
+
+        def removed_first(*args):
+            # The pending removal runs after save found the file but before it counted its reference.
+            callbacks[0]()
+            add_reference(*args)
+
+        with mock.patch.object(content_storage, 'add_reference', side_effect=removed_first):
+            self.save()
+        with content_storage.open(name) as f:
+            self.assertEqual(f.read(), self.DATA)
+        self.assertEqual(self.refcount(name), 1)
+
+    def test_rolled_back_delete_keeps_the_file(self):
+        name = self.save()
+        with self.captureOnCommitCallbacks() as callbacks:
+            try:
+                with transaction.atomic():
+                    content_storage.delete(name)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertTrue(content_storage.exists(name))
+        self.assertEqual(self.refcount(name), 1)
+
+    def test_replacing_a_course_image_releases_the_old_file(self):
+        teacher = User.objects.create_user(username='teacher', password='x', user_type=User.TEACHER)
+        part = Part.objects.create(name='Programming', slug='programming')
+        course = Course.objects.create(
+            name='Python', teacher=teacher, body='', level='Beginner', price=0, part=part,
+            image=SimpleUploadedFile('old.png', png_bytes(color='red')),
+        )
+        old = course.image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            course.image = SimpleUploadedFile('new.png', png_bytes(color='blue'))
+            course.save()
+        self.assertFalse(content_storage.exists(old))
+        self.assertEqual(self.refcount(course.image.name), 1)
+
+
+class MigrateMediaStorageTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        teacher = User.objects.create_user(username='teacher', password='x', user_type=User.TEACHER)
+        part = Part.objects.create(name='Programming', slug='programming')
+        self.courses = [
+            Course.objects.create(
+                name=f'Course {i}', teacher=teacher, body='', level='Beginner', price=0, part=part, image=image
+            )
+            for i, image in enumerate(['media/cover.jpg', 'media/cover-copy.jpg', 'media/missing.jpg'])
+        ]
+        for name in ('media/cover.jpg', 'media/cover-copy.jpg', 'media/orphan-copy.jpg'):
+            default_storage.save(name, ContentFile(b'cover'))
+        default_storage.save('media/orphan.jpg', ContentFile(b'unique'))
+        self.target = content_name('media/cover.jpg', hashlib.sha256(b'cover').hexdigest())
+
+    def migrate(self, *args):
+        out, err = StringIO(), StringIO()
+        call_command('migrate_media_storage', *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_dry_run_changes_nothing(self):
+        out, _ = self.migrate('--dry-run', '--prune-duplicates')
+        self.assertIn('Would move 1 files, removed 2 duplicates, 1 missing', out)
+        self.assertTrue(default_storage.exists('media/cover-copy.jpg'))
+        self.assertFalse(default_storage.exists(self.target))
+        self.assertFalse(StoredFile.objects.exists())
+
+    def test_files_move_to_content_names_and_duplicates_go(self):
+        out, err = self.migrate('--prune-duplicates')
+        self.assertIn('Moved 1 files, removed 2 duplicates, 1 missing', out)
+        self.assertIn('media/missing.jpg', err)
+        images = [course.image.name for course in Course.objects.filter(pk__in=[c.pk for c in self.courses])]
+        self.assertEqual(images, [self.target, self.target, 'media/missing.jpg'])
+        self.assertEqual(StoredFile.objects.get(name=self.target).refcount, 2)
+        self.assertEqual(
+            sorted(os.listdir(default_storage.path('media'))), sorted(['orphan.jpg', self.target.split('/')[1]])
+        )
+
+
+class ChunkedUploadTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.teacher = User.objects.create_user(username='teacher', password='x', user_type=User.TEACHER)
+        part = Part.objects.create(name='Programming', slug='programming')
+        self.course = Course.objects.create(
+            name='Python', teacher=self.teacher, body='', level='Beginner', price=0, part=part
+        )
+        self.data = b'0123456789' * 3
+        self.client.force_login(self.teacher)
+
+    def init(self, **data):
+        data = {'course_id': self.course.id, 'filename': 'intro.mp4', 'size': len(self.data), **data}
+        return self.client.post(reverse('upload_init'), data)
+
+    def send(self, upload_id, offset, chunk, checksum=None):
+        headers = {'Upload-Offset': str(offset)}
+        if checksum is not None:
+            headers['Upload-Checksum'] = checksum
+        return self.client.post(
+            reverse('upload_chunk', args=[upload_id]), chunk, content_type='application/octet-stream', headers=headers
+        )
+
+    def test_add_page_offers_the_teachers_courses(self):
+        response = self.client.get(reverse('add_course'), {'course': self.course.id})
+        self.assertContains(response, 'data-course-input="upload_course"')
+        self.assertContains(response, f'<option value="{self.course.id}" selected>Python</option>', html=True)
+
+    def test_init_needs_one_of_the_teachers_courses(self):
+        other = User.objects.create_user(username='other', password='x', user_type=User.TEACHER)
+        self.client.force_login(other)
+        self.assertEqual(self.init().status_code, 400)
+        self.assertEqual(self.init(course_id='').status_code, 400)
+
+        self.client.force_login(self.teacher)
+        response = self.init()
+        self.assertEqual(response.status_code, 201)
+        upload = VideoUpload.objects.get(id=response.json()['id'])
+        self.assertEqual((upload.course, upload.offset), (self.course, 0))
+        self.assertTrue(os.path.exists(upload.path))
+
+    def test_upload_resumes_and_completes(self):
+        upload_id = self.init(sha256=hashlib.sha256(self.data).hexdigest()).json()['id']
+        response = self.send(upload_id, 0, self.data[:10], hashlib.sha256(self.data[:10]).hexdigest())
+        self.assertEqual(response.json(), {'offset': 10})
+        # A chunk that arrived damaged is discarded.
+        response = self.send(upload_id, 10, self.data[10:20], hashlib.sha256(b'other').hexdigest())
+        self.assertEqual((response.status_code, response.json()['offset']), (400, 10))
+        self.assertEqual(self.send(upload_id, 20, self.data[20:]).status_code, 409)
+
+        # The client lost track, and asks where to resume.
+        response = self.client.get(reverse('upload_chunk', args=[upload_id]))
+        self.assertEqual(response.json(), {'offset': 10, 'size': len(self.data)})
+        self.assertEqual(self.send(upload_id, 10, self.data[10:]).json(), {'offset': len(self.data)})
+
+        response = self.client.post(reverse('upload_complete', args=[upload_id]))
+        self.assertEqual(response.status_code, 201)
+        upload = VideoUpload.objects.get(id=upload_id)
+        self.assertEqual(upload.video.id, response.json()['video'])
+        with upload.video.file.open('rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertFalse(os.path.exists(upload.path))
+
+    def test_whole_file_checksum_mismatch_restarts_the_upload(self):
+        upload_id = self.init(sha256=hashlib.sha256(b'something else').hexdigest()).json()['id']
+        self.send(upload_id, 0, self.data[:10])
+        self.assertEqual(self.client.post(reverse('upload_complete', args=[upload_id])).status_code, 409)
+        self.send(upload_id, 10, self.data[10:])
+
+        response = self.client.post(reverse('upload_complete', args=[upload_id]))
+        self.assertEqual((response.status_code, response.json()['offset']), (400, 0))
+        upload = VideoUpload.objects.get(id=upload_id)
+        self.assertEqual((upload.offset, upload.video, os.path.getsize(upload.path)), (0, None, 0))
+        self.assertFalse(Video.objects.exists())
+
+    def test_chunk_being_written_is_not_written_twice(self):
+        upload_id = self.init().json()['id']
+        VideoUpload.objects.filter(id=upload_id).update(writing_until=timezone.now() + views.CHUNK_WRITE_TIMEOUT)
+        response = self.send(upload_id, 0, self.data[:10])
+        self.assertEqual((response.status_code, response.json()['offset']), (409, 0))
+        self.assertEqual(os.path.getsize(VideoUpload.objects.get(id=upload_id).path), 0)
+
+        # A lease left by a request that died runs out.
+        VideoUpload.objects.filter(id=upload_id).update(writing_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.send(upload_id, 0, self.data[:10]).json(), {'offset': 10})
+        self.assertIsNone(VideoUpload.objects.get(id=upload_id).writing_until)
+
+    def test_upload_is_completed_once(self):
+        upload_id = self.init().json()['id']
+        self.send(upload_id, 0, self.data)
+        url = reverse('upload_complete', args=[upload_id])
+        # Another request is building the Video from this upload.
+        VideoUpload.objects.filter(id=upload_id).update(writing_until=timezone.now() + views.CHUNK_WRITE_TIMEOUT)
+        self.assertEqual(self.client.post(url).status_code, 409)
+        VideoUpload.objects.filter(id=upload_id).update(writing_until=None)
+
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(self.client.post(url).status_code, 404)
+        self.assertEqual(Video.objects.count(), 1)
+        self.assertIsNone(VideoUpload.objects.get(id=upload_id).writing_until)
+
+    def test_abandoned_uploads_expire(self):
+        stale = VideoUpload.objects.get(id=self.init().json()['id'])
+        fresh = VideoUpload.objects.get(id=self.init().json()['id'])
+        old = timezone.now() - timedelta(days=2)
+        VideoUpload.objects.filter(id=stale.id).update(updated_at=old)
+        orphan = os.path.join(os.path.dirname(stale.path), '999.part')
+        open(orphan, 'wb').close()
+        os.utime(orphan, (old.timestamp(), old.timestamp()))
+
+        out = StringIO()
+        call_command('expire_uploads', stdout=out)
+        self.assertIn('Expired 1 uploads and removed 1 orphaned part files.', out.getvalue())
+        self.assertEqual(list(VideoUpload.objects.values_list('id', flat=True)), [fresh.id])
+        self.assertEqual(os.listdir(os.path.dirname(stale.path)), [f'{fresh.id}.part'])
+
+
+class WatchProgressTests(TestCase):
+    def setUp(self):
+        teacher = User.objects.create_user(username='teacher', password='x', user_type=User.TEACHER)
+        self.student = User.objects.create_user(username='student', password='x')
+        part = Part.objects.create(name='Programming', slug='programming')
+        self.course = Course.objects.create(name='Python', teacher=teacher, body='', level='Beginner', price=0, part=part)
+        self.video = Video.objects.create(name='Welcome', user=teacher, course=self.course, duration=100)
+        timer = mock.patch('app.progress.threading.Timer')
+        self.Timer = timer.start()
+        self.addCleanup(timer.stop)
+        progress.buffer.clear()
+        progress.video_meta.clear()
+        progress.timer = None
+        progress.last_flush = progress.time.monotonic()
+
+    def test_heartbeats_are_buffered_until_flushed(self):
+        with self.assertNumQueries(1):
+            # Only the video's course and duration are looked up.
+            progress.record(self.student.id, self.video.id, 10)
+            progress.record(self.student.id, self.video.id, 20)
+        self.assertFalse(WatchProgress.objects.exists())
+        self.assertEqual(progress.last_watched_video(self.student, self.course), self.video)
+
+        self.assertEqual(progress.flush(), 1)
+        row = WatchProgress.objects.get()
+        self.assertEqual((row.user, row.course, row.position, row.completed), (self.student, self.course, 20, False))
+        progress.record(self.student.id, self.video.id)
+        progress.flush()
+        self.assertEqual(WatchProgress.objects.get().position, 20)
+
+    def test_timer_flushes_when_heartbeats_stop(self):
+        progress.record(self.student.id, self.video.id, 10)
+        progress.record(self.student.id, self.video.id, 20)
+        self.Timer.assert_called_once_with(settings.PROGRESS_FLUSH_INTERVAL, progress.flush_on_timer)
+        self.assertTrue(self.Timer.return_value.daemon)
+
+        with mock.patch('app.progress.connection.close') as close:
+            self.Timer.call_args.args[1]()
+        close.assert_called_once_with()
+        self.assertEqual(WatchProgress.objects.get().position, 20)
+        self.assertIsNone(progress.timer)
+
+    def test_completion_is_written_at_once_and_kept(self):
+        progress.record(self.student.id, self.video.id, 50)
+        with self.assertNumQueries(1):
+            progress.record(self.student.id, self.video.id, 95)
+        # Other processes read the table, not this buffer.
+        self.assertTrue(WatchProgress.objects.get(user=self.student, video=self.video).completed)
+        with self.assertNumQueries(0):
+            progress.record(self.student.id, self.video.id, 99)
+
+        progress.record(self.student.id, self.video.id, 5)
+        progress.flush()
+        row = WatchProgress.objects.get()
+        self.assertEqual((row.position, row.completed), (5, True))
+        self.assertEqual(progress.completed_video_ids(self.student, {self.video.id}), {self.video.id})
+
+    def test_heartbeat_refuses_positions_that_are_not_finite(self):
+        self.client.force_login(self.student)
+        url = reverse('watch_heartbeat', args=[self.video.id])
+        for position in ('nan', 'inf', '-inf'):
+            self.assertEqual(self.client.post(url, {'position': position}).status_code, 400)
+        self.assertEqual(self.client.post(url, {'position': '12.5'}).status_code, 204)
+        self.assertEqual(list(progress.buffer), [(self.student.id, self.video.id)])
+
+    def test_invalid_row_does_not_drop_the_batch(self):
+        other = User.objects.create_user(username='other', password='x')
+        progress.record(self.student.id, self.video.id, 30)
+        progress.record(other.id, self.video.id, float('nan'))
+        with self.assertLogs('app.progress', 'ERROR'):
+            self.assertEqual(progress.flush(), 2)
+        self.assertEqual(list(WatchProgress.objects.values_list('user', 'position')), [(self.student.id, 30)])
+
+    def test_failed_flush_keeps_the_buffer(self):
+        progress.record(self.student.id, self.video.id, 30)
+        with mock.patch.object(WatchProgress.objects, 'bulk_create', side_effect=OperationalError('locked')):
+            with self.assertRaises(OperationalError):
+                progress.flush()
+        progress.record(self.student.id, self.video.id)
+        self.assertEqual(progress.buffer[(self.student.id, self.video.id)]['position'], 30)
+        progress.flush()
+        self.assertEqual(WatchProgress.objects.get().position, 30)
+
+    @override_settings(PROGRESS_FLUSH_SIZE=1)
+    def test_heartbeat_succeeds_when_its_flush_fails(self):
+        self.client.force_login(self.student)
+        url = reverse('watch_heartbeat', args=[self.video.id])
+        with mock.patch.object(WatchProgress.objects, 'bulk_create', side_effect=OperationalError('locked')), \
+                self.assertLogs('app.progress', 'ERROR'):
+            self.assertEqual(self.client.post(url, {'position': '30'}).status_code, 204)
+        self.assertEqual(progress.buffer[(self.student.id, self.video.id)]['position'], 30)
+        self.assertEqual(self.client.post(url, {'position': '40'}).status_code, 204)
+        self.assertEqual(WatchProgress.objects.get().position, 40)
+
+    def test_unprobed_duration_is_looked_up_again(self):
+        Video.objects.filter(pk=self.video.pk).update(duration=None)
+        progress.record(self.student.id, self.video.id, 95)
+        Video.objects.filter(pk=self.video.pk).update(duration=100)
+        progress.record(self.student.id, self.video.id, 95)
+        self.assertTrue(WatchProgress.objects.get().completed)
+
+
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        teacher = User.objects.create_user(username='teacher', password='x', user_type=User.TEACHER)
+        self.student = User.objects.create_user(username='student', password='x')
+        part = Part.objects.create(name='Programming', slug='programming')
+        self.course = Course.objects.create(name='Python', teacher=teacher, body='', level='Beginner', price=0, part=part)
+
+    def assertAggregates(self, course, count, total, histogram):
+        course.refresh_from_db()
+        self.assertEqual((course.rating_count, course.rating_sum), (count, total))
+        self.assertEqual([getattr(course, f'rating_{stars}') for stars in range(1, 6)], histogram)
+
+    def test_create_update_and_delete_keep_aggregates(self):
+        other = Course.objects.create(
+            name='Django', teacher=self.course.teacher, body='', level='Beginner', price=0, part=self.course.part
+        )
+        reviewer = User.objects.create_user(username='reviewer', password='x')
+        first = Rating.objects.create(user=self.student, course=self.course, rating=4)
+        Rating.objects.create(user=reviewer, course=self.course, rating='5')
+        self.assertAggregates(self.course, 2, 9, [0, 0, 0, 1, 1])
+
+        first.rating = 2
+        first.save()
+        self.assertAggregates(self.course, 2, 7, [0, 1, 0, 0, 1])
+        first.save()
+        self.assertAggregates(self.course, 2, 7, [0, 1, 0, 0, 1])
+
+        first.course = other
+        first.save()
+        self.assertAggregates(self.course, 1, 5, [0, 0, 0, 0, 1])
+        self.assertAggregates(other, 1, 2, [0, 1, 0, 0, 0])
+
+        first.delete()
+        self.assertAggregates(other, 0, 0, [0, 0, 0, 0, 0])
+        # Deleting the user cascades to their rating.
+        reviewer.delete()
+        self.assertAggregates(self.course, 0, 0, [0, 0, 0, 0, 0])
+
+    def test_rating_outside_one_to_five_is_refused(self):
+        rating = Rating.objects.create(user=self.student, course=self.course, rating=3)
+        for stars in (0, 6):
+            rating.rating = stars
+            with self.assertRaises(ValueError):
+                rating.save()
+            with self.assertRaises(ValueError):
+                Rating.objects.create(user=self.student, course=self.course, rating=stars)
+        self.assertEqual(list(Rating.objects.values_list('rating', flat=True)), [3])
+        self.assertAggregates(self.course, 1, 3, [0, 0, 1, 0, 0])
+        # Writes that skip save() are stopped by the database.
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Rating.objects.filter(pk=rating.pk).update(rating=6)
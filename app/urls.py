@@ -14,13 +14,17 @@ urlpatterns = [
     path('account/<str:pk>/', account, name="account"),
     path('account_courses/<str:pk>/', user_courses, name="user_courses"),
     path('add_course/', add_course, name="add_course"),
+    path('upload/init/', upload_init, name="upload_init"),
+    path('upload/<int:pk>/', upload_chunk, name="upload_chunk"),
+    path('upload/<int:pk>/complete/', upload_complete, name="upload_complete"),
     path('delete_users/<str:pk>/', delete_users, name='delete_users'),
     path('search/', search, name="search"),
+    path('suggest/', suggest, name="suggest"),
     path('logout/', logoutUser, name='logout'),
     path("login/", loginPage, name="login"),
     path('register/', registerPage, name="register"),
     path('courses/', courses, name="courses"),
-    path('courses/<str:name>/', courses_tag, name="courses_tag"),
+    path('courses/<str:slug>/', courses_tag, name="courses_tag"),
     path('follow_user/<str:pk>/',follow_user, name="follow_user"),
     path('unfollow_user/<str:pk>/',unfollow_user, name="unfollow_user"),
     path('update_user/<str:pk>/', updateUser, name="updateUser"),
@@ -30,6 +34,12 @@ urlpatterns = [
     name='product_list_by_category'),
     path('detail/<int:pk>/', detail, name="detail"),
     path('detail_video/<int:pk>/<int:id>/', detail_video, name="detail_video"),
+    path('detail/<int:pk>/comments/', course_comments, name="course_comments"),
+    path('detail/<int:pk>/reviews/', course_reviews, name="course_reviews"),
+    path('stream/<int:pk>/', stream_video, name="stream_video"),
+    path('progress/<int:pk>/', watch_heartbeat, name="watch_heartbeat"),
+    path('stream/<int:pk>/hls/<str:name>', stream_hls, name="stream_hls"),
+    path('img/<int:width>/<str:fmt>/<path:name>', image_derivative, name="image_derivative"),
     path('like_course/<int:pk>/', like_course, name="like_course"),
     path('deslike_course/<int:pk>/', deslike_course, name="deslike_course"),
 ]
@@ -1,21 +1,42 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from app.models import Course, Part, Comment, User, Lecture, Video, Tags, Review
+from django.template.loader import render_to_string
+from app.models import Course, Part, Comment, User, Lecture, Video, Tag, Review, VideoUpload
 from app.forms import *
-from django.db.models import Q
+from django.db.models import Count, Q
 from django.contrib import messages
-from moviepy.video.io.VideoFileClip import VideoFileClip
 from django.contrib.auth.decorators import user_passes_test
 from django.contrib.auth import logout, login, authenticate
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
+from app.comments import comment_page, review_page
+from app.pagination import paginate
+from app.search import SEARCH_ORDERING, search_courses
+from app.facets import facet_counts, filter_courses
+from app.suggest import suggestions
+from django.utils.translation import get_language
 from django.utils.translation import gettext as _
 import logging
 import math
 from django.utils import timezone
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, FileResponse, StreamingHttpResponse, HttpResponseNotModified, JsonResponse, HttpResponseNotAllowed
+from django.views.decorators.http import require_POST
+from django.core.files import File
+from app.storage import hash_content
+from app import progress
+import hashlib
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.conf import settings
+from django.core.files.storage import default_storage
+from app.media import IMAGE_WIDTHS, IMAGE_FORMATS, IMAGE_EXTENSIONS, DERIVATIVES_DIR, derivative_name
+import mimetypes
+import os
+import posixpath
+import re
+import time
+from datetime import timedelta
 
 logger = logging.getLogger(__name__)
 
+
 def home(request):
     text = _("Boshqa kurslar")
     gap = _("Featured Courses")
@@ -35,12 +56,10 @@ def home(request):
     dark = _("Dark")
     auto = _("Auto")
     viewa = _("View all categories")
-    parts = Part.objects.all()
-    courses = Course.objects.all()
+    courses = Course.objects.with_card_data(request.user)
     
     return render(request, "home.html", {
         "courses" : courses,
-        "parts" : parts,
         "text" : text,
         "gap" : gap,
         "category" : categorys,
@@ -62,12 +81,8 @@ def home(request):
     })
 
 def courses(request):
-    courses = Course.objects.all()
-    for course in courses:
-        lectures = Lecture.objects.filter(course_id=course.id)
-        count = lectures.count()
-    page = request.GET.get('page', 1)
-    paginator = Paginator(courses, 4)
+    # Keyset pagination: the card annotations only run for the rows on this page.
+    courses = paginate(request, Course.objects.with_card_data(request.user), 4, with_total=True)
     text = _("Boshqa kurslar")
     categorys = _("Category")
     find = _("Find your course")
@@ -82,13 +97,6 @@ def courses(request):
     auto = _("Auto")
     viewa = _("View all categories")
     title = _("Barcha kurslar")
-    parts = Part.objects.all()
-    try:
-        courses = paginator.page(page)
-    except PageNotAnInteger:
-        courses = paginator.page(1)
-    except EmptyPage:
-        courses = paginator.page(paginator.num_pages)
     
     return render(request, "courses.html", {
         "courses" : courses,
@@ -106,29 +114,20 @@ def courses(request):
         "auto" : auto,
         "viewa" : viewa,
         "title" : title,
-        "parts" : parts,
-        "count" : count
     })
 
 def detail(request, pk):
-    course = get_object_or_404(Course, id=pk)
-    reviews = course.review_set.all()
-    lectures = Lecture.objects.filter(course=course)
+    course = get_object_or_404(Course.objects.select_related('teacher'), id=pk)
+    lectures = course.get_syllabus(request.user)
     videos = Video.objects.filter(course=course)
-    parts = Part.objects.all()
-    tags = Tags.objects.filter(course=course)
-    comments = course.comment_set.all()
+    tags = Tag.objects.filter(course_tags__course=course)
 
     comment_form = CommentForm()
-    try:
-        last_viewed_video_instance = Video.objects.filter(user=request.user, course=course).latest('last_watched')
-    except Video.DoesNotExist:
-        first_lecture = lectures.first()
-        if first_lecture:
-            first_video = first_lecture.videos.first()
-            last_viewed_video_instance = first_video
-        else:
-            last_viewed_video_instance = None
+    last_viewed_video_instance = progress.last_watched_video(request.user, course)
+    if last_viewed_video_instance is None and lectures:
+        first_lecture_videos = lectures[0].videos.all()
+        if first_lecture_videos:
+            last_viewed_video_instance = first_lecture_videos[0]
     
     rating_review_form = RatingReviewForm()
 
@@ -176,35 +175,15 @@ def detail(request, pk):
     dark = _("Dark")
     auto = _("Auto")
     viewa = _("View all categories")
-    video_durations = [] 
-    for lecture in lectures:
-        for video in lecture.videos.all():
-            video_path = f'media/{video.file.url}'
-            try:
-                clip = VideoFileClip(video_path)
-                duration_seconds = clip.duration
-                clip.close()
-
-                video_durations.append({
-                    'video_name': video.name,
-                    'duration_seconds': duration_seconds,
-                    'duration_minutes': round(duration_seconds / 60)
-                })
-
-            except Exception as e:
-                error_message = f"Error calculating duration for video {video.name}: {str(e)}"
-                logger.error(error_message)
     return render(request, "detail.html", {
         "course": course, 
-        "reviews": reviews, 
-        "duration_message" : video_durations,
+        "reviews": review_page(course.id),
         'comment_form': comment_form,
         'lectures' : lectures,
         'videos' : videos,
         'last_viewed_video': last_viewed_video_instance,
         'tags' : tags,
-        'comments' : comments,
-        "parts" : parts,
+        'comments' : comment_page(course.id),
         "text" : text,
         "gap" : gap,
         "category" : categorys,
@@ -230,7 +209,7 @@ def search(request):
     query = request.GET.get('query', '')
     form = CourseSearchForm(request.GET)
 
-    courses = Course.objects.all()
+    courses = Course.objects.with_card_data(request.user)
     text = _("Boshqa kurslar")
     categorys = _("Category")
     find = _("Find your course")
@@ -246,30 +225,23 @@ def search(request):
     viewa = _("View all categories")
     title = _("Boshqa kurslar")
 
-    # Form-based filtering
+    # Facet counts are taken before the filters, so every option shows what it would give.
+    if query.strip():
+        courses = search_courses(courses, query)
     if form.is_valid():
-        category = form.cleaned_data.get('category')
-        price_level = form.cleaned_data.get('price_level')
-        skill_level = form.cleaned_data.get('skill_level')
-
-        if category:
-            courses = courses.filter(part__slug=category)
-
-        if price_level:
-            if price_level == 'Free':
-                courses = courses.filter(price=0)
-            elif price_level == 'Paid':
-                courses = courses.exclude(price=0)
-
-        if skill_level:
-            courses = courses.filter(level=skill_level)
-
-    # Query parameter-based filtering
-    if query:
-        courses = courses.filter(
-            Q(name__icontains=query) | Q(level__icontains=query) | Q(price__icontains=query)
+        selected = form.cleaned_data
+        form.set_facet_counts(facet_counts(courses, query, selected))
+        courses = filter_courses(
+            courses,
+            category=selected.get('category'),
+            price_level=selected.get('price_level'),
+            skill_level=selected.get('skill_level'),
+            rating=selected.get('rating'),
         )
 
+    ordering = SEARCH_ORDERING if query.strip() else ('-created_at', '-id')
+    courses = paginate(request, courses, 4, ordering=ordering, with_total=True)
+
     context = {
         'form': form,
         'query': query,
@@ -314,8 +286,12 @@ def deslike_course(request, pk):
 
 def full_search(request):
     quer = request.GET.get('quer', '')
-    parts  = Part.objects.filter(Q(name__icontains=quer))
-    courses  = Course.objects.filter(Q(name__icontains=quer) | Q(level__icontains=quer) | Q(price__icontains=quer))
+    parts  = Part.objects.filter(Q(name__icontains=quer)).annotate(course_count=Count('parts'))
+    courses  = search_courses(Course.objects.with_card_data(request.user), quer, fuzzy=True)
+    if quer.strip():
+        courses = paginate(request, courses, 4, ordering=SEARCH_ORDERING, with_total=True)
+    else:
+        courses = paginate(request, courses, 4, with_total=True)
     text = _("Boshqa kurslar")
     categorys = _("Category")
     title = _("Education, talents, and career opportunities. All in one place.")
@@ -380,7 +356,7 @@ def account(request, pk):
         courses_c = Course.objects.filter(teacher=user)
     
     query = request.GET.get('query', '')
-    courses = Course.objects.filter(Q(name__icontains=query) | Q(level__icontains=query) | Q(price__icontains=query))
+    courses = search_courses(Course.objects.all(), query)
     text = _("Boshqa kurslar")
     categorys = _("Category")
     find = _("Find your course")
@@ -481,7 +457,6 @@ def registerPage(request):
 
 def coursesview(request, part_slug=None):
     part = None
-    parts = Part.objects.all()
     text = _("Boshqa kurslar")
     categorys = _("Category")
     title = _("Education, talents, and career opportunities. All in one place.")
@@ -496,15 +471,14 @@ def coursesview(request, part_slug=None):
     dark = _("Dark")
     auto = _("Auto")
     viewa = _("View all categories")
-    courses = Course.objects.all()
+    courses = Course.objects.with_card_data(request.user)
     if part_slug:
         part = get_object_or_404(Part, 
         slug=part_slug)
-    courses = courses.filter(part=part)
+    courses = paginate(request, courses.filter(part=part), 4, with_total=True)
     return render(request,
         'courses.html',
         {'part': part,
-        'parts': parts,
         'courses': courses,
         "text" : text,
         "category" : categorys,
@@ -523,22 +497,19 @@ def coursesview(request, part_slug=None):
         })
 
 def detail_video(request, pk, id):
-    course = get_object_or_404(Course, id=pk)
-    tags = Tags.objects.filter(course=course)
-    reviews = course.review_set.all()
-    lectures = Lecture.objects.filter(course=course)
-    lecture = get_object_or_404(lectures, id=pk)
-    videos_queryset = lecture.videos.all()
-
-    if videos_queryset.exists():
-        video_ids = videos_queryset.get(id=id)
-    else:
-        video_ids = None
-    video = get_object_or_404(Video, id=id)
-    video.last_watched = timezone.now()
-    video.save()
-    lecture_count = lectures.count()
-    comments = course.comment_set.all()
+    course = get_object_or_404(Course.objects.select_related('teacher'), id=pk)
+    tags = Tag.objects.filter(course_tags__course=course)
+    lectures = course.get_syllabus(request.user)
+    # The lecture and video come from the syllabus that is rendered anyway.
+    lecture, video_ids = next(
+        ((item, video) for item in lectures for video in item.videos.all() if video.id == id),
+        (None, None),
+    )
+    if lecture is None:
+        raise Http404("Video not found in this course.")
+    if request.user.is_authenticated:
+        progress.record(request.user.id, video_ids.id)
+    lecture_count = len(lectures)
 
     comment_form = CommentForm()
     text = _("Boshqa kurslar")
@@ -555,24 +526,6 @@ def detail_video(request, pk, id):
     dark = _("Dark")
     auto = _("Auto")
     viewa = _("View all categories")
-    video_durations = []
-    for lecture in lectures:
-        for video in lecture.videos.all():
-            video_path = f'media/{video.file.url}'
-            try:
-                clip = VideoFileClip(video_path)
-                duration_seconds = clip.duration
-                clip.close()
-
-                video_durations.append({
-                    'video_name': video.name,
-                    'duration_seconds': duration_seconds,
-                    'duration_minutes': round(duration_seconds / 60)
-                })
-
-            except Exception as e:
-                error_message = f"Error calculating duration for video {video.name}: {str(e)}"
-                logger.error(error_message)
     rating_review_form = RatingReviewForm()
 
     if request.method == 'POST':
@@ -604,14 +557,13 @@ def detail_video(request, pk, id):
 
     return render(request, "video_detail.html", {
         "course": course, 
-        "reviews": reviews, 
+        "reviews": review_page(course.id),
         'comment_form': comment_form,
         'lecture_count' : lecture_count,
         'lectures' : lectures,
         'tags' : tags,
         'lecture' : lecture,
-        "duration_message" : video_durations,
-        'comments' : comments,
+        'comments' : comment_page(course.id),
         'video_ids' : video_ids,
         "text" : text,
         "category" : categorys,
@@ -630,13 +582,160 @@ def detail_video(request, pk, id):
         }
     )
 
-def courses_tag(request, name):
-    courses = Tags.objects.filter(name=name)
-    for course in courses:
-        lectures = Lecture.objects.filter(course_id=course.id)
-        count = lectures.count()
-    page = request.GET.get('page', 1)
-    paginator = Paginator(courses, 4)
+# A first byte, a suffix length or both; "bytes=-" is malformed and ignored.
+RANGE_RE = re.compile(r"^bytes=(?=\d|-\d)(\d*)-(\d*)$")
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def parse_range(header, size):
+    """Return (start, end) for a single-range ``Range`` header, or None if it does not apply."""
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start:
+        # Suffix range: the last N bytes.
+        start = max(size - int(end), 0)
+        end = size - 1
+    else:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    if start > end:
+        return None
+    return start, end
+
+
+def read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(STREAM_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+HLS_CONTENT_TYPES = {
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.ts': 'video/mp2t',
+}
+HLS_NAME_RE = re.compile(r"^[\w-]+\.(m3u8|ts)$")
+
+
+def serve_file(request, path, content_type=None, cache_control='private, max-age=86400'):
+    """Serve a media file with conditional GET and single byte-range support."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return HttpResponse(status=404)
+
+    size = stat.st_size
+    etag = quote_etag(f'{int(stat.st_mtime):x}-{size:x}')
+    last_modified = http_date(stat.st_mtime)
+    content_type = content_type or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if range_header:
+        # A stale If-Range means the client's partial copy is outdated, so send the whole file.
+        if_range = request.headers.get('If-Range')
+        if not if_range or if_range == etag or parse_http_date_safe(if_range) == int(stat.st_mtime):
+            byte_range = parse_range(range_header, size)
+            if byte_range is None and RANGE_RE.match(range_header.strip()):
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{size}'
+                return response
+
+    if byte_range is None:
+        # FileResponse hands the open file to the server's wsgi.file_wrapper (sendfile where available).
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        if end == size - 1:
+            f = open(path, 'rb')
+            f.seek(start)
+            response = FileResponse(f, content_type=content_type, status=206)
+        else:
+            response = StreamingHttpResponse(read_range(path, start, length), content_type=content_type, status=206)
+        response['Content-Length'] = str(length)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    response['Cache-Control'] = cache_control
+    return response
+
+
+def stream_video(request, pk):
+    video = get_object_or_404(Video.objects.select_related('course'), id=pk)
+    if not video.course.can_watch(request.user):
+        return HttpResponse(status=403)
+    video_file = video.playback_file
+    if not video_file:
+        return HttpResponse(status=404)
+    return serve_file(request, video_file.path, content_type='video/mp4')
+
+
+def stream_hls(request, pk, name):
+    video = get_object_or_404(Video.objects.select_related('course'), id=pk)
+    if not video.course.can_watch(request.user):
+        return HttpResponse(status=403)
+    if not video.hls_playlist or not HLS_NAME_RE.match(name):
+        return HttpResponse(status=404)
+    path = os.path.join(Video.file.field.storage.path(video.hls_dir), name)
+    content_type = HLS_CONTENT_TYPES[os.path.splitext(name)[1]]
+    # Playlists are tiny and replaced on re-packaging; segments never change once written.
+    cache_control = 'private, max-age=60' if name.endswith('.m3u8') else 'private, max-age=604800, immutable'
+    return serve_file(request, path, content_type=content_type, cache_control=cache_control)
+
+def image_derivative(request, width, fmt, name):
+    """Serve a responsive derivative encoded by the media worker.
+
+    Derivatives are queued when an image is saved, never from here. Until
+    the worker has encoded one, the original image is served with a short
+    cache lifetime, so the request never waits on an encode.
+    """
+    name = posixpath.normpath(name)
+    if (width not in IMAGE_WIDTHS or fmt not in IMAGE_FORMATS
+            or name.startswith(('..', '/', DERIVATIVES_DIR + '/'))
+            or not name.lower().endswith(IMAGE_EXTENSIONS)
+            or not default_storage.exists(name)):
+        return HttpResponse(status=404)
+
+    target = derivative_name(name, width, fmt)
+    if not default_storage.exists(target):
+        return serve_file(request, default_storage.path(name), cache_control='public, max-age=60')
+    # Uploaded names are never reused, so a derivative URL always points at the same bytes.
+    return serve_file(request, default_storage.path(target), content_type=IMAGE_FORMATS[fmt][1],
+                      cache_control='public, max-age=31536000, immutable')
+
+@login_required(login_url='login')
+@require_POST
+def watch_heartbeat(request, pk):
+    """Buffer the player position; the database is written in batches by progress.flush."""
+    try:
+        position = float(request.POST['position'])
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'position is required.'}, status=400)
+    if not math.isfinite(position):
+        return JsonResponse({'error': 'position must be a finite number.'}, status=400)
+    completed = request.POST.get('completed') == '1'
+    if not progress.record(request.user.id, pk, max(position, 0), completed):
+        return JsonResponse({'error': 'Unknown video.'}, status=404)
+    return HttpResponse(status=204)
+
+def courses_tag(request, slug):
+    tag = get_object_or_404(Tag, slug=slug)
+    tagged = Course.objects.with_card_data(request.user).filter(course_tags__tag=tag)
+    courses = paginate(request, tagged, 4, total=tag.course_count)
     text = _("Boshqa kurslar")
     categorys = _("Category")
     title = _("Education, talents, and career opportunities. All in one place.")
@@ -651,14 +750,9 @@ def courses_tag(request, name):
     dark = _("Dark")
     auto = _("Auto")
     viewa = _("View all categories")
-    try:
-        courses = paginator.page(page)
-    except PageNotAnInteger:
-        courses = paginator.page(1)
-    except EmptyPage:
-        courses = paginator.page(paginator.num_pages)
     
     return render(request, 'courses_tag.html', {
+        'tag' : tag,
         'courses' : courses,
         "text" : text,
         "category" : categorys,
@@ -674,7 +768,6 @@ def courses_tag(request, name):
         "auto" : auto,
         "viewa" : viewa,
         "title" : title,
-        "count" : count,
     })
 
 def delete_course(request, pk, id):
@@ -710,7 +803,7 @@ def user_courses(request, pk):
     if user.is_teacher():
         user_courses = Course.objects.filter(teacher=user)
     query = request.GET.get('query', '')
-    courses = Course.objects.filter(Q(name__icontains=query) | Q(level__icontains=query) | Q(price__icontains=query))
+    courses = search_courses(Course.objects.all(), query)
     return render(request, "user_courses.html", {'courses': courses, 'user_courses': user_courses})
 
 @login_required
@@ -739,7 +832,163 @@ def add_course(request):
             lecture_form.save_m2m()
             return redirect('/')  
 
-    return render(request, 'add.html', {'form': form, 'video_form': video_form, "lecture_form": lecture_form})
+    # Chunked video uploads go to one of the teacher's courses, picked on the page.
+    upload_courses = Course.objects.filter(teacher=request.user).only('id', 'name').order_by('-created_at')
+    return render(request, 'add.html', {
+        'form': form,
+        'video_form': video_form,
+        "lecture_form": lecture_form,
+        'upload_courses': upload_courses,
+        'upload_course': request.GET.get('course', ''),
+    })
+
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+# A chunk write that has not finished by then is assumed dead, and its chunk can be sent again.
+CHUNK_WRITE_TIMEOUT = timedelta(minutes=15)
+UPLOAD_EXPIRY_INTERVAL = 3600
+last_upload_expiry = 0.0
+
+
+@login_required(login_url='login')
+@require_POST
+def upload_init(request):
+    global last_upload_expiry
+    try:
+        course = Course.objects.get(id=request.POST['course_id'], teacher=request.user)
+        size = int(request.POST['size'])
+        filename = os.path.basename(request.POST['filename'])
+    except (KeyError, ValueError, Course.DoesNotExist):
+        return JsonResponse({'error': 'course_id, filename and size are required.'}, status=400)
+    sha256 = request.POST.get('sha256', '').lower()
+    if sha256 and not SHA256_RE.match(sha256):
+        return JsonResponse({'error': 'sha256 must be a hex digest.'}, status=400)
+    if not filename or size <= 0 or size > settings.CHUNKED_UPLOAD_MAX_SIZE:
+        return JsonResponse({'error': 'Invalid file name or size.'}, status=400)
+
+    upload = VideoUpload.objects.create(
+        user=request.user,
+        course=course,
+        name=(request.POST.get('name') or os.path.splitext(filename)[0])[:44],
+        filename=filename,
+        size=size,
+        sha256=sha256,
+    )
+    os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+    open(upload.path, 'wb').close()
+    if time.monotonic() - last_upload_expiry > UPLOAD_EXPIRY_INTERVAL:
+        last_upload_expiry = time.monotonic()
+        VideoUpload.expire(settings.CHUNKED_UPLOAD_EXPIRE_AFTER)
+    return JsonResponse({
+        'id': upload.id,
+        'offset': 0,
+        'chunk_size': settings.CHUNKED_UPLOAD_CHUNK_SIZE,
+    }, status=201)
+
+
+@login_required(login_url='login')
+def upload_chunk(request, pk):
+    """Report the resume offset (GET) or append one chunk at ``Upload-Offset`` (POST).
+
+    The body is streamed to disk in small blocks, so memory use does not
+    depend on the chunk or file size. An optional ``Upload-Checksum`` header
+    holds the sha256 of the chunk; a mismatch discards the chunk. While one
+    request writes a chunk, others for the same upload get 409.
+    """
+    upload = get_object_or_404(VideoUpload, id=pk, user=request.user, video__isnull=True)
+    if request.method == 'GET':
+        return JsonResponse({'offset': upload.offset, 'size': upload.size})
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['GET', 'POST'])
+
+    try:
+        offset = int(request.headers['Upload-Offset'])
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'Upload-Offset and Content-Length are required.'}, status=400)
+    if offset != upload.offset:
+        return JsonResponse({'error': 'Offset mismatch.', 'offset': upload.offset}, status=409)
+    if length <= 0 or length > settings.CHUNKED_UPLOAD_CHUNK_SIZE or offset + length > upload.size:
+        return JsonResponse({'error': 'Invalid chunk length.', 'offset': upload.offset}, status=400)
+
+    # Claim the chunk, the same way workers claim jobs; only one request may write at this offset.
+    now = timezone.now()
+    lease = now + CHUNK_WRITE_TIMEOUT
+    claimed = VideoUpload.objects.filter(pk=upload.pk, offset=offset).filter(
+        Q(writing_until__isnull=True) | Q(writing_until__lt=now)
+    ).update(writing_until=lease)
+    if not claimed:
+        return JsonResponse({'error': 'This chunk is already being written.', 'offset': upload.offset}, status=409)
+
+    checksum = request.headers.get('Upload-Checksum', '').lower()
+    digest = hashlib.sha256()
+    remaining = length
+    try:
+        with open(upload.path, 'r+b') as f:
+            # Drop whatever an interrupted request left past the confirmed offset.
+            f.seek(offset)
+            f.truncate()
+            while remaining > 0:
+                block = request.read(min(STREAM_CHUNK_SIZE, remaining))
+                if not block:
+                    break
+                f.write(block)
+                digest.update(block)
+                remaining -= len(block)
+            if checksum and (remaining or digest.hexdigest() != checksum):
+                f.truncate(offset)
+                return JsonResponse({'error': 'Chunk checksum mismatch.', 'offset': offset}, status=400)
+
+        received = length - remaining
+        VideoUpload.objects.filter(pk=upload.pk, offset=offset, writing_until=lease).update(
+            offset=offset + received, updated_at=timezone.now(),
+        )
+    finally:
+        VideoUpload.objects.filter(pk=upload.pk, writing_until=lease).update(writing_until=None)
+    if remaining:
+        return JsonResponse({'error': 'Incomplete chunk.', 'offset': offset + received}, status=400)
+    return JsonResponse({'offset': offset + received})
+
+
+@login_required(login_url='login')
+@require_POST
+def upload_complete(request, pk):
+    upload = get_object_or_404(VideoUpload, id=pk, user=request.user, video__isnull=True)
+    if upload.offset != upload.size:
+        return JsonResponse({'error': 'Upload is not finished.', 'offset': upload.offset}, status=409)
+
+    # Claim the upload like a chunk write, so a second complete cannot build a second Video from it.
+    now = timezone.now()
+    lease = now + CHUNK_WRITE_TIMEOUT
+    claimed = VideoUpload.objects.filter(pk=upload.pk, video__isnull=True, offset=upload.size).filter(
+        Q(writing_until__isnull=True) | Q(writing_until__lt=now)
+    ).update(writing_until=lease)
+    if not claimed:
+        return JsonResponse({'error': 'Upload is already being completed.', 'offset': upload.offset}, status=409)
+
+    try:
+        if upload.sha256:
+            with open(upload.path, 'rb') as f:
+                digest, _size = hash_content(File(f))
+            if digest != upload.sha256:
+                VideoUpload.objects.filter(pk=upload.pk).update(offset=0)
+                open(upload.path, 'wb').close()
+                return JsonResponse({'error': 'Checksum mismatch, upload again.', 'offset': 0}, status=400)
+
+        with open(upload.path, 'rb') as f:
+            video = Video(
+                name=upload.name,
+                user=upload.user,
+                course=upload.course,
+                file=File(f, name=upload.filename),
+            )
+            video.save()
+        upload.video = video
+        upload.writing_until = None
+        upload.save(update_fields=['video', 'writing_until', 'updated_at'])
+    finally:
+        VideoUpload.objects.filter(pk=upload.pk, writing_until=lease).update(writing_until=None)
+    os.remove(upload.path)
+    return JsonResponse({'video': video.id, 'status': video.processing_status}, status=201)
 
 def delete_users(request, pk):
     return render(request, 'delete_user.html')
@@ -765,7 +1014,6 @@ def unfollow_user(request, pk):
     return render(request, 'detail.html')
 
 def parts(request):
-    parts = Part.objects.all()
     text = _("Boshqa kurslar")
     categorys = _("Category")
     find = _("Find your course")
@@ -782,7 +1030,6 @@ def parts(request):
     title = _("Barcha kurslar")
     
     return render(request, "parts.html", {
-        "parts" : parts,
         "text" : text,
         "category" : categorys,
         "find" : find,
@@ -797,7 +1044,6 @@ def parts(request):
         "auto" : auto,
         "viewa" : viewa,
         "title" : title,
-        "parts" : parts
     })
 
 def student_subscrtiption(request):
@@ -819,4 +1065,28 @@ def instructor_student(request):
     return render(request, "instructor_student.html")
 
 def order(request):
-    return render(request, "order.html")
\ No newline at end of file
+    return render(request, "order.html")
+
+SUGGEST_LIMIT = 8
+SUGGEST_MAX_LIMIT = 20
+
+def suggest(request):
+    prefix = request.GET.get('q', '')[:100]
+    try:
+        limit = min(int(request.GET.get('limit', SUGGEST_LIMIT)), SUGGEST_MAX_LIMIT)
+    except ValueError:
+        limit = SUGGEST_LIMIT
+    results = suggestions.suggest(prefix, get_language(), max(limit, 1))
+    return JsonResponse({'query': prefix, 'results': results})
+
+def course_comments(request, pk):
+    """The page of top-level comments after ``cursor``, for lazy loading on the detail pages."""
+    page = comment_page(pk, request.GET.get('cursor'))
+    html = render_to_string('front/comment_list.html', {'comments': page}, request)
+    return JsonResponse({'html': html, 'next_url': page.next_url})
+
+def course_reviews(request, pk):
+    """The page of reviews after ``cursor``, for lazy loading on the detail pages."""
+    page = review_page(pk, request.GET.get('cursor'))
+    html = render_to_string('front/review_list.html', {'reviews': page}, request)
+    return JsonResponse({'html': html, 'next_url': page.next_url})
@@ -0,0 +1,125 @@
+"""Measure catalog page latency as the number of courses grows.
+
+Usage: python -m benchmarks.catalog_pages [--sizes 100,1000,10000,100000] [--repeat N] [--json]
+
+Seeds a throwaway SQLite database (the project database is not touched)
+up to each size in turn and times the first and the last page of
+/courses/ and of a tag listing. Page latency should stay flat: only the
+courses on the page are annotated.
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+
+BATCH_SIZE = 5000
+TAG = 'bench'
+TAGGED = 400
+PER_PAGE = 4
+
+
+def setup_database(path):
+    from django.conf import settings
+
+    settings.DATABASES['default']['NAME'] = path
+    # Fragments and shared entries from the throwaway database go in its directory too.
+    for alias in (settings.FRAGMENT_CACHE_ALIAS, settings.SHARED_CACHE_ALIAS):
+        settings.CACHES[alias]['LOCATION'] = os.path.join(os.path.dirname(path), alias)
+    import django
+    django.setup()
+    from django.core.management import call_command
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    call_command('migrate', verbosity=0)
+
+
+def seed(start, stop):
+    """Create courses numbered ``start`` to ``stop - 1``, each with a lecture and a tag."""
+    from app.models import Course, CourseTag, Lecture, Part, Tag, User
+
+    teacher, _ = User.objects.get_or_create(username='bench-teacher', defaults={'user_type': User.TEACHER})
+    part, _ = Part.objects.get_or_create(slug='bench', defaults={'name': 'Bench'})
+    tag, _ = Tag.objects.get_or_create(slug=TAG, defaults={'name': TAG})
+    for batch_start in range(start, stop, BATCH_SIZE):
+        numbers = range(batch_start, min(batch_start + BATCH_SIZE, stop))
+        courses = Course.objects.bulk_create([
+            Course(name=f'Course {i}', teacher=teacher, body='', level='Beginner', price=i % 50, part=part)
+            for i in numbers
+        ])
+        Lecture.objects.bulk_create([Lecture(name='Intro', user=teacher, course=c) for c in courses])
+        CourseTag.objects.bulk_create([CourseTag(tag=tag, course=c) for i, c in zip(numbers, courses) if i < TAGGED])
+    Tag.recount([tag.id])
+
+
+def last_page_cursor(courses):
+    """Cursor of the last page of ``courses`` in the catalog's newest-first order."""
+    from app.pagination import CursorPaginator
+
+    anchor = courses.order_by('created_at', 'id')[PER_PAGE]
+    return CursorPaginator(courses, PER_PAGE).cursor(anchor)
+
+
+def time_page(client, url, repeat):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    client.get(url)
+    timings = []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = client.get(url)
+            timings.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, (url, response.status_code)
+    return {'ms': round(statistics.median(timings), 2), 'queries': len(queries)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='100,1000,10000,100000')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', action='store_true', help="Print results as JSON.")
+    args = parser.parse_args()
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_database(os.path.join(tmp, 'bench.sqlite3'))
+        from django.test import Client
+        from django.urls import reverse
+
+        from app.models import Course, Tag
+
+        client = Client()
+        results = []
+        seeded = 0
+        for size in sizes:
+            seed(seeded, size)
+            seeded = size
+            pages = {
+                'courses first page': reverse('courses'),
+                'courses last page': f"{reverse('courses')}?cursor={last_page_cursor(Course.objects.all())}",
+                'tag first page': reverse('courses_tag', args=[TAG]),
+                'tag last page': f"{reverse('courses_tag', args=[TAG])}?cursor={last_page_cursor(Course.objects.filter(course_tags__tag=Tag.objects.get(slug=TAG)))}",
+            }
+            results.append({
+                'courses': size,
+                'pages': {name: time_page(client, url, args.repeat) for name, url in pages.items()},
+            })
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for result in results:
+        timings = ', '.join(
+            f"{name} {page['ms']}ms/{page['queries']}q" for name, page in result['pages'].items()
+        )
+        print(f"{result['courses']:>7} courses: {timings}")
+
+
+if __name__ == '__main__':
+    main()
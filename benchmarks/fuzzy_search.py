@@ -0,0 +1,114 @@
+"""Measure typo-tolerant name search on a generated corpus.
+
+Usage: python -m benchmarks.fuzzy_search [--names 100000] [--queries 1000] [--seed 1] [--json]
+
+Builds app.fuzzy.FuzzyIndex over random Uzbek-like course names, a third
+of them stored in Cyrillic, then looks each query up. A query is a stored
+name, possibly written in the other script, cut to its first words and
+given one typo. Reports p50/p99 latency and recall@10: how often a name
+containing the intended words is among the top 10. The database is not
+touched.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+
+# (Latin, Cyrillic) spellings of syllables, so each name exists in both scripts.
+SYLLABLES = [
+    ('da', 'да'), ('stur', 'стур'), ('lash', 'лаш'), ('o', 'о'), ('qo', 'қо'), ('g\'', 'ғ'),
+    ('shi', 'ши'), ('cha', 'ча'), ('xo', 'хо'), ('ki', 'ки'), ('mo', 'мо'), ('yo', 'ё'),
+    ('ma', 'ма'), ('te', 'те'), ('ti', 'ти'), ('ka', 'ка'), ('ri', 'ри'), ('zo', 'зо'),
+    ('bek', 'бек'), ('lar', 'лар'), ('ni', 'ни'), ('sa', 'са'), ('vo', 'во'), ('hu', 'ҳу'),
+    ('ju', 'жу'), ('fi', 'фи'), ('ya', 'я'), ('ol', 'ол'), ('u', 'у'), ('bo', 'бо'),
+]
+LETTERS = 'abcdefghijklmnopqrstuvxyz'
+
+
+def make_word(rng):
+    parts = [rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))]
+    return ''.join(p[0] for p in parts), ''.join(p[1] for p in parts)
+
+
+def make_name(rng):
+    words = [make_word(rng) for _ in range(rng.randint(1, 4))]
+    return ' '.join(w[0] for w in words), ' '.join(w[1] for w in words)
+
+
+def add_typo(rng, text):
+    if len(text) < 4:
+        return text
+    i = rng.randrange(1, len(text) - 1)
+    kind = rng.choice(('delete', 'insert', 'replace', 'swap'))
+    if kind == 'delete':
+        return text[:i] + text[i + 1:]
+    if kind == 'insert':
+        return text[:i] + rng.choice(LETTERS) + text[i:]
+    if kind == 'replace':
+        return text[:i] + rng.choice(LETTERS) + text[i + 1:]
+    return text[:i - 1] + text[i] + text[i - 1] + text[i + 1:]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--names', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help="Print results as JSON.")
+    args = parser.parse_args()
+
+    import django
+    django.setup()
+    from app.fuzzy import FuzzyIndex, fold
+
+    rng = random.Random(args.seed)
+    corpus = [make_name(rng) for _ in range(args.names)]
+    index = FuzzyIndex()
+    started = time.perf_counter()
+    for pk, (latin, cyrillic) in enumerate(corpus):
+        index.add(pk, [cyrillic if pk % 3 == 0 else latin])
+    build_seconds = time.perf_counter() - started
+
+    timings = []
+    hits = 0
+    for _ in range(args.queries):
+        pk = rng.randrange(args.names)
+        latin, cyrillic = corpus[pk]
+        text = cyrillic if rng.random() < 0.5 else latin
+        words = text.split()
+        intended = ' '.join(words[:rng.randint(1, len(words))])
+        query = add_typo(rng, intended)
+        started = time.perf_counter()
+        found = index.search(query, 10)
+        timings.append((time.perf_counter() - started) * 1000)
+        # Short queries fit many names equally well, so any name containing the words counts.
+        wanted = f' {fold(intended)} '
+        hits += any(wanted in f' {fold(corpus[found_pk][0])} ' for found_pk, _ in found)
+
+    summary = {
+        'names': args.names,
+        'queries': args.queries,
+        'build_seconds': round(build_seconds, 2),
+        'p50_ms': round(statistics.median(timings), 2),
+        'p99_ms': round(percentile(timings, 99), 2),
+        'recall_at_10': round(hits / args.queries, 3),
+    }
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    print(f"{summary['names']} names indexed in {summary['build_seconds']}s")
+    print(f"{summary['queries']} queries: p50 {summary['p50_ms']}ms, p99 {summary['p99_ms']}ms, "
+          f"recall@10 {summary['recall_at_10']:.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Measure HLS packaging time per minute of source video.
+
+Usage: python -m benchmarks.hls_packaging [--threads N] [--json] [video ...]
+
+Defaults to the file of every Video whose file is on disk, each stored
+file once. Only reads the database, and only to find those files. Videos
+without a readable duration are skipped.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+
+from app.media import HLS_RENDITIONS, package_hls, probe_video
+
+
+def stored_videos():
+    """Paths of the distinct stored files of every Video."""
+    import django
+    django.setup()
+    from app.models import Video
+
+    storage = Video.file.field.storage
+    names = Video.objects.exclude(file='').values_list('file', flat=True).distinct()
+    return sorted(path for path in map(storage.path, names) if os.path.exists(path))
+
+
+def bench(path, threads):
+    try:
+        duration = probe_video(path)['duration']
+    except ValueError:
+        duration = 0
+    if not duration:
+        print(f"Skipping {path}: no duration", file=sys.stderr)
+        return None
+    with tempfile.TemporaryDirectory() as output_dir:
+        started = time.perf_counter()
+        renditions = package_hls(path, output_dir, threads=threads)
+        elapsed = time.perf_counter() - started
+        output_size = sum(
+            os.path.getsize(os.path.join(output_dir, name)) for name in os.listdir(output_dir)
+        )
+    return {
+        'file': path,
+        'duration': duration,
+        'renditions': renditions,
+        'seconds': round(elapsed, 2),
+        'seconds_per_minute': round(elapsed / (duration / 60), 2),
+        'output_bytes': output_size,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('videos', nargs='*')
+    parser.add_argument('--threads', type=int, default=0, help="ffmpeg threads, 0 lets ffmpeg decide.")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON.")
+    args = parser.parse_args()
+
+    videos = args.videos or stored_videos()
+    results = [result for result in (bench(path, args.threads) for path in videos) if result]
+    total_seconds = sum(r['seconds'] for r in results)
+    total_minutes = sum(r['duration'] for r in results) / 60
+    summary = {
+        'ladder': [name for name, _, _, _ in HLS_RENDITIONS],
+        'videos': results,
+        'seconds_per_minute': round(total_seconds / total_minutes, 2) if total_minutes else None,
+    }
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    for r in results:
+        print(f"{r['file']}: {r['duration']:.1f}s of video, {len(r['renditions'])} renditions, "
+              f"{r['seconds']}s ({r['seconds_per_minute']}s per minute)")
+    print(f"Overall: {summary['seconds_per_minute']}s of packaging per minute of video")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+"""Measure the hot views against a seeded catalog.
+
+Usage: python -m benchmarks.hot_views [--courses 1000] [--requests 100] [--seed 1]
+       [--output results.json] [--baseline benchmarks/hot_views/baseline.json] [--json]
+
+Seeds a throwaway SQLite database (the project database is not touched)
+with courses and their lectures, videos, students, ratings, reviews,
+comment threads and orders, see seed.py. Then it sends GET requests to
+home, courses, detail, detail_video, search, full_search, cart_detail and
+order_create through Django's WSGI handler as a logged-in student with a
+cart. For each view it reports p50/p95/p99 latency, plus the queries,
+database time and template time per request that QueryBudgetMiddleware
+counted. It also reports the peak RSS of the process.
+
+Compare with --baseline: a view regresses if it runs more queries or its
+p95 grows by more than --tolerance (20%), and the exit status is 1.
+Latency only compares on the same machine, so regenerate the baseline
+with --output when the hardware changes.
+"""
@@ -0,0 +1,192 @@
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+from wsgiref.util import setup_testing_defaults
+
+from benchmarks.catalog_pages import setup_database
+from benchmarks.fuzzy_search import percentile
+from benchmarks.hot_views import __doc__ as description
+
+CART_COURSES = 3
+# Compared with a baseline, a view regresses if it runs more queries or its p95 grows by more than the tolerance.
+TOLERANCE = 0.2
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux.
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def wsgi_get(handler, url, cookie):
+    """GET ``url`` through the WSGI handler and return the status code."""
+    path, _, query = url.partition('?')
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'HTTP_HOST': 'testserver',
+        'HTTP_COOKIE': cookie,
+    }
+    setup_testing_defaults(environ)
+    statuses = []
+    response = handler(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    try:
+        for _ in response:
+            pass
+    finally:
+        response.close()
+    return int(statuses[0].split()[0])
+
+
+def student_session(courses):
+    """Cookie header of a logged-in student with ``courses`` in their cart."""
+    from django.conf import settings
+    from django.test import Client
+    from django.urls import reverse
+
+    from app.models import User
+
+    client = Client()
+    client.force_login(User.objects.filter(user_type=User.STUDENT).first())
+    for course in courses:
+        client.post(reverse('cart:cart_add_net_quantity', args=[course.id]))
+    return f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+
+
+def hot_views():
+    """(view name, url) of every benchmarked view."""
+    from django.urls import reverse
+
+    from app.models import Course, Video
+
+    course = Course.objects.order_by('id')[Course.objects.count() // 2]
+    video = Video.objects.filter(course=course).order_by('id').first()
+    return [
+        ('home', reverse('home')),
+        ('courses', reverse('courses')),
+        ('detail', reverse('detail', args=[course.id])),
+        ('detail_video', reverse('detail_video', args=[course.id, video.id])),
+        ('search', f"{reverse('search')}?query=python"),
+        ('full_search', f"{reverse('full_search')}?quer=python"),
+        ('cart:cart_detail', reverse('cart:cart_detail')),
+        ('orders:order_create', reverse('orders:order_create')),
+    ]
+
+
+def bench_view(handler, view_name, url, cookie, requests):
+    from app import querybudget
+
+    wsgi_get(handler, url, cookie)
+    querybudget.totals.clear()
+    timings = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        status = wsgi_get(handler, url, cookie)
+        timings.append((time.perf_counter() - started) * 1000)
+        assert status == 200, (url, status)
+    # QueryBudgetMiddleware has counted and timed every request.
+    totals = querybudget.totals[view_name]
+    return {
+        'url': url,
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p95_ms': round(percentile(timings, 95), 2),
+        'p99_ms': round(percentile(timings, 99), 2),
+        'queries': round(totals['queries'] / requests, 1),
+        'db_ms': round(totals['db_time'] * 1000 / requests, 2),
+        'template_ms': round(totals['template_time'] * 1000 / requests, 2),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Return a line per view compared with ``baseline``, and whether any view regressed."""
+    lines = []
+    regressed = False
+    if baseline['courses'] != results['courses']:
+        lines.append(f"Baseline was seeded with {baseline['courses']} courses, this run with {results['courses']}.")
+    for name, view in results['views'].items():
+        before = baseline['views'].get(name)
+        if before is None:
+            lines.append(f"{name}: not in the baseline")
+            continue
+        worse = view['queries'] > before['queries'] or view['p95_ms'] > before['p95_ms'] * (1 + tolerance)
+        regressed |= worse
+        change = (view['p95_ms'] - before['p95_ms']) / before['p95_ms'] if before['p95_ms'] else 0
+        lines.append(
+            f"{name}: p95 {before['p95_ms']} -> {view['p95_ms']}ms ({change:+.0%}), "
+            f"queries {before['queries']} -> {view['queries']}{'  REGRESSED' if worse else ''}"
+        )
+    return lines, regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=description.splitlines()[0])
+    parser.add_argument('--courses', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=100, help="Timed requests per view.")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="Write the results as JSON to this file.")
+    parser.add_argument('--baseline', help="Compare with the results in this file, exit 1 on a regression.")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--json', action='store_true', help="Print results as JSON.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_database(os.path.join(tmp, 'bench.sqlite3'))
+        from django.conf import settings
+        from django.core.handlers.wsgi import WSGIHandler
+
+        from app import progress
+        from app.models import Course
+        from benchmarks.hot_views.seed import seed
+
+        # Keep the totals in process and the over-budget warnings out of the output.
+        settings.REQUEST_STATS_FLUSH_INTERVAL = float('inf')
+        logging.getLogger('app.querybudget').setLevel(logging.ERROR)
+
+        started = time.perf_counter()
+        rows = seed(args.courses, args.seed)
+        seed_seconds = time.perf_counter() - started
+        cookie = student_session(Course.objects.order_by('id')[:CART_COURSES])
+        handler = WSGIHandler()
+        results = {
+            'courses': args.courses,
+            'requests': args.requests,
+            'rows': rows,
+            'seed_seconds': round(seed_seconds, 2),
+            'views': {
+                name: bench_view(handler, name, url, cookie, args.requests) for name, url in hot_views()
+            },
+        }
+        results['peak_rss_mb'] = peak_rss_mb()
+        # detail_video buffered watch progress, write it while the database still exists.
+        progress.flush()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"Seeded {args.courses} courses in {results['seed_seconds']}s: "
+              + ', '.join(f'{count} {name}' for name, count in rows.items()))
+        for name, view in results['views'].items():
+            print(f"{name:>20}: p50 {view['p50_ms']}ms, p95 {view['p95_ms']}ms, p99 {view['p99_ms']}ms, "
+                  f"{view['queries']} queries, {view['db_ms']}ms db, {view['template_ms']}ms templates")
+        print(f"Peak RSS {results['peak_rss_mb']} MB")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            lines, regressed = compare(results, json.load(f), args.tolerance)
+        print('\n'.join(lines), file=sys.stderr if args.json else sys.stdout)
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""Bulk generator for a catalog of a given size.
+
+Every row is made with bulk_create in large batches inside one
+transaction, so the model save hooks do not run; what they would keep in
+step (comment roots, rating aggregates, tag counts, the search index) is
+set or rebuilt once at the end. The same seed gives the same data.
+"""
+import random
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import transaction
+
+BATCH_SIZE = 5000
+PARTS = 10
+TOPICS = ['Python', 'Django', 'JavaScript', 'Dasturlash', 'Dizayn', 'Marketing', 'Matematika', 'Ingliz tili']
+LEVELS = ['Beginner', 'Intermediate', 'Advanced']
+TAGS = ['backend', 'frontend', 'data', 'career', 'mobile', 'design']
+
+# Rows per course.
+LECTURES = 4
+VIDEOS_PER_LECTURE = 2
+STUDENTS = 10
+REVIEWS = 5
+THREADS = 3
+TAGS_PER_COURSE = 2
+# One user per this many courses, at least USERS_MIN, so ratings and comments come from many authors.
+COURSES_PER_USER = 2
+USERS_MIN = 50
+ORDER_ITEMS = 2
+
+
+def bulk(model, rows):
+    return model.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+
+
+@transaction.atomic
+def seed(courses, seed=1):
+    """Create ``courses`` courses and everything that hangs off them; return the row counts."""
+    from app.models import Comment, Course, CourseTag, Lecture, Part, Rating, Review, Tag, User, Video
+    from orders.models import Order, OrderItem
+
+    rng = random.Random(seed)
+    users = bulk(User, [
+        User(username=f'bench-user-{i}', user_type=User.TEACHER if i % 10 == 0 else User.STUDENT)
+        for i in range(max(USERS_MIN, courses // COURSES_PER_USER))
+    ])
+    teachers = [user for user in users if user.user_type == User.TEACHER]
+    parts = bulk(Part, [Part(name=f'Part {i}', slug=f'part-{i}') for i in range(PARTS)])
+    tags = bulk(Tag, [Tag(name=name, slug=name) for name in TAGS])
+
+    course_rows = bulk(Course, [
+        Course(
+            name=f'{rng.choice(TOPICS)} {rng.choice(LEVELS).lower()} {i}',
+            teacher=rng.choice(teachers),
+            image='media/bench.jpg',
+            body=f'{rng.choice(TOPICS)} course number {i}',
+            level=rng.choice(LEVELS),
+            price=rng.randrange(0, 200),
+            part=rng.choice(parts),
+        )
+        for i in range(courses)
+    ])
+
+    lectures = bulk(Lecture, [
+        Lecture(name=f'Lecture {n}', user=course.teacher, course=course)
+        for course in course_rows for n in range(LECTURES)
+    ])
+    videos = bulk(Video, [
+        Video(
+            name=f'{lecture.name}.{n}', user=lecture.user, course=lecture.course, file='videos/bench.mp4',
+            poster='posters/bench.jpg', duration=rng.randrange(60, 1800),
+        )
+        for lecture in lectures for n in range(VIDEOS_PER_LECTURE)
+    ])
+    bulk(Lecture.videos.through, [
+        Lecture.videos.through(lecture=lectures[i // VIDEOS_PER_LECTURE], video=video)
+        for i, video in enumerate(videos)
+    ])
+
+    enrolled = {course.id: rng.sample(users, STUDENTS) for course in course_rows}
+    bulk(Course.students.through, [
+        Course.students.through(course_id=course_id, user=user)
+        for course_id, students in enrolled.items() for user in students
+    ])
+    bulk(Course.like.through, [
+        Course.like.through(course_id=course_id, user=user)
+        for course_id, students in enrolled.items() for user in students[:STUDENTS // 2]
+    ])
+    bulk(CourseTag, [
+        CourseTag(course=course, tag=tag) for course in course_rows for tag in rng.sample(tags, TAGS_PER_COURSE)
+    ])
+
+    reviews = bulk(Review, [
+        Review(user=user, course_id=course_id, body=f'Review by {user.username}')
+        for course_id, students in enrolled.items() for user in students[:REVIEWS]
+    ])
+    bulk(Rating, [
+        Rating(user=review.user, course_id=review.course_id, review=review, rating=rng.randint(1, 5))
+        for review in reviews
+    ])
+
+    # A thread is a question, an answer to it and a reply to the answer.
+    questions = bulk(Comment, [
+        Comment(user=rng.choice(users), course=course, body=f'Question {n}')
+        for course in course_rows for n in range(THREADS)
+    ])
+    answers = bulk(Comment, [
+        Comment(user=rng.choice(users), course_id=q.course_id, body='Answer', parent=q, root=q) for q in questions
+    ])
+    bulk(Comment, [
+        Comment(user=rng.choice(users), course_id=a.course_id, body='Thanks', parent=a, root_id=a.root_id)
+        for a in answers
+    ])
+
+    orders = bulk(Order, [
+        Order(
+            first_name='Bench', last_name=f'Buyer {i}', email=f'buyer{i}@example.com', address='Street 1',
+            postal_code='100000', city='Tashkent', delivery='express', paid=i % 2 == 0,
+        )
+        for i in range(courses // 2)
+    ])
+    bulk(OrderItem, [
+        OrderItem(order=order, product=course, price=course.price)
+        for order in orders for course in rng.sample(course_rows, ORDER_ITEMS)
+    ])
+
+    Tag.recount()
+    call_command('reconcile_ratings', stdout=StringIO())
+    call_command('rebuild_search_index', stdout=StringIO())
+    return {
+        'users': len(users),
+        'courses': len(course_rows),
+        'lectures': len(lectures),
+        'videos': len(videos),
+        'reviews': len(reviews),
+        'comments': len(questions) * 3,
+        'orders': len(orders),
+    }
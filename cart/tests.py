@@ -1,3 +1,19 @@
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from app.models import Course, Part, User
+from app.testing import QueryBudgetMixin
+
+
+class CartQueryBudgetTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        teacher = User.objects.create_user(username='teacher', password='x')
+        part = Part.objects.create(name='Programming', slug='programming')
+        for i in range(3):
+            course = Course.objects.create(
+                name=f'Course {i}', teacher=teacher, body='', level='Beginner', price=10, part=part
+            )
+            self.client.post(reverse('cart:cart_add_net_quantity', args=[course.id]))
+
+    def test_cart_detail_stays_within_budget(self):
+        self.assertViewQueryBudget(reverse('cart:cart_detail'), 3)
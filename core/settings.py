@@ -48,6 +48,7 @@ MODELTRANSLATION_ENABLE_LOCALE = True
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'app.querybudget.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -71,6 +72,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'django.template.context_processors.request',
+                'app.context_processors.categories',
             ],
         },
     },
@@ -198,3 +200,61 @@ STATICFILES_DIRS = [BASE_DIR / 'static',]
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Responsive image derivatives are regenerated on demand, so the cache can be trimmed freely.
+IMAGE_DERIVATIVES_MAX_BYTES = 512 * 1024 * 1024
+
+# Chunked video uploads are assembled here before they become a Video.
+CHUNKED_UPLOAD_DIR = BASE_DIR / 'uploads'
+CHUNKED_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+CHUNKED_UPLOAD_MAX_SIZE = 10 * 1024 * 1024 * 1024
+# Unfinished uploads untouched for this many seconds are deleted with their part files, see expire_uploads.
+CHUNKED_UPLOAD_EXPIRE_AFTER = 24 * 60 * 60
+
+# Watch progress heartbeats are buffered per process and flushed in bulk, at least every PROGRESS_FLUSH_INTERVAL
+# seconds. Finished videos are written at once.
+PROGRESS_FLUSH_SIZE = 500
+PROGRESS_FLUSH_INTERVAL = 10
+
+# Evicts category lists orphaned by a version bump, see app/categories.py.
+CATEGORY_CACHE_TIMEOUT = 300
+
+# Course search, see app/search.py.
+SEARCH_BACKEND = 'app.search.SQLiteFTSBackend'
+SEARCH_MAX_RESULTS = 1000
+SEARCH_FACETS_CACHE_TIMEOUT = 60
+
+# Typeahead prefix index, see app/suggest.py.
+SUGGEST_INDEX_MAX_AGE = 300
+
+# Typo-tolerant course name index, see app/fuzzy.py.
+FUZZY_INDEX_MAX_AGE = 300
+
+# Course detail fragments and the category navigation are invalidated by versions that any process may bump,
+# the media worker included, so they need caches every process shares, see app/fragments.py and
+# app/categories.py. The file cache is shared on one host; use Redis or Memcached once web and worker processes
+# run on several. The timeouts also evict entries orphaned by a version bump, which the file cache would
+# otherwise keep until it culls.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'fragments',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'shared',
+    },
+}
+SHARED_CACHE_ALIAS = 'shared'
+FRAGMENT_CACHE_ALIAS = 'fragments'
+FRAGMENT_CACHE_TIMEOUT = 3600
+
+# Requests over any of these are logged with their repeated SQL, see app/querybudget.py. Entries per URL name
+# override 'default'; times are in milliseconds.
+REQUEST_BUDGETS = {
+    'default': {'queries': 20, 'db_ms': 100, 'template_ms': 200, 'view_ms': 500},
+}
+REQUEST_STATS_FLUSH_INTERVAL = 60
@@ -0,0 +1,156 @@
+/**
+ * Chunked, resumable video uploads.
+ *
+ * Markup: <input type="file" data-chunked-upload
+ *                data-init-url="..." data-chunk-url=".../0/" data-complete-url=".../0/complete/"
+ *                data-course-input="upload_course">
+ * The "0" in the chunk and complete URLs is replaced with the upload id, and
+ * data-course-input names the field holding the id of the course to upload to.
+ * An interrupted upload is resumed from the server's offset when the same
+ * file is picked again.
+ **/
+(function () {
+  'use strict';
+
+  var MAX_RETRIES = 5;
+
+  function csrfToken() {
+    var match = document.cookie.match(/(?:^|;\s*)csrftoken=([^;]+)/);
+    return match ? decodeURIComponent(match[1]) : '';
+  }
+
+  function uploadUrl(template, id) {
+    return template.replace(/\/0\//, '/' + id + '/');
+  }
+
+  function sha256Hex(buffer) {
+    return crypto.subtle.digest('SHA-256', buffer).then(function (digest) {
+      return Array.prototype.map.call(new Uint8Array(digest), function (b) {
+        return ('0' + b.toString(16)).slice(-2);
+      }).join('');
+    });
+  }
+
+  function request(url, options) {
+    options.headers = Object.assign({'X-CSRFToken': csrfToken()}, options.headers || {});
+    options.credentials = 'same-origin';
+    return fetch(url, options).then(function (response) {
+      return response.json().then(function (data) {
+        data.status = response.status;
+        return data;
+      });
+    });
+  }
+
+  function wait(retries) {
+    return new Promise(function (resolve) {
+      setTimeout(resolve, 1000 * retries);
+    });
+  }
+
+  function setStatus(input, text) {
+    var status = input.parentNode.querySelector('.chunked-upload-status');
+    if (!status) {
+      status = document.createElement('div');
+      status.className = 'chunked-upload-status small mt-2';
+      input.parentNode.appendChild(status);
+    }
+    status.textContent = text;
+  }
+
+  function start(input, file) {
+    var key = 'chunked-upload:' + file.name + ':' + file.size + ':' + file.lastModified;
+    var savedId = localStorage.getItem(key);
+    var courseInput = document.querySelector('[name="' + (input.dataset.courseInput || 'course_id') + '"]');
+    if (!courseInput || !courseInput.value) {
+      setStatus(input, 'Choose a course first.');
+      input.value = '';
+      return Promise.resolve();
+    }
+
+    var ready = savedId
+      ? request(uploadUrl(input.dataset.chunkUrl, savedId), {method: 'GET'}).then(function (data) {
+          return data.status === 200 ? {id: savedId, offset: data.offset} : null;
+        })
+      : Promise.resolve(null);
+
+    return ready.then(function (resume) {
+      if (resume) {
+        return resume;
+      }
+      var body = new FormData();
+      body.append('course_id', courseInput.value);
+      body.append('filename', file.name);
+      body.append('size', file.size);
+      return request(input.dataset.initUrl, {method: 'POST', body: body}).then(function (data) {
+        if (data.status !== 201) {
+          throw new Error(data.error);
+        }
+        localStorage.setItem(key, data.id);
+        return data;
+      });
+    }).then(function (upload) {
+      var chunkSize = upload.chunk_size || 8 * 1024 * 1024;
+      var retries = 0;
+
+      function next(offset) {
+        setStatus(input, 'Uploading ' + Math.floor(offset * 100 / file.size) + '%');
+        if (offset >= file.size) {
+          return request(uploadUrl(input.dataset.completeUrl, upload.id), {method: 'POST'}).then(function (data) {
+            if (data.status !== 201) {
+              throw new Error(data.error);
+            }
+            localStorage.removeItem(key);
+            input.value = '';
+            setStatus(input, 'Uploaded, processing video.');
+            return data;
+          });
+        }
+        var chunk = file.slice(offset, offset + chunkSize);
+        return chunk.arrayBuffer().then(function (buffer) {
+          return sha256Hex(buffer).then(function (checksum) {
+            return request(uploadUrl(input.dataset.chunkUrl, upload.id), {
+              method: 'POST',
+              headers: {'Upload-Offset': String(offset), 'Upload-Checksum': checksum, 'Content-Type': 'application/octet-stream'},
+              body: buffer,
+            });
+          });
+        }).then(function (data) {
+          if (data.status === 200) {
+            retries = 0;
+            return next(data.offset);
+          }
+          if (++retries > MAX_RETRIES) {
+            throw new Error(data.error);
+          }
+          // 409 means another request is still writing this chunk; give it time before asking again.
+          return wait(retries).then(function () {
+            return next(data.offset);
+          });
+        }, function () {
+          // Network error: ask the server where to continue from.
+          if (++retries > MAX_RETRIES) {
+            throw new Error('Upload interrupted.');
+          }
+          return wait(retries).then(function () {
+            return request(uploadUrl(input.dataset.chunkUrl, upload.id), {method: 'GET'});
+          }).then(function (data) {
+            return next(data.offset);
+          });
+        });
+      }
+
+      return next(upload.offset || 0);
+    }).catch(function (error) {
+      setStatus(input, 'Upload failed: ' + error.message);
+    });
+  }
+
+  document.querySelectorAll('input[type="file"][data-chunked-upload]').forEach(function (input) {
+    input.addEventListener('change', function () {
+      if (input.files.length && window.crypto && crypto.subtle) {
+        start(input, input.files[0]);
+      }
+    });
+  });
+})();
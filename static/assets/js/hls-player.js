@@ -0,0 +1,30 @@
+/**
+ * HLS playback.
+ *
+ * Plays the bitrate ladder of every <video data-hls-url="..."> through
+ * hls.js where the browser has Media Source Extensions but no native HLS.
+ * hls.js is vendored as assets/vendor/hls/hls.min.js and only loaded when
+ * that file is present, see the hls_js template tag.
+ * Safari plays the playlist <source> itself; browsers with neither keep the
+ * MP4 <source>.
+ **/
+(function () {
+  'use strict';
+
+  document.querySelectorAll('video[data-hls-url]').forEach(function (video) {
+    if (video.canPlayType('application/vnd.apple.mpegurl') || !window.Hls || !Hls.isSupported()) {
+      return;
+    }
+    var hls = new Hls();
+    hls.on(Hls.Events.ERROR, function (event, data) {
+      if (data.fatal) {
+        // Fall back to the MP4 <source>.
+        hls.destroy();
+        video.removeAttribute('src');
+        video.load();
+      }
+    });
+    hls.loadSource(video.dataset.hlsUrl);
+    hls.attachMedia(video);
+  });
+})();
@@ -0,0 +1,65 @@
+/**
+ * Lazy-loaded lists.
+ *
+ * A <div data-lazy-list data-next-url="..."> holds the first page of a list.
+ * When its end scrolls into view, the next page is fetched from the URL as
+ * JSON ({html, next_url}), appended, and the URL moves on, until next_url
+ * is null. A failed fetch leaves the URL where it was and shows a message
+ * with a button to try again; scrolling away and back retries as well.
+ **/
+(function () {
+  'use strict';
+
+  document.querySelectorAll('[data-lazy-list][data-next-url]').forEach(function (list) {
+    var sentinel = document.createElement('div');
+    var loading = false;
+    list.after(sentinel);
+
+    function observeAgain() {
+      // Observing again reports the sentinel if it is still in view.
+      observer.unobserve(sentinel);
+      observer.observe(sentinel);
+    }
+
+    function showError() {
+      var message = document.createElement('p');
+      var retry = document.createElement('button');
+      message.className = 'text-center small text-danger my-3';
+      message.textContent = 'Could not load more. ';
+      retry.type = 'button';
+      retry.className = 'btn btn-link btn-sm p-0 align-baseline';
+      retry.textContent = 'Try again';
+      retry.addEventListener('click', observeAgain);
+      message.appendChild(retry);
+      sentinel.replaceChildren(message);
+    }
+
+    var observer = new IntersectionObserver(function (entries) {
+      if (loading || !entries.some(function (entry) { return entry.isIntersecting; })) {
+        return;
+      }
+      loading = true;
+      sentinel.replaceChildren();
+      fetch(list.dataset.nextUrl, {credentials: 'same-origin', headers: {'Accept': 'application/json'}})
+        .then(function (response) {
+          if (!response.ok) {
+            throw new Error(response.status + ' ' + response.statusText);
+          }
+          return response.json();
+        })
+        .then(function (data) {
+          list.insertAdjacentHTML('beforeend', data.html);
+          if (data.next_url) {
+            list.dataset.nextUrl = data.next_url;
+            // A short page may leave the sentinel in view.
+            observeAgain();
+          } else {
+            observer.disconnect();
+            sentinel.remove();
+          }
+        }, showError)
+        .finally(function () { loading = false; });
+    }, {rootMargin: '200px'});
+    observer.observe(sentinel);
+  });
+})();
@@ -0,0 +1,49 @@
+/**
+ * Watch progress heartbeats.
+ *
+ * Sends the playback position of every <video data-progress-url="..."> while
+ * it plays, and once more on pause, end and page hide. The server buffers
+ * these and writes them in batches, so a short interval is cheap.
+ **/
+(function () {
+  'use strict';
+
+  var INTERVAL = 15000;
+
+  function csrfToken() {
+    var match = document.cookie.match(/(?:^|;\s*)csrftoken=([^;]+)/);
+    return match ? decodeURIComponent(match[1]) : '';
+  }
+
+  function send(video, completed) {
+    var body = new FormData();
+    body.append('csrfmiddlewaretoken', csrfToken());
+    body.append('position', video.currentTime.toFixed(1));
+    if (completed) {
+      body.append('completed', '1');
+    }
+    fetch(video.dataset.progressUrl, {method: 'POST', body: body, credentials: 'same-origin', keepalive: true});
+  }
+
+  document.querySelectorAll('video[data-progress-url]').forEach(function (video) {
+    var timer = null;
+
+    video.addEventListener('play', function () {
+      clearInterval(timer);
+      timer = setInterval(function () { send(video, false); }, INTERVAL);
+    });
+    video.addEventListener('pause', function () {
+      clearInterval(timer);
+      send(video, false);
+    });
+    video.addEventListener('ended', function () {
+      clearInterval(timer);
+      send(video, true);
+    });
+    window.addEventListener('pagehide', function () {
+      if (!video.paused) {
+        send(video, false);
+      }
+    });
+  });
+})();